@@ -0,0 +1,193 @@
+"""
+请求合并（single-flight）
+
+热点通知发布后，大量用户会在几秒内发送相同的查询，每个请求各自执行检索、重排和LLM生成。
+这里按"规范化查询 + 参数"生成键，同一时刻只执行一次计算：
+
+    - 第一个请求（leader）启动计算，计算在独立任务中运行，leader断开不影响其他等待者
+    - 并发的相同请求（follower）等待在途计算的结果，等待超过 max_wait 后自行计算
+    - 流式结果通过 SharedStream 广播：新加入的订阅者先回放已产出的事件再跟随后续事件，
+      所有订阅者都断开时中止上游生成；流的总时长由生产者自身的超时约束
+
+计算结束后键即被移除，合并只发生在并发请求之间，不缓存结果。
+返回给多个请求的是同一个对象，调用方只能读取，需要修改时先复制。
+
+配置项（services.app.coalesce.*）：
+    enabled    是否启用，默认True
+    max_wait   follower等待在途计算的最长时间（秒），默认30
+"""
+import asyncio
+import json
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+from config import Config
+from core.utils.logger import register_logger
+
+logger = register_logger('api.common.coalesce')
+config = Config()
+
+T = TypeVar("T")
+
+
+def normalize_query(query: str) -> str:
+    """规范化查询：合并空白、去除首尾空白并转为小写"""
+    return " ".join((query or "").split()).lower()
+
+
+def make_key(query: str, **params: Any) -> str:
+    """由规范化查询和参数生成合并键"""
+    return json.dumps([normalize_query(query), params], sort_keys=True, ensure_ascii=False, default=str)
+
+
+def _consume_exception(task: asyncio.Task):
+    # 所有等待者都已离开时避免"exception was never retrieved"警告
+    if not task.cancelled():
+        task.exception()
+
+
+class SharedStream:
+    """把一个异步迭代器的输出广播给多个订阅者"""
+
+    def __init__(self, source: AsyncIterator[Any], on_close: Callable[[], None]):
+        self._items: List[Any] = []
+        self._done = False
+        self._changed = asyncio.Event()
+        self._subscribers = 0
+        self._on_close = on_close
+        self._task = asyncio.ensure_future(self._pump(source))
+        self._task.add_done_callback(_consume_exception)
+
+    @property
+    def done(self) -> bool:
+        return self._done
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def _pump(self, source: AsyncIterator[Any]):
+        try:
+            async for item in source:
+                self._items.append(item)
+                self._notify()
+        finally:
+            self._done = True
+            self._notify()
+            self._on_close()
+            aclose = getattr(source, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    async def subscribe(self) -> AsyncIterator[Any]:
+        """从头回放并跟随后续输出"""
+        self._subscribers += 1
+        index = 0
+        try:
+            while True:
+                if index < len(self._items):
+                    item = self._items[index]
+                    index += 1
+                    yield item
+                    continue
+                if self._done:
+                    return
+                await self._changed.wait()
+        finally:
+            self._subscribers -= 1
+            if self._subscribers == 0 and not self._task.done():
+                logger.debug("共享流的所有订阅者均已断开，中止上游")
+                self._task.cancel()
+
+
+class SingleFlight:
+    """按键合并并发的相同请求"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._streams: Dict[str, SharedStream] = {}
+        self.stats: Dict[str, int] = {"requests": 0, "leaders": 0, "followers": 0, "timeouts": 0}
+
+    def _release(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]], max_wait: Optional[float] = None) -> T:
+        """
+        执行或加入一次计算
+
+        Args:
+            key: 合并键
+            fn: 无参协程函数，仅在没有在途计算时调用
+            max_wait: follower的最长等待时间（秒），默认取配置 services.app.coalesce.max_wait
+        """
+        if not config.get("services.app.coalesce.enabled", True):
+            return await fn()
+
+        self.stats["requests"] += 1
+        task = self._inflight.get(key)
+        if task is not None:
+            self.stats["followers"] += 1
+            if max_wait is None:
+                max_wait = config.get("services.app.coalesce.max_wait", 30)
+            try:
+                return await asyncio.wait_for(asyncio.shield(task), timeout=max_wait)
+            except asyncio.TimeoutError:
+                self.stats["timeouts"] += 1
+                logger.warning(f"[{self.name}] 等待在途计算超过 {max_wait} 秒，改为自行计算")
+                return await fn()
+
+        self.stats["leaders"] += 1
+        task = asyncio.ensure_future(fn())
+        self._inflight[key] = task
+        task.add_done_callback(lambda t: self._release(key, t))
+        task.add_done_callback(_consume_exception)
+        return await asyncio.shield(task)
+
+    def stream(self, key: str, factory: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        """
+        订阅或创建一个共享流
+
+        Args:
+            key: 合并键
+            factory: 无参函数，返回上游异步迭代器，仅在没有在途流时调用
+        """
+        if not config.get("services.app.coalesce.enabled", True):
+            return factory()
+
+        self.stats["requests"] += 1
+        shared = self._streams.get(key)
+        if shared is not None and not shared.done:
+            self.stats["followers"] += 1
+        else:
+            self.stats["leaders"] += 1
+
+            def on_close():
+                if self._streams.get(key) is shared:
+                    del self._streams[key]
+
+            shared = SharedStream(factory(), on_close)
+            self._streams[key] = shared
+        return shared.subscribe()
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self.stats)
+        stats["inflight"] = len(self._inflight) + len(self._streams)
+        stats["coalescing_ratio"] = round(stats["followers"] / stats["requests"], 4) if stats["requests"] else 0.0
+        return stats
+
+
+_flights: Dict[str, SingleFlight] = {}
+
+
+def get_single_flight(name: str) -> SingleFlight:
+    """获取指定端点的合并器"""
+    flight = _flights.get(name)
+    if flight is None:
+        flight = _flights[name] = SingleFlight(name)
+    return flight
+
+
+def get_coalescing_stats() -> Dict[str, Any]:
+    """获取各端点的合并统计，coalescing_ratio 为被合并的请求占比"""
+    return {name: flight.get_stats() for name, flight in _flights.items()}
@@ -1,9 +1,32 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
+import hmac
 import time
+from typing import Optional
+from config import Config
 from etl.load.db_pool_manager import db_pool
 from api.models.common import Response
 
 router = APIRouter()
+config = Config()
+
+_LOCAL_HOSTS = {"127.0.0.1", "::1", "localhost"}
+
+
+def _admin_denied(request: Request) -> Optional[Response]:
+    """
+    管理操作的访问控制：配置了 services.app.admin_token 时要求请求头 X-Admin-Token 匹配，
+    否则只允许本机访问（部署在反向代理后时代理需自行限制 /admin 路径）
+    """
+    token = config.get("services.app.admin_token")
+    if token:
+        provided = request.headers.get("X-Admin-Token", "")
+        if hmac.compare_digest(provided.encode(), str(token).encode()):
+            return None
+        return Response.forbidden(message="管理令牌无效")
+    client_host = request.client.host if request.client else None
+    if client_host in _LOCAL_HOSTS:
+        return None
+    return Response.forbidden(message="该操作仅允许本机访问")
 
 @router.get("/dbpool/status", summary="获取数据库连接池状态")
 async def get_db_pool_status():
@@ -22,4 +45,66 @@ async def get_db_pool_status():
             "timestamp": time.time()
         })
     except Exception as e:
-        return Response.error(message=f"获取数据库连接池状态失败: {str(e)}")
\ No newline at end of file
+        return Response.error(message=f"获取数据库连接池状态失败: {str(e)}")
+
+@router.get("/es/status", summary="获取Elasticsearch客户端状态")
+async def get_es_client_status_endpoint():
+    """获取共享Elasticsearch客户端的健康状态和请求统计。"""
+    from etl.retrieval.es_client import check_es_health, get_es_client_status
+    try:
+        await check_es_health()
+        return Response.success(data=get_es_client_status())
+    except Exception as e:
+        return Response.error(message=f"获取Elasticsearch客户端状态失败: {str(e)}")
+
+@router.get("/coze/status", summary="获取Coze实例池状态")
+async def get_coze_pool_status_endpoint():
+    """获取共享CozeAgent实例和HTTP连接池的状态。"""
+    from core.agent.coze.agent_pool import get_coze_pool_status
+    try:
+        return Response.success(data=get_coze_pool_status())
+    except Exception as e:
+        return Response.error(message=f"获取Coze实例池状态失败: {str(e)}")
+
+@router.get("/coalesce/status", summary="获取请求合并统计")
+async def get_coalescing_status_endpoint():
+    """获取各端点的请求合并统计，coalescing_ratio 为合并到在途计算的请求占比。"""
+    from api.common.coalesce import get_coalescing_stats
+    try:
+        return Response.success(data=get_coalescing_stats())
+    except Exception as e:
+        return Response.error(message=f"获取请求合并统计失败: {str(e)}")
+
+@router.get("/rag/status", summary="获取共享RAG管道状态")
+async def get_rag_pipeline_status_endpoint():
+    """获取当前进程中共享RAG管道的加载状态。"""
+    from etl.rag.pipeline_manager import get_rag_pipeline_status
+    try:
+        return Response.success(data=get_rag_pipeline_status())
+    except Exception as e:
+        return Response.error(message=f"获取RAG管道状态失败: {str(e)}")
+
+
+@router.post("/rag/reload", summary="热替换共享RAG管道")
+async def reload_rag_pipeline_endpoint(request: Request):
+    """
+    索引重建后重新加载RAG管道，新实例就绪前旧实例继续服务。
+
+    处理请求的worker立即重新加载并返回其状态；其他worker通过重载标记
+    在各自的下一个RAG请求时于后台热替换。
+    """
+    denied = _admin_denied(request)
+    if denied is not None:
+        return denied
+    from etl.rag.pipeline_manager import (
+        reload_rag_pipeline, request_rag_pipeline_reload, get_rag_pipeline_status
+    )
+    try:
+        request_rag_pipeline_reload()
+        await reload_rag_pipeline()
+        status = get_rag_pipeline_status()
+        if status.get("last_error"):
+            return Response.error(message=f"RAG管道重新加载失败: {status['last_error']}")
+        return Response.success(data=status)
+    except Exception as e:
+        return Response.error(message=f"RAG管道重新加载失败: {str(e)}")
@@ -11,7 +11,9 @@ from typing import List, Dict, Any, Optional, Union
 from fastapi import APIRouter
 from api.models.common import Response, Request, validate_params
 from api.routes.knowledge.search import _elasticsearch_search_internal
-from core.agent.coze.coze_agent import CozeAgent
+from api.common.coalesce import get_single_flight, make_key
+from core.agent.coze.agent_pool import get_coze_agent
+from core.agent.coze.coze_agent import parse_follow_up
 from fastapi.responses import StreamingResponse
 from core.utils.logger import register_logger
 import urllib.parse
@@ -33,19 +35,13 @@ router = APIRouter()
 async def rewrite_query(query: str, bot_tag = "queryEnhance") -> str:
     """使用Coze改写bot改写用户查询"""
     try:
-        rewrite_agent = CozeAgent(tag = bot_tag)
+        rewrite_agent = get_coze_agent(tag=bot_tag)
         prompt = query
         start_time = time.time()
         
         try:
-            # 使用异步超时控制，最多等待30秒
-            async def _rewrite_with_timeout():
-                # 创建可取消的任务
-                loop = asyncio.get_event_loop()
-                response = await loop.run_in_executor(None, lambda: rewrite_agent.chat_with_new_conversation(prompt, stream=False))
-                return response
-                
-            response = await asyncio.wait_for(_rewrite_with_timeout(), timeout=30.0)
+            # 使用异步超时控制，最多等待30秒；超时取消时上游对话随之中止
+            response = await asyncio.wait_for(rewrite_agent.achat(prompt), timeout=30.0)
             
         except asyncio.TimeoutError:
             logger.warning(f"改写请求超时（>30秒），返回原始查询")
@@ -61,42 +57,37 @@ async def rewrite_query(query: str, bot_tag = "queryEnhance") -> str:
         logger.error(f"查询改写失败: {str(e)}")
         return query
 
+def build_rag_prompt(query: str, sources: List[Any]) -> str:
+    """将检索结果拼接为RAG bot的prompt"""
+    sources_text = ""
+    for i, source in enumerate(sources):
+        title = source.get('title', '无标题')
+        content = source.get('content', '') # 使用正确的 'content' 字段
+        
+        # 构建单条source的文本，确保换行正确
+        source_item_text = f"[{i+1}] 标题: {title}\n内容: {content}\n\n"
+        sources_text += source_item_text
+        
+    # 如果sources_text为空，可能需要一个提示
+    if not sources_text.strip():
+        sources_text = "没有找到相关的参考资料。"
+
+    return f"用户问题：{query}\n\n参考资料：\n{sources_text}"
+
 async def generate_answer(query: str, enhanced_query: str, sources: List[Any], bot_tag = "answerGenerate") -> Dict[str, Any]:
     """使用Coze RAG bot生成答案"""
     try:
-        rag_agent = CozeAgent(tag = bot_tag)
-        
-        sources_text = ""
-        for i, source in enumerate(sources):
-            title = source.get('title', '无标题')
-            content = source.get('content', '') # 使用正确的 'content' 字段
-            
-            # 构建单条source的文本，确保换行正确
-            source_item_text = f"[{i+1}] 标题: {title}\n内容: {content}\n\n"
-            sources_text += source_item_text
-            
-        # 如果sources_text为空，可能需要一个提示
-        if not sources_text.strip():
-            sources_text = "没有找到相关的参考资料。"
-
-        prompt = f"用户问题：{query}\n\n参考资料：\n{sources_text}"
+        rag_agent = get_coze_agent(tag=bot_tag)
+        prompt = build_rag_prompt(query, sources)
         
         logger.debug(f"发送给RAG Agent的最终prompt (部分):\n{prompt[:1000]}...")
         
         start_time = time.time()
         try:
-            async def _generate_with_timeout():
-                loop = asyncio.get_event_loop()
-                
-                # 使用chat_with_new_conversation方法直接获取回答和建议问题
-                response = await loop.run_in_executor(
-                    None, 
-                    lambda: rag_agent.chat_with_new_conversation(prompt, stream=False, openid=f"rag_user_{int(time.time())}")
-                )
-                
-                return response
-                
-            response = await asyncio.wait_for(_generate_with_timeout(), timeout=60.0)
+            response = await asyncio.wait_for(
+                rag_agent.achat(prompt, openid=f"rag_user_{int(time.time())}"),
+                timeout=60.0
+            )
             
         except asyncio.TimeoutError:
             logger.warning(f"生成回答请求超时（>60秒）")
@@ -130,87 +121,196 @@ async def generate_answer(query: str, enhanced_query: str, sources: List[Any], b
             "suggested_questions": []
         }
 
-def get_stream_generator(result: Dict[str, Any]):
-    """生成流式响应的生成器"""
-    def stream_generator():
-        try:
-            
-            yield f"data: {json.dumps({'type': 'query', 'original': result['original_query'], 'rewritten': result['rewritten_query']})}\n\n"
+def _sse(payload: Dict[str, Any]) -> str:
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
 
-            response_text = result["response"]
-            chunk_size = 20
-            
-            # 用于记录所有响应块
-            all_chunks = []
-            
-            for i in range(0, len(response_text), chunk_size):
-                chunk = response_text[i:i+chunk_size]
-                all_chunks.append(chunk)
-                yield f"data: {json.dumps({'type': 'content', 'chunk': chunk})}\n\n"
-                time.sleep(0.05)
-                
-
-            # 转换sources为可序列化的格式
-            sources_data = []
-            for source in result.get('sources', []):
-                try:
-                    if isinstance(source, bytes):
-                        # 如果是字节，先解码
-                        source_str = source.decode('utf-8')
-                        source_dict = json.loads(source_str)
-                        sources_data.append(source_dict)
-                    elif hasattr(source, 'dict'):
-                        # 如果是Pydantic模型
-                        source_dict = source.dict()
-                        # 处理日期时间字段
-                        for key, value in source_dict.items():
-                            if isinstance(value, (datetime.datetime, datetime.date)):
-                                source_dict[key] = value.isoformat()
-                        sources_data.append(source_dict)
-                    elif isinstance(source, dict):
-                        # 如果已经是字典，处理日期时间字段
-                        source_dict = {}
-                        for key, value in source.items():
-                            if isinstance(value, (datetime.datetime, datetime.date)):
-                                source_dict[key] = value.isoformat()
-                            else:
-                                source_dict[key] = value
-                        sources_data.append(source_dict)
+def _serialize_sources(sources: List[Any]) -> List[Dict[str, Any]]:
+    """转换sources为可序列化的格式"""
+    sources_data = []
+    for source in sources:
+        try:
+            if isinstance(source, bytes):
+                # 如果是字节，先解码
+                source_str = source.decode('utf-8')
+                source_dict = json.loads(source_str)
+                sources_data.append(source_dict)
+            elif hasattr(source, 'dict'):
+                # 如果是Pydantic模型
+                source_dict = source.dict()
+                # 处理日期时间字段
+                for key, value in source_dict.items():
+                    if isinstance(value, (datetime.datetime, datetime.date)):
+                        source_dict[key] = value.isoformat()
+                sources_data.append(source_dict)
+            elif isinstance(source, dict):
+                # 如果已经是字典，处理日期时间字段
+                source_dict = {}
+                for key, value in source.items():
+                    if isinstance(value, (datetime.datetime, datetime.date)):
+                        source_dict[key] = value.isoformat()
                     else:
-                        # 其他情况，尝试转换为字典
-                        logger.warning(f"未知的source类型: {type(source)}")
-                        # 尝试提取属性
-                        source_dict = {
-                            'title': getattr(source, 'title', '未知标题'),
-                            'content': getattr(source, 'content', ''),
-                            'author': getattr(source, 'author', '未知作者'),
-                            'platform': getattr(source, 'platform', '未知平台')
-                        }
-                        sources_data.append(source_dict)
-                except Exception as e:
-                    logger.error(f"处理source失败: {str(e)}")
-                    # 添加一个占位源
-                    sources_data.append({
-                        'title': '数据处理错误',
-                        'content': f'无法处理此来源: {str(e)}',
-                        'author': '系统',
-                        'platform': '未知'
-                    })
-                    
-            yield f"data: {json.dumps({'type': 'sources', 'sources': sources_data})}\n\n"
-            
-            if result.get("suggested_questions"):
-                logger.debug(f"流式响应包含建议问题: {result['suggested_questions']}")
-                yield f"data: {json.dumps({'type': 'suggestions', 'suggestions': result['suggested_questions']})}\n\n"
-                
-            yield f"data: {json.dumps({'type': 'end'})}\n\n"
-            logger.debug(f"流式响应结束")
+                        source_dict[key] = value
+                sources_data.append(source_dict)
+            else:
+                # 其他情况，尝试转换为字典
+                logger.warning(f"未知的source类型: {type(source)}")
+                # 尝试提取属性
+                source_dict = {
+                    'title': getattr(source, 'title', '未知标题'),
+                    'content': getattr(source, 'content', ''),
+                    'author': getattr(source, 'author', '未知作者'),
+                    'platform': getattr(source, 'platform', '未知平台')
+                }
+                sources_data.append(source_dict)
         except Exception as e:
-            logger.error(f"流式生成失败: {str(e)}")
-            yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
-            yield f"data: {json.dumps({'type': 'end'})}\n\n"
+            logger.error(f"处理source失败: {str(e)}")
+            # 添加一个占位源
+            sources_data.append({
+                'title': '数据处理错误',
+                'content': f'无法处理此来源: {str(e)}',
+                'author': '系统',
+                'platform': '未知'
+            })
+    return sources_data
+
+async def stream_rag_events(request: Optional[Request], query: str, enhanced_query: str,
+                            sources: List[Dict[str, Any]], openid: str,
+                            bot_tag: str = "answerGenerate", timeout: float = 60.0):
+    """SSE事件流：先发送查询和检索结果，再逐个转发LLM的增量输出
     
-    return stream_generator
+    客户端断开时生成器被关闭，CozeAgent.astream_chat 随之中止上游生成。
+    request 为None时（多个请求共享的流）不检查断开，由订阅者各自检查。
+    """
+    start_time = time.time()
+    yield _sse({'type': 'query', 'original': query, 'rewritten': enhanced_query})
+    yield _sse({'type': 'sources', 'sources': _serialize_sources(sources)})
+
+    upstream = None
+    suggestions: List[str] = []
+    # 缓冲开头几个字符，去掉"回答："前缀
+    pending = ""
+    prefix_checked = False
+    chunk_count = 0
+    last_disconnect_check = time.monotonic()
+    try:
+        rag_agent = get_coze_agent(tag=bot_tag)
+        upstream = rag_agent.astream_chat(
+            build_rag_prompt(query, sources), openid=f"rag_user_{openid}"
+        )
+        deadline = start_time + timeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise asyncio.TimeoutError()
+            try:
+                event = await asyncio.wait_for(upstream.__anext__(), timeout=remaining)
+            except StopAsyncIteration:
+                break
+
+            if event["type"] == "follow_up":
+                suggestions.extend(parse_follow_up(event["content"]))
+                continue
+
+            chunk = event["content"]
+            if not prefix_checked:
+                pending += chunk
+                if len(pending) < 3:
+                    continue
+                prefix_checked = True
+                if pending.startswith("回答：") or pending.startswith("回答:"):
+                    pending = pending[3:].lstrip()
+                chunk, pending = pending, ""
+                if not chunk:
+                    continue
+
+            chunk_count += 1
+            if chunk_count == 1:
+                logger.info(f"RAG流式首个内容块耗时: {time.time() - start_time:.2f}秒")
+            yield _sse({'type': 'content', 'chunk': chunk})
+
+            # 定期检查客户端是否已断开
+            if request is not None and time.monotonic() - last_disconnect_check > 1.0:
+                last_disconnect_check = time.monotonic()
+                if await request.is_disconnected():
+                    logger.info("客户端已断开，停止RAG流式生成")
+                    return
+
+        if pending:
+            yield _sse({'type': 'content', 'chunk': pending})
+        if suggestions:
+            logger.debug(f"流式响应包含建议问题: {suggestions}")
+            yield _sse({'type': 'suggestions', 'suggestions': suggestions})
+        yield _sse({'type': 'end'})
+        logger.debug(f"流式响应结束，耗时: {time.time() - start_time:.2f}秒")
+    except asyncio.TimeoutError:
+        logger.warning(f"生成回答请求超时（>{timeout:.0f}秒）")
+        yield _sse({'type': 'error', 'message': '抱歉，回答生成超时，请稍后再试。'})
+        yield _sse({'type': 'end'})
+    except Exception as e:
+        logger.error(f"流式生成失败: {str(e)}")
+        yield _sse({'type': 'error', 'message': str(e)})
+        yield _sse({'type': 'end'})
+    finally:
+        if upstream is not None:
+            await upstream.aclose()
+
+async def follow_until_disconnected(request: Request, events):
+    """转发共享流的事件，客户端断开时停止订阅"""
+    last_disconnect_check = time.monotonic()
+    try:
+        async for event in events:
+            yield event
+            if time.monotonic() - last_disconnect_check > 1.0:
+                last_disconnect_check = time.monotonic()
+                if await request.is_disconnected():
+                    logger.info("客户端已断开，退出共享RAG流")
+                    return
+    finally:
+        await events.aclose()
+
+async def retrieve_sources(query: str, platform: Optional[str], max_results: int,
+                           rewrite_query_enabled: bool) -> Dict[str, Any]:
+    """查询改写（可选）并从Elasticsearch检索来源文档"""
+    # 1. 根据参数决定是否查询改写
+    if rewrite_query_enabled:
+        logger.debug(f"开始改写查询: {query}")
+        enhanced_query = await rewrite_query(query)
+        logger.debug(f"查询改写完成: {query} -> {enhanced_query}")
+    else:
+        enhanced_query = query
+        logger.debug(f"查询改写已禁用，使用原始查询: {query}")
+        
+    # 2. 调用共享的Elasticsearch检索函数
+    logger.debug(f"开始使用Elasticsearch检索: query='{query}', enhanced_query='{enhanced_query}'")
+    response = await _elasticsearch_search_internal(
+        query=query,
+        enhanced_query=enhanced_query,
+        platform=platform,
+        size=max_results
+    )
+
+    retrieved_docs = response.get('hits', {}).get('hits', [])
+    logger.debug(f"ES检索到 {len(retrieved_docs)} 条相关文档")
+    
+    # 3. 处理检索结果
+    sources = []
+    for hit in retrieved_docs:
+        source_data = hit['_source']
+        content_preview = source_data.get('content', '')
+        if len(content_preview) > 2000:
+            content_preview = content_preview[:2000]
+
+        sources.append({
+            "title": source_data.get('title', '无标题'),
+            "content": content_preview,
+            "author": source_data.get('author', ''),
+            "platform": source_data.get('platform', ''),
+            "original_url": source_data.get('original_url', ''),
+            "relevance": hit['_score']
+        })
+
+    logger.debug(f"从 Elasticsearch 获取到 {len(sources)} 条搜索结果")
+    return {"enhanced_query": enhanced_query, "sources": sources}
 
 @router.post("/rag")
 async def rag_endpoint(request: Request):
@@ -234,45 +334,13 @@ async def rag_endpoint(request: Request):
         
         logger.info(f"RAG请求开始: query='{query}', stream={request_stream}, rewrite={rewrite_query_enabled}")
 
-        # 1. 根据参数决定是否查询改写
-        if rewrite_query_enabled:
-            logger.debug(f"开始改写查询: {query}")
-            enhanced_query = await rewrite_query(query)
-            logger.debug(f"查询改写完成: {query} -> {enhanced_query}")
-        else:
-            enhanced_query = query
-            logger.debug(f"查询改写已禁用，使用原始查询: {query}")
-            
-        # 2. 调用共享的Elasticsearch检索函数
-        logger.debug(f"开始使用Elasticsearch检索: query='{query}', enhanced_query='{enhanced_query}'")
-        response = await _elasticsearch_search_internal(
-            query=query,
-            enhanced_query=enhanced_query,
-            platform=platform,
-            size=max_results
+        # 1-3. 查询改写与检索，并发的相同查询只执行一次（与用户无关，键中不含openid）
+        coalesce_key = make_key(query, platform=platform, max_results=max_results, rewrite=bool(rewrite_query_enabled))
+        retrieval = await get_single_flight("agent.rag.retrieve").do(
+            coalesce_key,
+            lambda: retrieve_sources(query, platform, max_results, rewrite_query_enabled)
         )
-
-        retrieved_docs = response.get('hits', {}).get('hits', [])
-        logger.debug(f"ES检索到 {len(retrieved_docs)} 条相关文档")
-        
-        # 3. 处理检索结果
-        sources = []
-        for hit in retrieved_docs:
-            source_data = hit['_source']
-            content_preview = source_data.get('content', '')
-            if len(content_preview) > 2000:
-                content_preview = content_preview[:2000]
-
-            sources.append({
-                "title": source_data.get('title', '无标题'),
-                "content": content_preview,
-                "author": source_data.get('author', ''),
-                "platform": source_data.get('platform', ''),
-                "original_url": source_data.get('original_url', ''),
-                "relevance": hit['_score']
-            })
-
-        logger.debug(f"从 Elasticsearch 获取到 {len(sources)} 条搜索结果")
+        enhanced_query, sources = retrieval["enhanced_query"], retrieval["sources"]
 
         # 如果未找到文档，则直接返回
         if not sources:
@@ -298,9 +366,26 @@ async def rag_endpoint(request: Request):
             }
             return Response.success(data=result)
 
-        # 4. 使用sources生成答案
+        # 4. 流式请求：立即返回事件流，检索结果先行，答案增量随到随发
+        if request_stream:
+            logger.info("请求为流式响应，开始转发增量事件流。")
+            # 相同查询的并发流式请求订阅同一个上游生成，后加入者先回放已产出的事件
+            events = get_single_flight("agent.rag.stream").stream(
+                coalesce_key,
+                lambda: stream_rag_events(None, query, enhanced_query, sources, openid)
+            )
+            return StreamingResponse(
+                follow_until_disconnected(request, events),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            )
+
+        # 5. 使用sources生成答案
         logger.debug(f"开始生成答案: sources数量={len(sources)}")
-        answer_result = await generate_answer(query, enhanced_query, sources, 'answerGenerate')
+        answer_result = await get_single_flight("agent.rag.answer").do(
+            coalesce_key,
+            lambda: generate_answer(query, enhanced_query, sources, 'answerGenerate')
+        )
         
         # 构建返回结果
         total_time = time.time() - start_time
@@ -318,13 +403,8 @@ async def rag_endpoint(request: Request):
         logger.debug(f"RAG处理完成，耗时: {total_time:.2f}秒")
         logger.debug(f"最终响应内容:\n{'-'*30}\n{(answer_result['response'] or '')[:500]}...\n{'-'*30}")
         
-        if request_stream:
-            logger.info("请求为流式响应，开始生成事件流。")
-            stream_gen = get_stream_generator(result)
-            return StreamingResponse(stream_gen(), media_type="text/event-stream")
-        else:
-            logger.info("请求为非流式响应，返回完整JSON。")
-            return Response.success(data=result)
+        logger.info("请求为非流式响应，返回完整JSON。")
+        return Response.success(data=result)
     
     except Exception as e:
         logger.exception(f"RAG处理失败: {e}")
@@ -1,18 +1,18 @@
 import time
 import json
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Tuple
 import asyncio
 from datetime import datetime
 import re
 import hashlib
 from pathlib import Path
 
-from elasticsearch import AsyncElasticsearch
 from fastapi import Query, APIRouter, Body, HTTPException
 from pydantic import BaseModel, Field
 import jieba.analyse
 
 from api.models.common import Response, Request, validate_params, PaginationInfo
+from api.common.coalesce import get_single_flight, make_key
 from config import Config
 from core.utils.logger import register_logger
 from etl.load import (
@@ -24,13 +24,15 @@ from etl.load import (
     get_by_id
 )
 from etl import ES_INDEX_NAME
-from etl.rag.pipeline import RagPipeline
+from etl.retrieval.es_client import es_search
+from etl.rag.pipeline_manager import get_or_init_rag_pipeline
 from etl.rag.strategies import RetrievalStrategy, RerankStrategy
 from api.routes.wxapp._utils import batch_enrich_posts_with_user_info
 from etl.utils.const import official_author as OFFICIAL_AUTHORS_WHITELIST
 
 router = APIRouter()
 logger = register_logger('api.routes.knowledge.search')
+config = Config()
 
 TABLE_MAPPING = {
     # 微信小程序平台
@@ -166,87 +168,132 @@ def calculate_relevance(query: str, title: str, content: str, author: str = "",
         
     return min(total_score / max_score, 1.0)
 
-async def search_knowledge(
-    query: str, 
-    openid: str,
-    platform: Optional[str] = None,
-    tag: Optional[str] = None,
-    max_results: int = 30,  # 显著增加默认单表查询结果数量
-    page: int = 1,
-    page_size: int = 10,
-    sort_by: str = "relevance",
-    max_content_length: int = 500
-) -> Dict[str, Any]:
-    """知识库搜索核心逻辑，供内部调用
+def _get_table_info(table: str) -> Dict[str, Any]:
+    """根据表名获取TABLE_MAPPING中的字段配置"""
+    platform_name, *rest = table.split("_")
+    platform_info = TABLE_MAPPING[platform_name]
+    if platform_name == "wxapp":
+        return platform_info[rest[0]]
+    return platform_info
+
+def _build_boolean_query(query: str) -> str:
+    """将查询词转为BOOLEAN MODE表达式：每个词作为短语、词之间为OR关系，与LIKE检索的匹配语义一致
     
-    Args:
-        query: 搜索关键词
-        openid: 用户openid
-        platform: 平台标识，可选值：wechat/website/market/wxapp，多个用逗号分隔
-        tag: 标签，多个用逗号分隔
-        max_results: 单表最大结果数，默认30
-        page: 分页页码，默认1
-        page_size: 每页结果数，默认10
-        sort_by: 排序方式，可选值：relevance(相关度)/time(时间)，默认relevance
-        max_content_length: 单条内容最大长度，默认500，超过将被截断
-        
-    Returns:
-        Dict: 搜索结果，包含分页信息和数据列表
-        {
-            "data": [...], // 字典对象列表
-            "pagination": {...} // 分页信息
-        }
+    短于ngram_token_size的词无法命中ngram索引，直接丢弃
     """
+    min_length = config.get("services.app.search.ngram_token_size", 2)
+    terms = [k.replace('"', ' ').strip() for k in query.split()]
+    return " ".join(f'"{t}"' for t in terms if len(t) >= min_length)
+
+async def _fulltext_search(
+    query: str,
+    valid_tables: List[str],
+    offset: int,
+    page_size: int,
+    sort_by: str,
+    max_content_length: int
+) -> Optional[Tuple[List[Dict[str, Any]], int]]:
+    """基于ngram FULLTEXT索引(ft_content)的检索
     
-    if not query:
-        return {"data": [], "pagination": {"total": 0, "page": page, "page_size": page_size, "total_pages": 0}}
+    各表的命中通过UNION ALL合并，由MySQL完成打分、排序和LIMIT/OFFSET，只回表读取当前页的记录。
+    相关度为MATCH分数乘以与calculate_relevance相同的时间因子。
     
-    # 处理平台标识参数，支持多平台
-    table_list = []
-    if platform:
-        # 分割平台字符串
-        platform_list = [p.strip() for p in platform.split(',') if p.strip()]
+    Returns:
+        Tuple: (当前页结果, 总数)；查询词都短于ngram长度时返回None，由调用方回退到LIKE检索
+    """
+    boolean_query = _build_boolean_query(query)
+    if not boolean_query:
+        return None
+    
+    branches, branch_params = [], []
+    count_branches, count_params = [], []
+    for table in valid_tables:
+        table_info = _get_table_info(table)
+        match_sql = f"MATCH({table_info['content_field']}, {table_info['title_field']}) AGAINST(%s IN BOOLEAN MODE)"
+        time_field = table_info.get("time_field", "publish_time")
         
-        for p in platform_list:
-            if p == "wxapp":
-                table_list.append("wxapp_post")
-            elif p in ["wechat", "website", "market"]:
-                table_list.append(f"{p}_nku")
-            else:
-                logger.warning(f"平台 {p} 不存在或不支持搜索")
-                continue
-    else:
-        # 不指定平台时，搜索所有表
-        table_list = ["wechat_nku", "website_nku", "market_nku", "wxapp_post"]
+        where_condition = match_sql
+        if "status_field" in table_info:
+            where_condition += f" AND {table_info['status_field']} = 1"
+        if "deleted_field" in table_info:
+            where_condition += f" AND {table_info['deleted_field']} = 0"
+        
+        score_sql = (
+            f"{match_sql} * CASE "
+            f"WHEN {time_field} >= NOW() - INTERVAL 30 DAY THEN 1.2 "
+            f"WHEN {time_field} >= NOW() - INTERVAL 90 DAY THEN 1.1 "
+            f"WHEN {time_field} >= NOW() - INTERVAL 180 DAY THEN 1.05 "
+            f"ELSE 1.0 END"
+        )
+        branches.append(
+            f"(SELECT '{table}' AS _table, id, {score_sql} AS score, {time_field} AS sort_time "
+            f"FROM {table} WHERE {where_condition})"
+        )
+        branch_params.extend([boolean_query, boolean_query])
+        count_branches.append(f"SELECT COUNT(*) AS cnt FROM {table} WHERE {where_condition}")
+        count_params.append(boolean_query)
     
-    # 处理标签参数，为不同平台提供默认标签
-    tag_list = []
-    if tag:
-        tag_list = tag.split(",")
-    else:
-        # 不指定tag时，根据平台添加默认标签
-        if len(table_list) == 1:
-            if table_list[0] == "wxapp_post":
-                tag_list = ["post"]
-            elif table_list[0] in ["wechat_nku", "website_nku", "market_nku"]:
-                tag_list = ["nku"]
+    order_by = "score DESC, sort_time DESC" if sort_by == "relevance" else "sort_time DESC, score DESC"
+    hits_sql = " UNION ALL ".join(branches) + f" ORDER BY {order_by} LIMIT %s OFFSET %s"
+    count_sql = "SELECT SUM(cnt) AS total FROM (" + " UNION ALL ".join(count_branches) + ") AS counts"
     
-    logger.debug(f"知识库搜索: query={query}, platform={platform}, tag={tag_list}, tables={table_list}, max_content_length={max_content_length}")
+    hits, count_row = await asyncio.gather(
+        execute_custom_query(hits_sql, branch_params + [page_size, offset], fetch='all'),
+        execute_custom_query(count_sql, count_params, fetch='one')
+    )
+    total_count = int(count_row["total"] or 0) if count_row else 0
+    if not hits:
+        return [], total_count
     
-    # 验证表名是否合法
-    valid_tables = []
-    for table in table_list:
-        platform_name = table.split("_")[0]
-        if platform_name in TABLE_MAPPING:
-            valid_tables.append(table)
-        else:
-            logger.warning(f"平台 {platform_name} 不存在或不支持搜索")
-            
-    if not valid_tables:
-        return {"data": [], "pagination": {"total": 0, "page": page, "page_size": page_size, "total_pages": 0}}
-            
-    offset = (page - 1) * page_size
+    # 只回表读取当前页的记录
+    ids_by_table: Dict[str, List[int]] = {}
+    for hit in hits:
+        ids_by_table.setdefault(hit["_table"], []).append(hit["id"])
+    tables = list(ids_by_table)
+    rows_list = await asyncio.gather(*[
+        execute_custom_query(
+            f"SELECT * FROM {table} WHERE id IN ({', '.join(['%s'] * len(ids_by_table[table]))})",
+            ids_by_table[table],
+            fetch='all'
+        )
+        for table in tables
+    ])
+    rows_by_key = {
+        (table, row["id"]): row
+        for table, rows in zip(tables, rows_list)
+        for row in (rows or [])
+    }
     
+    paged_results = []
+    for hit in hits:
+        item = rows_by_key.get((hit["_table"], hit["id"]))
+        if item is None:
+            continue
+        item = dict(item)
+        item["relevance"] = float(hit["score"] or 0.0)
+        item["_table"] = hit["_table"]
+        item["_type"] = TABLE_MAPPING[hit["_table"].split("_")[0]]["name"]
+        if item.get("content") and len(item["content"]) > max_content_length:
+            item["content"] = item["content"][:max_content_length] + "..."
+            item["_content_truncated"] = True
+        paged_results.append(item)
+    
+    return paged_results, total_count
+
+async def _like_search(
+    query: str,
+    valid_tables: List[str],
+    offset: int,
+    page_size: int,
+    max_results: int,
+    sort_by: str,
+    max_content_length: int
+) -> Tuple[List[Dict[str, Any]], int]:
+    """LIKE检索（回退路径）：每表最多取max_results条，在Python中计算相关度并分页
+    
+    Returns:
+        Tuple: (当前页结果, 总数)
+    """
     # 搜索所有指定表
     all_results = []
     search_tasks = []
@@ -396,11 +443,114 @@ async def search_knowledge(
     # 分页
     paged_results = all_results[offset:offset+page_size] if all_results else []
     
+    return paged_results, total_count
+
+
+async def search_knowledge(
+    query: str, 
+    openid: str,
+    platform: Optional[str] = None,
+    tag: Optional[str] = None,
+    max_results: int = 30,  # 显著增加默认单表查询结果数量
+    page: int = 1,
+    page_size: int = 10,
+    sort_by: str = "relevance",
+    max_content_length: int = 500
+) -> Dict[str, Any]:
+    """知识库搜索核心逻辑，供内部调用
+    
+    Args:
+        query: 搜索关键词
+        openid: 用户openid
+        platform: 平台标识，可选值：wechat/website/market/wxapp，多个用逗号分隔
+        tag: 标签，多个用逗号分隔
+        max_results: 单表最大结果数，默认30（仅LIKE回退检索使用）
+        page: 分页页码，默认1
+        page_size: 每页结果数，默认10
+        sort_by: 排序方式，可选值：relevance(相关度)/time(时间)，默认relevance
+        max_content_length: 单条内容最大长度，默认500，超过将被截断
+        
+    Returns:
+        Dict: 搜索结果，包含分页信息和数据列表
+        {
+            "data": [...], // 字典对象列表
+            "pagination": {...} // 分页信息
+        }
+    """
+    
+    if not query:
+        return {"data": [], "pagination": {"total": 0, "page": page, "page_size": page_size, "total_pages": 0}}
+    
+    # 处理平台标识参数，支持多平台
+    table_list = []
+    if platform:
+        # 分割平台字符串
+        platform_list = [p.strip() for p in platform.split(',') if p.strip()]
+        
+        for p in platform_list:
+            if p == "wxapp":
+                table_list.append("wxapp_post")
+            elif p in ["wechat", "website", "market"]:
+                table_list.append(f"{p}_nku")
+            else:
+                logger.warning(f"平台 {p} 不存在或不支持搜索")
+                continue
+    else:
+        # 不指定平台时，搜索所有表
+        table_list = ["wechat_nku", "website_nku", "market_nku", "wxapp_post"]
+    
+    # 处理标签参数，为不同平台提供默认标签
+    tag_list = []
+    if tag:
+        tag_list = tag.split(",")
+    else:
+        # 不指定tag时，根据平台添加默认标签
+        if len(table_list) == 1:
+            if table_list[0] == "wxapp_post":
+                tag_list = ["post"]
+            elif table_list[0] in ["wechat_nku", "website_nku", "market_nku"]:
+                tag_list = ["nku"]
+    
+    logger.debug(f"知识库搜索: query={query}, platform={platform}, tag={tag_list}, tables={table_list}, max_content_length={max_content_length}")
+    
+    # 验证表名是否合法
+    valid_tables = []
+    for table in table_list:
+        platform_name = table.split("_")[0]
+        if platform_name in TABLE_MAPPING:
+            valid_tables.append(table)
+        else:
+            logger.warning(f"平台 {platform_name} 不存在或不支持搜索")
+            
+    if not valid_tables:
+        return {"data": [], "pagination": {"total": 0, "page": page, "page_size": page_size, "total_pages": 0}}
+            
+    offset = (page - 1) * page_size
+    
+    async def _query_tables():
+        # 优先走全文索引：排序和分页都在MySQL中完成，total为真实命中数
+        if config.get("services.app.search.fulltext", True):
+            try:
+                fulltext_result = await _fulltext_search(query, valid_tables, offset, page_size, sort_by, max_content_length)
+                if fulltext_result is not None:
+                    return fulltext_result
+            except Exception as e:
+                logger.warning(f"全文索引检索失败，回退到LIKE检索: {str(e)}")
+        return await _like_search(
+            query, valid_tables, offset, page_size, max_results, sort_by, max_content_length
+        )
+    
+    # 与用户无关的数据库检索在并发的相同查询间合并，用户相关的互动信息仍按openid单独补充
+    search_key = make_key(query, tables=valid_tables, offset=offset, page_size=page_size,
+                          max_results=max_results, sort_by=sort_by, max_content_length=max_content_length)
+    paged_results, total_count = await get_single_flight("knowledge.search").do(search_key, _query_tables)
+    
     # 转换为字典格式
     sources = []
     
     # 收集所有来自wxapp_post的项目，用于批量查询用户信息
-    wxapp_post_items = [item for item in paged_results if item.get("_table") == "wxapp_post"]
+    # 合并的结果被多个请求共享，补充用户信息前先复制
+    wxapp_post_items = [dict(item) for item in paged_results if item.get("_table") == "wxapp_post"]
     other_items = [item for item in paged_results if item.get("_table") != "wxapp_post"]
 
     # 优先处理其他平台的item
@@ -634,22 +784,39 @@ async def advanced_search_endpoint(
             f"retrieval_strategy='{retrieval_strategy.value}', rerank_strategy='{rerank_strategy.value}'"
         )
         
-        # 1. 初始化 RAG 管道
-        rag_pipeline = RagPipeline()
-        
+        # 1. 获取共享的 RAG 管道实例（在应用启动时加载并预热）
+        rag_pipeline = await get_or_init_rag_pipeline()
+        if rag_pipeline is None:
+            return Response.error(message="RAG管道未就绪，请稍后再试", code=503)
+
         # 2. 执行仅检索和重排序
-        # retrieve_only 内部会调用 run(..., skip_generation=True)
-        results = rag_pipeline.retrieve_only(
-            query=query,
-            top_k_retrieve=top_k_retrieve,
-            top_k_rerank=top_k_rerank,
-            user_id=openid,
-            retrieval_strategy=retrieval_strategy,
-            rerank_strategy=rerank_strategy
+        # retrieve_only 内部会调用 run(..., skip_generation=True)，在线程中执行以免阻塞事件循环；
+        # 搜索历史在事件循环上查询后传入（连接池绑定在主事件循环，线程中无法使用）
+        search_history = await rag_pipeline.get_user_search_history(openid)
+        
+        async def _retrieve():
+            return await asyncio.to_thread(
+                rag_pipeline.retrieve_only,
+                query=query,
+                top_k_retrieve=top_k_retrieve,
+                top_k_rerank=top_k_rerank,
+                user_id=openid,
+                retrieval_strategy=retrieval_strategy,
+                rerank_strategy=rerank_strategy,
+                search_history=search_history
+            )
+        
+        # 并发的相同查询共享一次检索和重排；重排会按用户历史提权（ES结果在未启用重排时
+        # 也会改为个性化提权），历史非空时键中带上openid
+        retrieve_key = make_key(
+            query, top_k_retrieve=top_k_retrieve, top_k_rerank=top_k_rerank,
+            retrieval_strategy=retrieval_strategy.value, rerank_strategy=rerank_strategy.value,
+            user=openid if search_history else None
         )
+        results = await get_single_flight("knowledge.advanced_search").do(retrieve_key, _retrieve)
         
         # 3. 格式化返回结果
-        reranked_nodes = results.get("reranked_nodes", [])
+        reranked_nodes = results.get("contexts", [])
         contexts = []
         for node_with_score in reranked_nodes:
             node = node_with_score.node
@@ -717,12 +884,7 @@ async def _elasticsearch_search_internal(
     max_content_length: int = 300,
     openid: Optional[str] = None
 ) -> Dict[str, Any]:
-    """使用Elasticsearch进行内部复合查询"""
-    
-    es_client = AsyncElasticsearch(
-        [f"http://{Config().get('etl.data.elasticsearch.host')}:{Config().get('etl.data.elasticsearch.port')}"]
-    )
-
+    """使用Elasticsearch进行内部复合查询（复用应用级共享客户端）"""
     try:
         search_query = {
             "query": {
@@ -780,7 +942,10 @@ async def _elasticsearch_search_internal(
                 ]
 
         logger.debug(f"Executing ES query: {json.dumps(search_query, indent=2, ensure_ascii=False)}")
-        response = await es_client.search(index=ES_INDEX_NAME, body=search_query)
+        response = await es_search(
+            ES_INDEX_NAME, search_query,
+            timeout=config.get("etl.data.elasticsearch.search_timeout", 5)
+        )
         
         return response
     except Exception as e:
@@ -793,8 +958,6 @@ async def _elasticsearch_search_internal(
                 "hits": []
             }
         }
-    finally:
-        await es_client.close()
 
 @router.get("/es-search", summary="Elasticsearch 复合查询接口")
 async def elasticsearch_search_endpoint(
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+请求合并（SingleFlight / SharedStream）单元测试
+"""
+
+import asyncio
+import os
+import sys
+
+# 确保项目根目录在sys.path中
+current_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if current_dir not in sys.path:
+    sys.path.append(current_dir)
+
+from api.common.coalesce import SingleFlight, SharedStream, make_key
+
+
+def test_make_key_normalizes_query():
+    """空白和大小写不同的查询生成相同的键"""
+    assert make_key("  图书馆  开放时间 ", top_k=5) == make_key("图书馆 开放时间", top_k=5)
+    assert make_key("NKU", top_k=5) == make_key("nku", top_k=5)
+    assert make_key("nku", top_k=5) != make_key("nku", top_k=10)
+
+
+def test_concurrent_requests_share_one_call():
+    """并发的相同请求只执行一次计算"""
+    async def main():
+        flight = SingleFlight("test")
+        calls = 0
+
+        async def compute():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.05)
+            return {"answer": 42}
+
+        results = await asyncio.gather(*(flight.do("k", compute) for _ in range(5)))
+        assert calls == 1
+        assert all(result is results[0] for result in results)
+        stats = flight.get_stats()
+        assert stats["leaders"] == 1 and stats["followers"] == 4
+        assert stats["inflight"] == 0
+
+    asyncio.run(main())
+
+
+def test_leader_cancellation_does_not_cancel_followers():
+    """leader断开后计算继续，follower仍拿到结果"""
+    async def main():
+        flight = SingleFlight("test")
+        started = asyncio.Event()
+
+        async def compute():
+            started.set()
+            await asyncio.sleep(0.05)
+            return "done"
+
+        leader = asyncio.ensure_future(flight.do("k", compute))
+        await started.wait()
+        follower = asyncio.ensure_future(flight.do("k", compute, max_wait=1))
+        await asyncio.sleep(0)
+        leader.cancel()
+
+        assert await follower == "done"
+        assert leader.cancelled()
+        assert flight.stats["timeouts"] == 0
+
+    asyncio.run(main())
+
+
+def test_follower_timeout_computes_itself():
+    """follower等待超过max_wait后自行计算"""
+    async def main():
+        flight = SingleFlight("test")
+        calls = 0
+
+        async def slow():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.5)
+            return "slow"
+
+        async def fast():
+            nonlocal calls
+            calls += 1
+            return "fast"
+
+        leader = asyncio.ensure_future(flight.do("k", slow))
+        await asyncio.sleep(0)
+        assert await flight.do("k", fast, max_wait=0.01) == "fast"
+        assert flight.stats["timeouts"] == 1
+        assert await leader == "slow"
+        assert calls == 2
+
+    asyncio.run(main())
+
+
+def test_failure_propagates_and_key_is_released():
+    """计算失败时所有等待者收到异常，键随即释放"""
+    async def main():
+        flight = SingleFlight("test")
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        results = await asyncio.gather(flight.do("k", fail), flight.do("k", fail), return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+
+        async def ok():
+            return "ok"
+
+        assert await flight.do("k", ok) == "ok"
+
+    asyncio.run(main())
+
+
+def test_late_joiner_replays_stream():
+    """晚加入的订阅者先回放已产出的事件，再跟随后续事件"""
+    async def main():
+        flight = SingleFlight("test")
+        gate = asyncio.Event()
+
+        async def source():
+            yield "a"
+            yield "b"
+            await gate.wait()
+            yield "c"
+
+        first = flight.stream("k", source)
+        assert [await first.__anext__(), await first.__anext__()] == ["a", "b"]
+
+        late = flight.stream("k", source)
+        gate.set()
+        assert [item async for item in late] == ["a", "b", "c"]
+        assert [item async for item in first] == ["c"]
+        assert flight.stats["leaders"] == 1 and flight.stats["followers"] == 1
+        assert flight.get_stats()["inflight"] == 0
+
+    asyncio.run(main())
+
+
+def test_upstream_cancelled_when_all_subscribers_leave():
+    """所有订阅者断开时中止上游生成"""
+    async def main():
+        closed = asyncio.Event()
+
+        async def source():
+            try:
+                yield "a"
+                await asyncio.sleep(10)
+                yield "b"
+            finally:
+                closed.set()
+
+        released = []
+        shared = SharedStream(source(), on_close=lambda: released.append(True))
+        first = shared.subscribe()
+        second = shared.subscribe()
+        assert await first.__anext__() == "a"
+        assert await second.__anext__() == "a"
+
+        await first.aclose()
+        await asyncio.sleep(0.01)
+        assert not closed.is_set()
+
+        await second.aclose()
+        await asyncio.wait_for(closed.wait(), timeout=1)
+        assert shared.done
+        assert released == [True]
+
+    asyncio.run(main())
@@ -54,12 +54,39 @@ async def lifespan(app: FastAPI):
     
     # 初始化数据库连接池
     await init_db_pool()
-    
+
+    # 初始化共享的Elasticsearch客户端（ES不可用时不阻塞启动）
+    from etl.retrieval.es_client import init_es_client
+    await init_es_client()
+
+    # 预加载共享RAG管道（模型和索引只在每个工作进程中加载一次）
+    if config.get("etl.retrieval.pipeline.preload", True):
+        from etl.rag.pipeline_manager import init_rag_pipeline
+        await init_rag_pipeline()
+
     yield
-    
+
     # 应用关闭时执行清理
     logger.debug("应用关闭中，开始清理资源...")
-    
+
+    try:
+        from etl.rag.pipeline_manager import close_rag_pipeline
+        await close_rag_pipeline()
+    except Exception as e:
+        logger.error(f"释放RAG管道失败: {str(e)}")
+
+    try:
+        from core.agent.coze.agent_pool import close_coze_clients
+        await close_coze_clients()
+    except Exception as e:
+        logger.error(f"关闭Coze HTTP客户端失败: {str(e)}")
+
+    try:
+        from etl.retrieval.es_client import close_es_client
+        await close_es_client()
+    except Exception as e:
+        logger.error(f"关闭Elasticsearch客户端失败: {str(e)}")
+
     try:
         from etl.load import close_db_pool
         await close_db_pool()
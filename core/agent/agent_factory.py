@@ -63,13 +63,12 @@ def create_agent(agent_type: str = "coze", **kwargs) -> Agent:
    
     try:
         if agent_type == "coze":
-            from core.agent.coze.coze_agent import CozeAgent
-            # 如果提供了bot_id，则优先使用bot_id初始化
+            from core.agent.coze.agent_pool import get_coze_agent
+            # 按bot_id复用进程内共享的实例；提供了bot_id时优先使用，否则使用tag
             if "bot_id" in kwargs:
-                return CozeAgent(bot_id=kwargs["bot_id"])
-            # 否则，使用tag
+                return get_coze_agent(bot_id=kwargs["bot_id"])
             tag = kwargs.get("tag", "default")
-            return CozeAgent(tag=tag)
+            return get_coze_agent(tag=tag)
         elif agent_type == "chatgpt":
             from core.agent.chatgpt.chat_gpt_agent import ChatGPTAgent
             return ChatGPTAgent()
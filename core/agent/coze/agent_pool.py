@@ -0,0 +1,117 @@
+"""
+CozeAgent 进程级实例池
+
+原先每次查询改写、每次生成答案都新建 CozeAgent，各自创建 Coze 客户端和 SessionManager，
+HTTP 连接无法复用。这里在进程内维护：
+
+    - 一个共享的 httpx.AsyncClient（异步SDK调用）和一个 httpx.Client（同步SDK调用与http直连），
+      开启keep-alive并限制连接数
+    - 按 bot_id 缓存的 CozeAgent 实例，所有实例共用上面的连接池
+
+配置项（core.agent.coze.http.*）：
+    max_connections            最大连接数，默认100
+    max_keepalive_connections  最大空闲keep-alive连接数，默认20
+    keepalive_expiry           空闲连接保留时间（秒），默认30
+    timeout                    读写超时（秒），默认60
+    connect_timeout            连接超时（秒），默认5
+"""
+import threading
+from typing import Any, Dict, Optional
+
+import httpx
+from cozepy import AsyncHTTPClient, SyncHTTPClient
+from loguru import logger
+
+from config import Config
+
+config = Config()
+
+_async_http_client: Optional[AsyncHTTPClient] = None
+_sync_http_client: Optional[SyncHTTPClient] = None
+_agents: Dict[str, Any] = {}
+_lock = threading.Lock()
+
+
+def _client_kwargs() -> Dict[str, Any]:
+    return {
+        "limits": httpx.Limits(
+            max_connections=config.get("core.agent.coze.http.max_connections", 100),
+            max_keepalive_connections=config.get("core.agent.coze.http.max_keepalive_connections", 20),
+            keepalive_expiry=config.get("core.agent.coze.http.keepalive_expiry", 30),
+        ),
+        "timeout": httpx.Timeout(
+            config.get("core.agent.coze.http.timeout", 60),
+            connect=config.get("core.agent.coze.http.connect_timeout", 5),
+        ),
+        # 与cozepy一致，不读取环境变量中的代理设置
+        "trust_env": False,
+    }
+
+
+def get_async_http_client() -> AsyncHTTPClient:
+    """获取进程共享的异步HTTP客户端"""
+    global _async_http_client
+    if _async_http_client is None or _async_http_client.is_closed:
+        with _lock:
+            if _async_http_client is None or _async_http_client.is_closed:
+                _async_http_client = AsyncHTTPClient(**_client_kwargs())
+    return _async_http_client
+
+
+def get_sync_http_client() -> SyncHTTPClient:
+    """获取进程共享的同步HTTP客户端"""
+    global _sync_http_client
+    if _sync_http_client is None or _sync_http_client.is_closed:
+        with _lock:
+            if _sync_http_client is None or _sync_http_client.is_closed:
+                _sync_http_client = SyncHTTPClient(**_client_kwargs())
+    return _sync_http_client
+
+
+def get_coze_agent(tag: str = "default", index: int = 0, bot_id: Optional[str] = None):
+    """
+    按bot_id获取共享的CozeAgent实例
+
+    Args:
+        tag: 配置中的bot标签（core.agent.coze.{tag}_bot_id）
+        index: bot_id为列表时的下标
+        bot_id: 直接指定bot_id，优先于tag
+    """
+    from core.agent.coze.coze_agent import CozeAgent
+
+    resolved = bot_id or CozeAgent.resolve_bot_id(tag, index)
+    agent = _agents.get(resolved)
+    if agent is None:
+        with _lock:
+            agent = _agents.get(resolved)
+            if agent is None:
+                agent = CozeAgent(bot_id=resolved)
+                _agents[resolved] = agent
+                logger.info(f"CozeAgent实例池新增: tag={tag}, bot_id={resolved}, 当前实例数={len(_agents)}")
+    return agent
+
+
+async def close_coze_clients():
+    """关闭共享的HTTP客户端并清空实例池，应在应用关闭时调用"""
+    global _async_http_client, _sync_http_client
+    with _lock:
+        async_client, sync_client = _async_http_client, _sync_http_client
+        _async_http_client = _sync_http_client = None
+        _agents.clear()
+    if async_client is not None:
+        await async_client.aclose()
+    if sync_client is not None:
+        sync_client.close()
+    logger.info("Coze HTTP客户端已关闭")
+
+
+def get_coze_pool_status() -> Dict[str, Any]:
+    """获取实例池、连接池状态和各调用类型的分阶段耗时"""
+    from core.agent.coze.latency import get_chat_latency_stats
+
+    return {
+        "agents": list(_agents.keys()),
+        "async_client_open": _async_http_client is not None and not _async_http_client.is_closed,
+        "sync_client_open": _sync_http_client is not None and not _sync_http_client.is_closed,
+        "latency": get_chat_latency_stats(),
+    }
@@ -9,8 +9,9 @@ import json
 import os
 import sys
 import re
-from typing import List, Dict, Generator
+from typing import Any, AsyncIterator, List, Dict, Generator
 import time
+import asyncio
 from loguru import logger
 import uuid
 import httpx
@@ -26,9 +27,12 @@ from core.bridge.context import ContextType, Context
 from core.bridge.reply import Reply, ReplyType
 from core.agent.session_manager import SessionManager
 from core.agent.chatgpt.chat_gpt_session import ChatGPTSession
+from core.agent.coze.agent_pool import get_async_http_client, get_sync_http_client
+from core.agent.coze.latency import ChatTimer
 
 try:
     from cozepy import Coze, TokenAuth, Message, ChatEventType, COZE_CN_BASE_URL, MessageRole, MessageContentType, ChatStatus
+    from cozepy import AsyncCoze, AsyncTokenAuth
     COZE_SDK_AVAILABLE = True
 except ImportError:
     COZE_SDK_AVAILABLE = False
@@ -36,6 +40,34 @@ except ImportError:
     raise
 
 config = Config()
+
+# 后台中止上游对话的任务，保留引用避免被GC回收
+_background_tasks = set()
+
+
+def _spawn(coro):
+    task = asyncio.get_running_loop().create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+def parse_follow_up(content) -> List[str]:
+    """解析follow_up消息中的推荐问题，兼容列表、字典和纯文本格式"""
+    try:
+        parsed = json.loads(content)
+    except (json.JSONDecodeError, TypeError):
+        return [content]
+    if isinstance(parsed, list):
+        return parsed
+    if isinstance(parsed, dict):
+        for key in ("questions", "follow_ups", "suggestions"):
+            if key in parsed:
+                return list(parsed[key])
+        return [value for value in parsed.values() if isinstance(value, str) and len(value) > 5]
+    return [content]
+
+
 class CozeAgent(Agent):
     """CozeAgent类，使用官方 coze-py SDK 的精简实现"""
     
@@ -53,26 +85,29 @@ class CozeAgent(Agent):
         if not self.api_key:
             raise ValueError("API 密钥未配置")
         
-        if bot_id:
-            self.bot_id = bot_id
-        else:
-            bot_id_list = config.get(f"core.agent.coze.{tag}_bot_id")
-            
-            if(isinstance(bot_id_list, list)):
-                self.bot_id = bot_id_list[index]
-            else:
-                self.bot_id = bot_id_list
+        self.bot_id = bot_id or self.resolve_bot_id(tag, index)
 
         logger.info(f"CozeAgent初始化，输入tag: {tag}, bot_id: {self.bot_id}")
 
-        # 初始化Coze客户端
+        # 初始化Coze客户端，HTTP连接池在进程内共享（见 agent_pool）
         self.client = Coze(
             auth=TokenAuth(token=self.api_key), 
-            base_url=COZE_CN_BASE_URL  # 默认使用国内API
+            base_url=COZE_CN_BASE_URL,  # 默认使用国内API
+            http_client=get_sync_http_client()
         )
+        # 异步客户端按需创建，供流式接口在事件循环中直接转发增量
+        self._async_client = None
         
         logger.info(f"CozeAgent 初始化完成，tag={tag}, bot_id={self.bot_id}")
 
+    @staticmethod
+    def resolve_bot_id(tag="default", index=0):
+        """从配置 core.agent.coze.{tag}_bot_id 解析bot_id"""
+        bot_id_list = config.get(f"core.agent.coze.{tag}_bot_id")
+        if isinstance(bot_id_list, list):
+            return bot_id_list[index]
+        return bot_id_list
+
     def reply(self, query: str, context: Context) -> Reply:
         """处理用户输入，返回回复"""
         if context.type == ContextType.TEXT:
@@ -133,21 +168,14 @@ class CozeAgent(Agent):
                 while retry_count < max_retries:
                     try:
                         logger.debug(f"开始非流式请求，尝试次数: {retry_count + 1}")
-                        response = self.client.chat.create_and_poll(
-                            bot_id=self.bot_id,
-                            user_id=openid,
-                            additional_messages=[
-                                Message.build_user_question_text(query, meta_data=meta_data)
-                            ]
-                        )
+                        chat = self._collect_chat(query, openid=openid, meta_data=meta_data, kind="reply")
                         
                         # 提取回复内容
-                        for message in response.messages:
-                            if message.role == "assistant" and message.type == "answer":
-                                # 处理完成后更新会话
-                                completion_tokens, total_tokens = self._calc_tokens(session.messages, message.content)
-                                self.sessions.session_reply(message.content, session_id, total_tokens)
-                                return Reply(ReplyType.TEXT, message.content)
+                        if chat["response"]:
+                            # 处理完成后更新会话
+                            completion_tokens, total_tokens = self._calc_tokens(session.messages, chat["response"])
+                            self.sessions.session_reply(chat["response"], session_id, total_tokens)
+                            return Reply(ReplyType.TEXT, chat["response"])
                         
                         return Reply(ReplyType.TEXT, "未获取到有效回复")
                         
@@ -253,46 +281,180 @@ class CozeAgent(Agent):
                 yield f"请求失败 (尝试 {retry_count}/{max_retries}): {error_msg}"
                 break
 
+    def _get_async_client(self):
+        if self._async_client is None:
+            self._async_client = AsyncCoze(
+                auth=AsyncTokenAuth(token=self.api_key),
+                base_url=COZE_CN_BASE_URL,
+                http_client=get_async_http_client()
+            )
+        return self._async_client
+
+    async def astream_chat(self, query, openid="default_user", meta_data=None) -> AsyncIterator[Dict[str, Any]]:
+        """异步流式对话，上游每到达一个增量就立即产出
+        
+        产出的事件:
+            {"type": "delta", "content": 增量文本}
+            {"type": "follow_up", "content": 推荐问题}
+        
+        生成器在对话完成前被关闭（如客户端断开连接）时，关闭上游连接并调用cancel接口中止生成。
+        """
+        client = self._get_async_client()
+        stream = client.chat.stream(
+            bot_id=self.bot_id,
+            user_id=openid,
+            additional_messages=[Message.build_user_question_text(query, meta_data=meta_data)]
+        )
+        conversation_id = chat_id = None
+        completed = failed = False
+        timer = ChatTimer("astream")
+        chunk_count = 0
+        try:
+            async for event in stream:
+                if event.event == ChatEventType.CONVERSATION_CHAT_CREATED and event.chat:
+                    timer.mark("create")
+                    conversation_id, chat_id = event.chat.conversation_id, event.chat.id
+                elif event.event == ChatEventType.CONVERSATION_MESSAGE_DELTA:
+                    if event.message and event.message.content:
+                        chunk_count += 1
+                        timer.mark("first_token")
+                        yield {"type": "delta", "content": event.message.content}
+                elif event.event == ChatEventType.CONVERSATION_MESSAGE_COMPLETED:
+                    if event.message and event.message.type == "follow_up" and event.message.content:
+                        yield {"type": "follow_up", "content": event.message.content}
+                elif event.event == ChatEventType.CONVERSATION_CHAT_FAILED:
+                    completed = failed = True
+                    raise RuntimeError(f"Coze对话失败: {getattr(event.chat, 'last_error', None)}")
+                elif event.event == ChatEventType.CONVERSATION_CHAT_COMPLETED:
+                    completed = True
+            logger.info(f"异步流式请求完成: 共 {chunk_count} 个响应块，总耗时: {time.perf_counter() - timer.start:.2f}秒")
+        finally:
+            timer.finish(ok=completed and not failed)
+            # 不在finally中await：调用方可能处于已取消的作用域内，中止操作交给后台任务
+            if not completed:
+                logger.info(f"流式对话提前结束，中止上游生成: chat_id={chat_id}")
+                _spawn(self._abort_chat(stream, conversation_id, chat_id))
+
+    async def _abort_chat(self, stream, conversation_id, chat_id):
+        """关闭上游流并取消仍在进行的对话"""
+        try:
+            await stream.aclose()
+        except Exception as e:
+            logger.debug(f"关闭上游流失败: {e}")
+        if conversation_id and chat_id:
+            try:
+                await self._get_async_client().chat.cancel(conversation_id=conversation_id, chat_id=chat_id)
+            except Exception as e:
+                logger.warning(f"取消Coze对话失败: {e}")
+
+    async def achat(self, query, openid="default_user", meta_data=None, max_retries=3) -> Dict[str, Any]:
+        """异步非流式对话，基于流式事件通道收集完整回答
+        
+        Returns:
+            {"response": 回复内容, "suggested_questions": 推荐问题列表}
+        """
+        retry_count = 0
+        while True:
+            chunks: List[str] = []
+            suggested_questions: List[str] = []
+            try:
+                async for event in self.astream_chat(query, openid=openid, meta_data=meta_data):
+                    if event["type"] == "delta":
+                        chunks.append(event["content"])
+                    else:
+                        suggested_questions.extend(parse_follow_up(event["content"]))
+                return {"response": "".join(chunks), "suggested_questions": suggested_questions}
+            except Exception as e:
+                retry_count += 1
+                error_msg = str(e)
+                # 只有尚未收到任何内容的网络断开错误才重试
+                if not chunks and retry_count < max_retries and (
+                    isinstance(e, httpx.TransportError)
+                    or "RemoteProtocolError" in error_msg or "Server disconnected" in error_msg
+                ):
+                    wait_time = retry_count * 2  # 指数退避
+                    logger.warning(f"异步请求失败 (尝试 {retry_count}/{max_retries}): {error_msg}，{wait_time} 秒后重试")
+                    await asyncio.sleep(wait_time)
+                    continue
+                logger.error(f"异步请求失败: {error_msg}")
+                return {"response": f"请求失败: {error_msg}", "suggested_questions": []}
+
+    def _collect_chat(self, query, openid="default_user", meta_data=None, kind="sync") -> Dict[str, Any]:
+        """通过流式事件通道完成一次对话，收到 conversation.chat.completed 即返回，无需轮询
+
+        Returns:
+            {"response", "suggested_questions", "messages"(已完成的消息列表), "conversation_id", "chat_id"}
+        """
+        timer = ChatTimer(kind)
+        result = {"response": None, "suggested_questions": [], "messages": [],
+                  "conversation_id": None, "chat_id": None}
+        chunks: List[str] = []
+        ok = False
+        try:
+            for event in self.client.chat.stream(
+                bot_id=self.bot_id,
+                user_id=openid,
+                additional_messages=[Message.build_user_question_text(query, meta_data=meta_data)]
+            ):
+                if event.event == ChatEventType.CONVERSATION_CHAT_CREATED and event.chat:
+                    timer.mark("create")
+                    result["conversation_id"], result["chat_id"] = event.chat.conversation_id, event.chat.id
+                elif event.event == ChatEventType.CONVERSATION_MESSAGE_DELTA:
+                    if event.message and event.message.content:
+                        timer.mark("first_token")
+                        chunks.append(event.message.content)
+                elif event.event == ChatEventType.CONVERSATION_MESSAGE_COMPLETED and event.message:
+                    message = event.message
+                    result["messages"].append(message)
+                    if message.type == "answer" and message.content and result["response"] is None:
+                        result["response"] = message.content
+                    elif message.type == "follow_up" and message.content:
+                        result["suggested_questions"].extend(parse_follow_up(message.content))
+                elif event.event == ChatEventType.CONVERSATION_CHAT_FAILED:
+                    raise RuntimeError(f"Coze对话失败: {getattr(event.chat, 'last_error', None)}")
+                elif event.event == ChatEventType.CONVERSATION_CHAT_COMPLETED:
+                    ok = True
+                    break
+        finally:
+            timer.finish(ok=ok)
+        if result["response"] is None and chunks:
+            result["response"] = "".join(chunks)
+        return result
+
+    def _iter_http_events(self, url, headers, data, timeout=30.0) -> Generator[tuple, None, None]:
+        """直接请求v3流式接口，按SSE格式逐个产出 (event, data)"""
+        event_name = None
+        with get_sync_http_client().stream("POST", url, headers=headers, json=data, timeout=timeout) as resp:
+            for line in resp.iter_lines():
+                if not line:
+                    event_name = None
+                    continue
+                if line.startswith("event:"):
+                    event_name = line[len("event:"):].strip()
+                elif line.startswith("data:"):
+                    payload = line[len("data:"):].strip()
+                    try:
+                        event_data = json.loads(payload)
+                    except json.JSONDecodeError:
+                        event_data = payload
+                    yield event_name, event_data
+                    if event_name in ("conversation.chat.completed", "conversation.chat.failed", "done"):
+                        return
+
     def get_knowledge_results(self, query, openid="default_user"):
         """获取对话的知识库召回结果"""
         try:
             logger.info(f"开始获取知识库召回结果，bot_id: {self.bot_id}, query: {query}")
             
-            # 创建对话
-            chat = self.client.chat.create(
-                bot_id=self.bot_id,
-                user_id=openid,
-                additional_messages=[
-                    Message.build_user_question_text(query)
-                ]
-            )
-            
-            # 获取会话ID和聊天ID
-            conversation_id = chat.conversation_id
-            chat_id = chat.id
-            
-            # 等待对话完成
-            for _ in range(30):
-                time.sleep(0.3)
-                
-                chat_status = self.client.chat.retrieve(
-                    conversation_id=conversation_id,
-                    chat_id=chat_id
+            # 通过事件通道等待对话完成，召回结果在verbose消息中
+            chat = self._collect_chat(query, openid=openid, kind="knowledge")
+            messages = chat["messages"]
+            if not any(message.type == "verbose" for message in messages) and chat["chat_id"]:
+                # 事件通道未带verbose消息时，对话已完成，直接拉取一次消息列表
+                messages = self.client.chat.messages.list(
+                    conversation_id=chat["conversation_id"],
+                    chat_id=chat["chat_id"]
                 )
-                status = chat_status.status
-                
-                if status in ["completed", "required_action"]:
-                    break
-            
-            if status not in ["completed", "required_action"]:
-                logger.warning(f"对话未完成，最终状态: {status}")
-                return []
-            
-            # 获取消息列表
-            messages = self.client.chat.messages.list(
-                conversation_id=conversation_id,
-                chat_id=chat_id
-            )
             
             # 提取知识库内容
             knowledge_results = []
@@ -468,85 +630,47 @@ class CozeAgent(Agent):
                 if stream:
                     # 流式响应
                     def content_generator():
-                        with httpx.stream("POST", url, headers=headers, json=data, timeout=30.0) as resp:
-                            for line in resp.iter_lines():
-                                if not line:
-                                    continue
-                                try:
-                                    obj = json.loads(line)
-                                    # v3流式返回: event/data
-                                    if obj.get("event") == "conversation.message.delta":
-                                        event_data = obj.get("data")
-                                        if event_data:
-                                            message = json.loads(event_data)
-                                            content = message.get("content", "")
-                                            if content:
-                                                yield content
-                                except Exception:
-                                    continue
+                        for event, event_data in self._iter_http_events(url, headers, data):
+                            if event == "conversation.message.delta" and isinstance(event_data, dict):
+                                content = event_data.get("content", "")
+                                if content:
+                                    yield content
                     return content_generator()
                 else:
-                    # 非流式响应
-                    resp = httpx.post(url, headers=headers, json=data, timeout=30.0)
-                    resp_data = resp.json().get("data", {})
-                    conversation_id = resp_data.get("conversation_id")
-                    logger.debug(f"创建新对话成功: {conversation_id}")
-                    chat_id = resp_data.get("id")
-                    status = resp_data.get("status")
-                    # 轮询直到终态
-                    poll_count = 0
-                    max_poll = 30
-                    while status == "in_progress":
-                        time.sleep(1)
-                        poll_count += 1
-                        retrieve_url = (
-                            base_url.rstrip("/") +
-                            f"/v3/chat/retrieve?conversation_id={conversation_id}&chat_id={chat_id}"
-                        )
-                        try:
-                            retrieve_resp = httpx.get(retrieve_url, headers=headers, timeout=30.0)
-                            status = retrieve_resp.json().get("status")
-                        except httpx.TimeoutException:
-                            logger.warning(f"轮询超时，重试中...（第{poll_count}次）")
-                            continue
-                        except Exception as e:
-                            logger.error(f"轮询异常: {str(e)}，重试中...（第{poll_count}次）")
-                            continue
-                        if poll_count > max_poll:
-                            logger.error("轮询超时，终止等待")
-                            break  # 最多等30秒
-                    # 获取消息详情
-                    msg_url = (
-                        base_url.rstrip("/") +
-                        f"/v3/chat/message/list?conversation_id={conversation_id}&chat_id={chat_id}"
-                    )
-                    try:
-                        msg_resp = httpx.get(msg_url, headers=headers, timeout=30.0)
-                    except httpx.TimeoutException:
-                        logger.error("获取消息详情超时")
-                        return {"response": None, "suggested_questions": []}
-                    except Exception as e:
-                        logger.error(f"获取消息详情异常: {str(e)}")
-                        return {"response": None, "suggested_questions": []}
+                    # 非流式响应：同样走流式事件通道，收到完成事件即返回，不再每秒轮询状态
+                    data["stream"] = True
+                    timer = ChatTimer("http")
                     response = None
+                    chunks = []
                     suggested_questions = []
-                    for msg in msg_resp.json().get("data", []):
-                        if msg.get("role") == "assistant" and msg.get("type") == "answer" and msg.get("content"):
-                            if not response:
-                                response = msg.get("content")
-                        if msg.get("type") == "follow_up":
-                            try:
-                                content = json.loads(msg.get("content", ""))
-                                if isinstance(content, list):
-                                    suggested_questions.extend(content)
-                                elif isinstance(content, dict):
-                                    for k in ["questions", "follow_ups", "suggestions"]:
-                                        if k in content:
-                                            suggested_questions.extend(content[k])
-                                else:
-                                    suggested_questions.append(msg.get("content", ""))
-                            except Exception:
-                                suggested_questions.append(msg.get("content", ""))
+                    ok = False
+                    try:
+                        for event, event_data in self._iter_http_events(url, headers, data):
+                            if not isinstance(event_data, dict):
+                                continue
+                            if event == "conversation.chat.created":
+                                timer.mark("create")
+                                logger.debug(f"创建新对话成功: {event_data.get('conversation_id')}")
+                            elif event == "conversation.message.delta":
+                                if event_data.get("content"):
+                                    timer.mark("first_token")
+                                    chunks.append(event_data["content"])
+                            elif event == "conversation.message.completed":
+                                if event_data.get("type") == "answer" and event_data.get("content") and not response:
+                                    response = event_data["content"]
+                                elif event_data.get("type") == "follow_up" and event_data.get("content"):
+                                    suggested_questions.extend(parse_follow_up(event_data["content"]))
+                            elif event == "conversation.chat.failed":
+                                logger.error(f"对话失败: {event_data.get('last_error')}")
+                                break
+                            elif event == "conversation.chat.completed":
+                                ok = True
+                    except httpx.TimeoutException:
+                        logger.error("等待对话完成超时")
+                    finally:
+                        timer.finish(ok=ok)
+                    if not response and chunks:
+                        response = "".join(chunks)
                     logger.debug(f"获取消息详情成功: {str(response)[:50]}...")
                     return {
                         "response": response,
@@ -575,59 +699,9 @@ class CozeAgent(Agent):
                 # 非流式响应
                 logger.debug(f"创建新对话并发送消息(非流式): {query[:30]}...")
                 
-                # 在调用前打印日志
-                messages_to_send = [
-                    Message.build_user_question_text(query, meta_data=meta_data)
-                ]
-                logger.debug(f"即将发送给 create_and_poll 的消息: {messages_to_send}")
-
-                chat_poll = self.client.chat.create_and_poll(
-                    bot_id=self.bot_id,
-                    user_id=openid,
-                    additional_messages=messages_to_send
-                )
-                
-                # 提取回复内容
-                response = None
-                for message in chat_poll.messages:
-                    if message.role == "assistant" and message.type == "answer":
-                        response = message.content
-                        break
-                
-                # 从消息中查找类型为FOLLOW_UP的消息，提取推荐问题
-                suggested_questions = []
-                for message in chat_poll.messages:
-                    if message.type == "follow_up":
-                        logger.debug(f"找到follow_up类型消息: {message.content[:50]}...")
-                        
-                        # 尝试解析内容，FOLLOW_UP通常是JSON格式
-                        try:
-                            import json
-                            content = json.loads(message.content)
-                            
-                            # 处理各种可能的格式
-                            if isinstance(content, list):
-                                # 如果是一个列表，直接添加所有元素
-                                suggested_questions.extend(content)
-                            elif isinstance(content, dict):
-                                # 如果是一个字典，查找可能的问题字段
-                                if "questions" in content:
-                                    suggested_questions.extend(content["questions"])
-                                elif "follow_ups" in content:
-                                    suggested_questions.extend(content["follow_ups"])
-                                elif "suggestions" in content:
-                                    suggested_questions.extend(content["suggestions"])
-                                else:
-                                    # 如果没有找到特定字段，尝试使用所有值
-                                    for key, value in content.items():
-                                        if isinstance(value, str) and len(value) > 5:
-                                            suggested_questions.append(value)
-                            else:
-                                # 其他情况，直接添加内容
-                                suggested_questions.append(message.content)
-                        except json.JSONDecodeError:
-                            # 如果不是JSON格式，直接添加内容
-                            suggested_questions.append(message.content)
+                chat = self._collect_chat(query, openid=openid, meta_data=meta_data, kind="sdk")
+                response = chat["response"]
+                suggested_questions = chat["suggested_questions"]
                 
                 logger.debug(f"找到 {len(suggested_questions)} 个建议问题")
                 
@@ -666,51 +740,10 @@ class CozeAgent(Agent):
         try:
             logger.debug(f"获取原生建议问题: query={query[:30]}...")
             
-            # 创建非流式对话，这样可以获取完整的消息列表
-            chat_poll = self.client.chat.create_and_poll(
-                bot_id=self.bot_id,
-                user_id=openid,
-                additional_messages=[
-                    Message.build_user_question_text(query, meta_data=meta_data)
-                ]
-            )
-            
-            # 从消息中查找类型为FOLLOW_UP的消息
-            suggested_questions = []
-            
-            for message in chat_poll.messages:
-                # 查看消息类型是否为 FOLLOW_UP
-                if message.type == "follow_up":
-                    logger.debug(f"找到follow_up类型消息: {message.content[:50]}...")
-                    
-                    # 尝试解析内容，FOLLOW_UP通常是JSON格式
-                    try:
-                        import json
-                        content = json.loads(message.content)
-                        
-                        # 处理各种可能的格式
-                        if isinstance(content, list):
-                            # 如果是一个列表，直接添加所有元素
-                            suggested_questions.extend(content)
-                        elif isinstance(content, dict):
-                            # 如果是一个字典，查找可能的问题字段
-                            if "questions" in content:
-                                suggested_questions.extend(content["questions"])
-                            elif "follow_ups" in content:
-                                suggested_questions.extend(content["follow_ups"])
-                            elif "suggestions" in content:
-                                suggested_questions.extend(content["suggestions"])
-                            else:
-                                # 如果没有找到特定字段，尝试使用所有值
-                                for key, value in content.items():
-                                    if isinstance(value, str) and len(value) > 5:
-                                        suggested_questions.append(value)
-                        else:
-                            # 其他情况，直接添加内容
-                            suggested_questions.append(message.content)
-                    except json.JSONDecodeError:
-                        # 如果不是JSON格式，直接添加内容
-                        suggested_questions.append(message.content)
+            # 通过事件通道完成对话，FOLLOW_UP消息在对话完成前到达
+            suggested_questions = self._collect_chat(
+                query, openid=openid, meta_data=meta_data, kind="suggestions"
+            )["suggested_questions"]
             
             logger.debug(f"找到 {len(suggested_questions)} 个建议问题")
             return suggested_questions
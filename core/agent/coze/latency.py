@@ -0,0 +1,94 @@
+"""
+Coze对话分阶段耗时统计
+
+每次调用记录三个阶段相对请求开始的耗时：
+    create       对话创建（收到 conversation.chat.created）
+    first_token  首个回答增量
+    complete     对话完成（收到 conversation.chat.completed 或出错结束）
+
+按调用类型（如 achat、http、knowledge）分别保留最近的样本，供 /coze/status 输出分位数。
+
+配置项（core.agent.coze.latency.*）：
+    window     每个调用类型保留的样本数，默认500
+"""
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, Optional
+
+from loguru import logger
+
+from config import Config
+
+config = Config()
+
+PHASES = ("create", "first_token", "complete")
+
+_samples: Dict[str, Dict[str, Deque[float]]] = {}
+_counters: Dict[str, Dict[str, int]] = defaultdict(lambda: {"calls": 0, "failures": 0})
+_lock = threading.Lock()
+
+
+class ChatTimer:
+    """单次对话的分阶段计时器，每个阶段只记录第一次到达的时间"""
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.start = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self._finished = False
+
+    def mark(self, phase: str):
+        if phase not in self.phases:
+            self.phases[phase] = time.perf_counter() - self.start
+
+    def finish(self, ok: bool = True):
+        """标记完成并写入统计，重复调用只记录一次"""
+        if self._finished:
+            return
+        self._finished = True
+        self.mark("complete")
+        _record(self.kind, self.phases, ok)
+        logger.debug(
+            f"Coze对话耗时[{self.kind}]: "
+            + ", ".join(f"{phase}={self.phases[phase]:.2f}s" for phase in PHASES if phase in self.phases)
+        )
+
+
+def _record(kind: str, phases: Dict[str, float], ok: bool):
+    window = config.get("core.agent.coze.latency.window", 500)
+    with _lock:
+        samples = _samples.get(kind)
+        if samples is None:
+            samples = _samples[kind] = {phase: deque(maxlen=window) for phase in PHASES}
+        for phase, elapsed in phases.items():
+            if phase in samples:
+                samples[phase].append(elapsed)
+        _counters[kind]["calls"] += 1
+        if not ok:
+            _counters[kind]["failures"] += 1
+
+
+def _percentile(values, q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 1)
+
+
+def get_chat_latency_stats() -> Dict[str, Any]:
+    """按调用类型返回各阶段的p50/p95耗时（毫秒）"""
+    with _lock:
+        snapshot = {kind: {phase: list(values) for phase, values in phases.items()}
+                    for kind, phases in _samples.items()}
+        counters = {kind: dict(values) for kind, values in _counters.items()}
+    stats = {}
+    for kind, phases in snapshot.items():
+        stats[kind] = dict(counters.get(kind, {}))
+        for phase, values in phases.items():
+            stats[kind][phase] = {
+                "samples": len(values),
+                "p50_ms": _percentile(values, 0.5),
+                "p95_ms": _percentile(values, 0.95),
+            }
+    return stats
@@ -72,6 +72,7 @@ CHUNK_OVERLAP: int = _config.get('etl.chunking.chunk_overlap', 200)
 
 # --- BM25 索引相关配置 ---
 BM25_NODES_PATH: str = _config.get('etl.retrieval.bm25.nodes_path', str(INDEX_PATH / 'bm25_nodes.pkl'))
+BM25_INDEX_DIR: str = _config.get('etl.retrieval.bm25.index_dir', str(INDEX_PATH / 'bm25'))
 STOPWORDS_PATH: str = _config.get('etl.retrieval.bm25.stopwords_path', str(NLTK_PATH / 'hit_stopwords.txt'))
 BM25_ENABLE_CHUNKING: bool = _config.get('etl.retrieval.bm25.enable_chunking', False)
 
@@ -15,6 +15,7 @@ from datetime import datetime
 sys.path.append(str(Path(__file__).resolve().parent.parent.parent))
 from etl.crawler import crawler_logger, RAW_PATH, default_user_agents, default_locale, default_timezone
 from etl.utils.file import clean_filename
+from etl.utils.raw_manifest import record_raw_file
 
 
 class BaseCrawler():
@@ -291,12 +292,14 @@ class BaseCrawler():
                 try:
                     with open(save_path.with_suffix('.json'), 'w', encoding='utf-8', errors='ignore') as f:
                         json.dump(meta, f, ensure_ascii=False, indent=2)
+                    record_raw_file(save_path.with_suffix('.json'), meta)
                 except PermissionError:
                     self.logger.error(f"无法写入文件 {save_path}，权限被拒绝")
                     # 尝试使用临时文件名
                     temp_path = save_path.with_name(f"temp_{save_path.name}")
                     with open(temp_path.with_suffix('.json'), 'w', encoding='utf-8', errors='ignore') as f:
                         json.dump(meta, f, ensure_ascii=False, indent=2)
+                    record_raw_file(temp_path.with_suffix('.json'), meta)
                 scraped_original_urls.append(article['original_url'])
             else:
                 self.counter['noneed'] += 1
@@ -9,6 +9,7 @@ from etl.utils.const import domain_source_map, nankai_url_maps, nankai_start_url
 from etl.crawler.base_crawler import BaseCrawler
 from etl.utils.date import parse_date
 from etl.utils.file import clean_filename
+from etl.utils.raw_manifest import record_raw_file
 from tqdm import tqdm
 from typing import Any, List, Dict, Set
 from pathlib import Path
@@ -722,6 +723,7 @@ class WebpageCrawler(BaseCrawler):
             
             with open(article_dir / f"{clean_title[:50]}.json", 'w', encoding='utf-8') as f:
                 json.dump(meta, f, ensure_ascii=False, indent=2)
+            record_raw_file(article_dir / f"{clean_title[:50]}.json", meta)
                 
             # 保存内容到markdown文件
             content = article_data.get('content', '')
@@ -16,6 +16,7 @@ from etl.utils.const import (
 from etl.crawler.base_crawler import BaseCrawler
 from etl.utils.date import parse_date
 from etl.utils.file import clean_filename
+from etl.utils.raw_manifest import record_raw_file
 from tqdm import tqdm
 from typing import Any
 from pathlib import Path
@@ -376,6 +377,7 @@ class Wechat(BaseCrawler):
                             # article['content'] = abstract
                             with open(save_dir / f"{clean_title}.json", 'w', encoding='utf-8') as f:
                                 json.dump(article, f, ensure_ascii=False,indent=4)
+                            record_raw_file(save_dir / f"{clean_title}.json", article)
                             with open(save_dir / 'abstract.md', 'w', encoding='utf-8') as f:
                                 f.write(abstract)
                             self.logger.debug(f"生成摘要成功: {clean_title}")
@@ -388,6 +390,7 @@ class Wechat(BaseCrawler):
                             article['content'] = ""
                             with open(save_dir / f"{clean_title}.json", 'w', encoding='utf-8') as f:
                                 json.dump(article, f, ensure_ascii=False, indent=4)
+                            record_raw_file(save_dir / f"{clean_title}.json", article)
                             self.logger.debug(f"摘要生成失败，已将content置空保存: {clean_title}")
                         except Exception as e:
                             self.logger.exception(e)
@@ -397,6 +400,7 @@ class Wechat(BaseCrawler):
                         article['content'] = content  # 使用原始内容
                         with open(save_dir / f"{clean_title}.json", 'w', encoding='utf-8') as f:
                             json.dump(article, f, ensure_ascii=False, indent=4)
+                        record_raw_file(save_dir / f"{clean_title}.json", article)
                         # self.logger.debug(f"跳过摘要生成，保存原始内容: {clean_title}")
                     except Exception as e:
                         self.logger.exception(e)
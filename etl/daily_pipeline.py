@@ -33,6 +33,8 @@ from etl.indexing.qdrant_indexer import QdrantIndexer
 from etl.load import db_core
 from etl.load.db_pool_manager import close_db_pool, init_db_pool
 from etl.processors.chunk_cache import ChunkCacheManager
+from etl.utils.date import parse_datetime_utc
+from etl.utils.raw_manifest import get_raw_manifest
 from etl import QDRANT_COLLECTION
 from etl.utils.const import (
     university_official_accounts,
@@ -43,6 +45,9 @@ from etl.utils.const import (
 
 logger = register_logger("etl.daily_pipeline")
 
+# 未启用文件清单时，逐个解析文件的最大并发数
+MAX_OPEN_FILES = 64
+
 # 定义洞察分类
 InsightCategory = Literal["官方", "社区", "集市"]
 
@@ -51,32 +56,6 @@ OFFICIAL_WECHAT_SOURCES = set(university_official_accounts + school_official_acc
 COMMUNITY_WECHAT_SOURCES = set(club_official_accounts + unofficial_accounts)
 
 
-def parse_datetime_utc(time_str: str) -> Optional[datetime]:
-    """将字符串稳健地解析为带UTC时区的时间对象"""
-    if not time_str or not isinstance(time_str, str):
-        return None
-    try:
-        # 尝试ISO 8601格式（带或不带'Z'）
-        if time_str.endswith("Z"):
-            time_str = time_str[:-1] + "+00:00"
-        dt = datetime.fromisoformat(time_str)
-        return dt.astimezone(timezone.utc)
-    except (ValueError, TypeError):
-        pass
-
-    # 尝试其他常见格式
-    formats_to_try = ["%Y-%m-%d %H:%M:%S", "%Y-%m-%d"]
-    for fmt in formats_to_try:
-        try:
-            dt = datetime.strptime(time_str, fmt)
-            # 假定为本地时区并转换为UTC
-            return dt.astimezone().astimezone(timezone.utc)
-        except ValueError:
-            continue
-    logger.debug(f"无法解析的时间格式: '{time_str}'")
-    return None
-
-
 async def find_new_files_in_timespan(
     data_dir: Path, start_time: datetime, end_time: datetime, platform_filter: Optional[str] = None
 ) -> List[Path]:
@@ -97,8 +76,8 @@ async def find_new_files_in_timespan(
 
     logger.info(f"将目标扫描范围限定于以下年月目录: {sorted(list(target_months))}")
 
-    # 2. 遍历所有 platform/tag 组合，查找匹配的年月目录，收集文件
-    files_to_check = []
+    # 2. 遍历所有 platform/tag 组合，收集存在的年月目录
+    month_dirs = []
     if not data_dir.is_dir():
         logger.warning(f"数据源目录 {data_dir} 不存在。")
         return []
@@ -114,12 +93,35 @@ async def find_new_files_in_timespan(
             for month_str in target_months:
                 month_dir = tag_dir / month_str
                 if month_dir.is_dir():
-                    files_to_check.extend(month_dir.rglob("*.json"))
+                    month_dirs.append(month_dir)
+
+    # 3. 优先使用文件清单：只stat目标目录，仅重新解析 mtime/大小 变化的文件，再按发布时间范围查询
+    manifest = get_raw_manifest()
+    if manifest is not None:
+        stats = await asyncio.to_thread(manifest.refresh, month_dirs)
+        logger.info(
+            f"文件清单已更新: 扫描 {stats['scanned']} 个文件，重新解析 {stats['parsed']} 个，移除 {stats['removed']} 个"
+        )
+        query_root = data_dir / platform_filter if platform_filter else data_dir
+        candidates = await asyncio.to_thread(manifest.query, start_time, end_time, query_root)
+        new_files = [path for path in candidates if path.exists()]
+        logger.info(f"清单查询完成，在时间范围内找到 {len(new_files)} 个新文件。")
+        return new_files
+
+    files_to_check = []
+    for month_dir in month_dirs:
+        files_to_check.extend(month_dir.rglob("*.json"))
     
     logger.info(f"在目标年月目录中共找到 {len(files_to_check)} 个 .json 文件待精确检查。")
 
-    # 3. 对筛选后的文件进行精确时间检查
-    tasks = [is_file_in_timespan(file_path, start_time, end_time) for file_path in files_to_check]
+    # 4. 对筛选后的文件进行精确时间检查（限制同时打开的文件数）
+    semaphore = asyncio.Semaphore(MAX_OPEN_FILES)
+
+    async def check(file_path: Path) -> Optional[Path]:
+        async with semaphore:
+            return await is_file_in_timespan(file_path, start_time, end_time)
+
+    tasks = [check(file_path) for file_path in files_to_check]
     
     results = await aio_tqdm.gather(
         *tasks, desc="精确扫描文件", unit="个"
@@ -156,16 +158,15 @@ async def process_files_to_nodes(file_paths: List[Path]) -> List[TextNode]:
         return []
     
     chunk_manager = ChunkCacheManager()
-    all_nodes = []
 
-    async def process_single_file(path: Path) -> List[TextNode]:
+    async def read_single_file(path: Path) -> Optional[Document]:
         try:
             async with aiofiles.open(path, "r", encoding="utf-8") as f:
                 content = await f.read()
                 data = json.loads(content)
             
             # 使用Document对象来承载内容和元数据
-            doc = Document(
+            return Document(
                 text=data.get("content", ""),
                 metadata={
                     "doc_id": data.get("id"),
@@ -177,16 +178,16 @@ async def process_files_to_nodes(file_paths: List[Path]) -> List[TextNode]:
                     "file_path": str(path),
                 },
             )
-            return await chunk_manager.chunk_documents_with_cache([doc], show_progress=False)
         except Exception as e:
             logger.warning(f"处理文件 {path} 失败: {e}")
-            return []
+            return None
 
-    tasks = [process_single_file(path) for path in file_paths]
-    results = await aio_tqdm.gather(*tasks, desc="处理并转换节点", unit="个")
-    
-    for node_list in results:
-        all_nodes.extend(node_list)
+    tasks = [read_single_file(path) for path in file_paths]
+    docs = await aio_tqdm.gather(*tasks, desc="读取文件", unit="个")
+    docs = [doc for doc in docs if doc is not None]
+
+    # 整批交给分块缓存：未变化的文档直接复用，只对新增或修改的文档分块
+    all_nodes = await chunk_manager.chunk_documents_with_cache(docs, show_progress=True)
         
     logger.info(f"成功将 {len(file_paths)} 个文件转换为 {len(all_nodes)} 个TextNode。")
     return all_nodes
@@ -220,8 +221,11 @@ async def build_bm25_indexes(nodes: List[TextNode]):
         logger.warning("没有节点需要索引，跳过BM25索引步骤。")
         return
     bm25_indexer = BM25Indexer()
-    logger.info(f"开始为 {len(nodes)} 个节点建立BM25索引...")
-    await bm25_indexer.build_from_nodes(nodes)
+    logger.info(f"开始为 {len(nodes)} 个节点增量更新BM25索引...")
+    result = await bm25_indexer.update_from_nodes(nodes)
+    if not result.get("success"):
+        logger.error(f"BM25索引增量更新失败: {result.get('error')}")
+        return
     logger.info("BM25索引建立完成。")
 
 
@@ -0,0 +1,133 @@
+"""
+查询嵌入动态批处理
+
+并发请求各自以batch=1调用 SentenceTransformer.encode，既浪费CPU的SIMD吞吐，
+又会在多个线程间争抢计算资源。EmbeddingBatcher 在单个后台线程中收集一个小时间窗口
+（max_wait_ms）或至多 max_batch_size 个请求，合并为一次批量encode，再把结果分发回各请求。
+
+同步调用方使用 submit(text).result()，异步调用方使用 await batcher.aembed(text)。
+"""
+import asyncio
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, List, Dict, Any
+
+from core.utils.logger import register_logger
+
+logger = register_logger("etl.embedding.batcher")
+
+
+class EmbeddingBatcher:
+    """将并发的单条嵌入请求合并为批量计算"""
+
+    def __init__(
+        self,
+        encode_fn: Callable[[List[str]], List[List[float]]],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+        name: str = "embedding",
+    ):
+        self._encode_fn = encode_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: "queue.Queue" = queue.Queue()
+        self._closed = False
+
+        # 指标
+        self._lock = threading.Lock()
+        self.total_requests = 0
+        self.total_batches = 0
+        self.max_queue_depth = 0
+        self._recent_batch_sizes = deque(maxlen=1000)
+        self._recent_wait_ms = deque(maxlen=1000)
+
+        self._thread = threading.Thread(target=self._run, name=f"{name}-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, text: str) -> Future:
+        """提交一条文本，返回结果Future"""
+        if self._closed:
+            raise RuntimeError("EmbeddingBatcher已关闭")
+        future: Future = Future()
+        self._queue.put((text, future, time.perf_counter()))
+        depth = self._queue.qsize()
+        with self._lock:
+            self.total_requests += 1
+            if depth > self.max_queue_depth:
+                self.max_queue_depth = depth
+        return future
+
+    async def aembed(self, text: str) -> List[float]:
+        return await asyncio.wrap_future(self.submit(text))
+
+    def _collect(self):
+        """阻塞等待第一条请求，然后在时间窗口内尽量凑满一批；返回 (批, 是否收到退出信号)"""
+        first = self._queue.get()
+        if first is None:
+            return [], True
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = self._collect()
+            if not batch:
+                break
+            texts = [text for text, _, _ in batch]
+            start = time.perf_counter()
+            try:
+                embeddings = self._encode_fn(texts)
+            except Exception as e:
+                logger.error(f"批量嵌入计算失败 (batch={len(texts)}): {e}")
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future, _), embedding in zip(batch, embeddings):
+                future.set_result(embedding)
+
+            with self._lock:
+                self.total_batches += 1
+                self._recent_batch_sizes.append(len(batch))
+                self._recent_wait_ms.extend((start - enqueued) * 1000 for _, _, enqueued in batch)
+
+    def stop(self):
+        """通知后台线程退出（不等待），已入队的请求会先处理完"""
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+
+    def close(self):
+        """停止后台线程并等待其退出"""
+        self.stop()
+        self._thread.join(timeout=5)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            sizes = list(self._recent_batch_sizes)
+            waits = sorted(self._recent_wait_ms)
+            return {
+                "queue_depth": self._queue.qsize(),
+                "max_queue_depth": self.max_queue_depth,
+                "total_requests": self.total_requests,
+                "total_batches": self.total_batches,
+                "avg_batch_size": sum(sizes) / len(sizes) if sizes else 0.0,
+                "max_batch_size_seen": max(sizes) if sizes else 0,
+                "p50_wait_ms": waits[len(waits) // 2] if waits else 0.0,
+                "p95_wait_ms": waits[int(len(waits) * 0.95)] if waits else 0.0,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+            }
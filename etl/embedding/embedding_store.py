@@ -0,0 +1,233 @@
+"""
+文本嵌入持久化存储
+
+重建索引或每日增量时，绝大多数分块文本与上次相比并未变化，但 QdrantIndexer 每次都会在CPU上
+重新计算全部嵌入。EmbeddingStore 以 sha1(模型名, embed_type, get_node_content文本) 为键保存向量，
+只有新增或内容变化的分块才需要重新计算。
+
+存储布局（每个模型一个目录，目录内向量维度固定）：
+    vectors.bin    只追加的行主序向量文件，按 np.memmap 映射读取
+    index.sqlite   键 -> 行号 的索引，以及 dim / dtype 元数据
+    write.lock     追加时持有的文件锁；多个索引进程共享同一存储时，行号由加锁后的文件大小决定
+
+配置项（etl.embedding.store.*）：
+    enabled   是否启用，默认True
+    path      存储根目录，默认 CACHE_PATH/embeddings/store
+    dtype     向量存储精度：float32 / float16，默认float32
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, Optional, Dict, Any, Union
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows 下只有进程内的线程锁
+    fcntl = None
+
+from config import Config
+from core.utils.logger import register_logger
+from etl import CACHE_PATH
+
+logger = register_logger("etl.embedding.embedding_store")
+config = Config()
+
+# sqlite单条语句的参数数量上限
+_SQLITE_MAX_PARAMS = 900
+
+
+def make_embedding_key(model_name: str, embed_type: int, text: str) -> str:
+    return hashlib.sha1(f"{model_name}\x00{embed_type}\x00{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """以内容哈希为键的向量存储：只追加的memmap向量文件 + sqlite键索引"""
+
+    def __init__(self, path: Union[str, Path], dtype: str = "float32"):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._vectors_path = self.path / "vectors.bin"
+        self._lock_path = self.path / "write.lock"
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path / "index.sqlite"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, row INTEGER NOT NULL)")
+        self._conn.commit()
+
+        meta = dict(self._conn.execute("SELECT name, value FROM meta").fetchall())
+        # 已有存储沿用其创建时的精度，避免同一文件中混用
+        self.dtype = np.dtype(meta.get("dtype", dtype))
+        self.dim: Optional[int] = int(meta["dim"]) if "dim" in meta else None
+        self._rows = 0
+        self._mmap: Optional[np.memmap] = None
+        if self.dim is not None:
+            # 只读取完整行数：末尾的半行可能是其他进程正在追加的数据，截断留给持锁的 put_many
+            self._rows = self._complete_rows()
+
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def _row_bytes(self) -> int:
+        return self.dim * self.dtype.itemsize
+
+    def _complete_rows(self) -> int:
+        """按文件大小计算的完整行数，不修改文件"""
+        if not self._vectors_path.exists():
+            return 0
+        return self._vectors_path.stat().st_size // self._row_bytes
+
+    def _recover_rows(self) -> int:
+        """截掉上次异常退出时写了一半的行，返回完整行数；必须持有 _write_lock()"""
+        if not self._vectors_path.exists():
+            return 0
+        size = self._vectors_path.stat().st_size
+        rows, remainder = divmod(size, self._row_bytes)
+        if remainder:
+            logger.warning(f"嵌入存储 {self._vectors_path} 末尾存在不完整的行，已截断")
+            with open(self._vectors_path, "r+b") as f:
+                f.truncate(rows * self._row_bytes)
+        return rows
+
+    @contextmanager
+    def _write_lock(self):
+        """跨进程的追加锁，需在持有 self._lock 时使用"""
+        if fcntl is None:
+            yield
+            return
+        with open(self._lock_path, "a+b") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _mapped(self) -> np.memmap:
+        """返回覆盖当前全部行的只读映射，文件追加后重新映射"""
+        if self._mmap is None or self._mmap.shape[0] < self._rows:
+            self._mmap = np.memmap(self._vectors_path, dtype=self.dtype, mode="r", shape=(self._rows, self.dim))
+        return self._mmap
+
+    def __len__(self) -> int:
+        return self._rows
+
+    def get_many(self, keys: List[str]) -> List[Optional[List[float]]]:
+        """批量读取，未命中的位置为None"""
+        rows: Dict[str, int] = {}
+        with self._lock:
+            if self._rows:
+                for start in range(0, len(keys), _SQLITE_MAX_PARAMS):
+                    batch = keys[start:start + _SQLITE_MAX_PARAMS]
+                    rows.update(self._conn.execute(
+                        f"SELECT key, row FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                    ).fetchall())
+            if rows and max(rows.values()) >= self._rows:
+                # 其他进程追加了新行，按文件大小刷新行数
+                self._rows = self._complete_rows()
+            vectors = self._mapped() if rows else None
+            result = [
+                vectors[rows[key]].astype(np.float32).tolist() if key in rows else None
+                for key in keys
+            ]
+            self.hits += len(keys) - result.count(None)
+            self.misses += result.count(None)
+        return result
+
+    def put_many(self, keys: List[str], embeddings: List[List[float]]):
+        """批量追加向量，已存在的键跳过"""
+        if not keys:
+            return
+        matrix = np.asarray(embeddings, dtype=self.dtype)
+        with self._lock, self._write_lock():
+            if self.dim is None:
+                # 其他进程可能已先写入元数据
+                row = self._conn.execute("SELECT value FROM meta WHERE name = 'dim'").fetchone()
+                if row is not None:
+                    self.dim = int(row[0])
+                else:
+                    self.dim = int(matrix.shape[1])
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)",
+                        [("dim", str(self.dim)), ("dtype", self.dtype.name)],
+                    )
+                    self._conn.commit()
+            if matrix.shape[1] != self.dim:
+                raise ValueError(f"向量维度 {matrix.shape[1]} 与存储维度 {self.dim} 不一致")
+
+            # 同一批内的重复键只保留第一条
+            positions: Dict[str, int] = {}
+            for i, key in enumerate(keys):
+                positions.setdefault(key, i)
+            existing = set()
+            unique = list(positions)
+            for start in range(0, len(unique), _SQLITE_MAX_PARAMS):
+                batch = unique[start:start + _SQLITE_MAX_PARAMS]
+                existing.update(row[0] for row in self._conn.execute(
+                    f"SELECT key FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                ))
+            new_keys = [key for key in unique if key not in existing]
+            if not new_keys:
+                return
+
+            # 行号取自加锁后的文件大小而不是本进程的计数，其他进程的追加不会造成行号冲突；
+            # 同时截掉异常退出留下的半行
+            first_row = self._recover_rows()
+            # 先写向量再写索引：中途退出只会留下无索引的孤立行，不会出现指向无效数据的键
+            with open(self._vectors_path, "ab") as f:
+                f.write(np.ascontiguousarray(matrix[[positions[key] for key in new_keys]]).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            self._conn.executemany(
+                "INSERT INTO embeddings (key, row) VALUES (?, ?)",
+                [(key, first_row + i) for i, key in enumerate(new_keys)],
+            )
+            self._conn.commit()
+            self._rows = first_row + len(new_keys)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "path": str(self.path),
+                "rows": self._rows,
+                "dim": self.dim,
+                "dtype": self.dtype.name,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def close(self):
+        with self._lock:
+            self._mmap = None
+            self._conn.close()
+
+
+_stores: Dict[str, EmbeddingStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_embedding_store(model_name: str) -> Optional[EmbeddingStore]:
+    """获取指定模型的共享嵌入存储，配置关闭或初始化失败时返回None"""
+    if not config.get("etl.embedding.store.enabled", True):
+        return None
+    with _stores_lock:
+        store = _stores.get(model_name)
+        if store is None:
+            root = Path(config.get("etl.embedding.store.path") or CACHE_PATH / "embeddings" / "store")
+            slug = re.sub(r"[^0-9A-Za-z._-]+", "_", model_name.strip("/"))
+            try:
+                store = EmbeddingStore(root / slug, dtype=config.get("etl.embedding.store.dtype", "float32"))
+            except Exception as e:
+                logger.warning(f"嵌入存储初始化失败，将不使用缓存: {e}")
+                return None
+            _stores[model_name] = store
+    return store
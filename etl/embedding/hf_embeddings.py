@@ -1,10 +1,16 @@
 import asyncio
+import weakref
 from typing import List, Any
 from sentence_transformers import SentenceTransformer
 from llama_index.core.base.embeddings.base import BaseEmbedding
 from llama_index.core.bridge.pydantic import Field, ConfigDict
 from llama_index.core.schema import BaseNode
 from etl.processors.nodes import get_node_content
+from etl.embedding.query_cache import get_query_embedding_cache
+from etl.embedding.batcher import EmbeddingBatcher
+from config import Config
+
+config = Config()
 
 class HuggingFaceEmbedding(BaseEmbedding):
     model_config = ConfigDict(
@@ -37,6 +43,20 @@ class HuggingFaceEmbedding(BaseEmbedding):
             device=kwargs.get('device', 'cpu'),
             trust_remote_code=True
         )
+        self._model_key = model_name
+        self._query_cache = get_query_embedding_cache()
+        # 查询嵌入动态批处理：并发的单条查询合并为一次encode
+        self._batcher = None
+        if kwargs.get('query_batching', config.get('etl.embedding.batching.enabled', True)):
+            # 批处理线程只持有弱引用，管道热替换后旧模型可以被回收
+            embed_ref = weakref.WeakMethod(self._embed)
+            self._batcher = EmbeddingBatcher(
+                lambda texts: embed_ref()(texts),
+                max_batch_size=config.get('etl.embedding.batching.max_batch_size', 32),
+                max_wait_ms=config.get('etl.embedding.batching.max_wait_ms', 5.0),
+                name=model_name.split('/')[-1],
+            )
+            weakref.finalize(self, self._batcher.stop)
 
     @classmethod
     def class_name(cls) -> str:
@@ -45,11 +65,51 @@ class HuggingFaceEmbedding(BaseEmbedding):
     def _embed(self, texts: List[str]) -> List[List[float]]:
         return self._model.encode(texts, normalize_embeddings=self.normalize).tolist()
 
-    def _get_query_embedding(self, query: str) -> List[float]:
+    def _compute_query_embedding(self, query: str) -> List[float]:
+        if self._batcher is not None:
+            return self._batcher.submit(query).result()
         return self._embed([query])[0]
 
+    def _get_query_embedding(self, query: str) -> List[float]:
+        if self._query_cache is None:
+            return self._compute_query_embedding(query)
+        key = self._query_cache.make_key(self._model_key, query)
+        embedding = self._query_cache.get(key)
+        if embedding is None:
+            embedding = self._compute_query_embedding(query)
+            self._query_cache.put(key, embedding)
+        return embedding
+
     async def _aget_query_embedding(self, query: str) -> List[float]:
-        return await asyncio.to_thread(self._get_query_embedding, query)
+        cache = self._query_cache
+        key = cache.make_key(self._model_key, query) if cache is not None else None
+        if cache is not None and cache.backend is not None:
+            # 持久化后端涉及I/O：内存命中直接返回，否则整体放到线程中
+            embedding = cache.get_local(key)
+            if embedding is not None:
+                return embedding
+            return await asyncio.to_thread(self._get_query_embedding, query)
+        
+        if cache is not None:
+            embedding = cache.get(key)
+            if embedding is not None:
+                return embedding
+        if self._batcher is not None:
+            # 直接等待批处理结果，不占用线程池
+            embedding = await self._batcher.aembed(query)
+        else:
+            embedding = (await asyncio.to_thread(self._embed, [query]))[0]
+        if cache is not None:
+            cache.put(key, embedding)
+        return embedding
+
+    def query_cache_stats(self):
+        """查询嵌入缓存的命中统计"""
+        return self._query_cache.stats() if self._query_cache is not None else None
+
+    def batcher_stats(self):
+        """查询嵌入批处理的队列深度和批大小统计"""
+        return self._batcher.stats() if self._batcher is not None else None
 
     def _get_text_embedding(self, text: str) -> List[float]:
         return self._embed([text])[0]
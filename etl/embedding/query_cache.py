@@ -0,0 +1,189 @@
+"""
+查询嵌入缓存
+
+校园场景中的热门查询高度重复，每次都在CPU上运行一遍 bge-large-zh 前向计算代价很高。
+QueryEmbeddingCache 以 (模型名, 归一化查询文本) 为键缓存查询向量：
+
+- 进程内有界LRU（线程安全），统计命中/未命中次数
+- 可选的持久化后端，LRU未命中时再查询：
+    sqlite  本地文件，多进程共享且重启后保留
+    redis   使用 etl 中的 REDIS_* 配置，多实例共享
+
+配置项（etl.embedding.query_cache.*）：
+    enabled   是否启用，默认True
+    size      LRU容量，默认4096
+    backend   持久化后端：none / sqlite / redis，默认none
+    path      sqlite文件路径，默认 CACHE_PATH/embeddings/query_embeddings.sqlite
+    ttl       redis键过期时间（秒），默认7天
+"""
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Optional, Dict, Any
+
+import numpy as np
+
+from config import Config
+from core.utils.logger import register_logger
+from etl import CACHE_PATH, REDIS_HOST, REDIS_PORT, REDIS_DB, REDIS_PASSWORD
+
+logger = register_logger("etl.embedding.query_cache")
+config = Config()
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    """归一化查询文本：全半角统一、去首尾空白、合并连续空白、英文小写"""
+    query = unicodedata.normalize("NFKC", query or "")
+    return _WHITESPACE.sub(" ", query).strip().lower()
+
+
+class _SqliteBackend:
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS query_embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            row = self._conn.execute("SELECT vector FROM query_embeddings WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: bytes):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO query_embeddings (key, vector) VALUES (?, ?)", (key, value))
+            self._conn.commit()
+
+
+class _RedisBackend:
+    def __init__(self, ttl: int):
+        import redis
+        self._client = redis.Redis(
+            host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB, password=REDIS_PASSWORD,
+            socket_timeout=0.5, socket_connect_timeout=0.5,
+        )
+        self._ttl = ttl
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._client.get(f"qemb:{key}")
+
+    def set(self, key: str, value: bytes):
+        self._client.set(f"qemb:{key}", value, ex=self._ttl)
+
+
+class QueryEmbeddingCache:
+    """有界LRU查询嵌入缓存，可选sqlite/redis持久化后端"""
+
+    def __init__(self, max_size: int = 4096, backend: Optional[Any] = None):
+        self.max_size = max_size
+        self.backend = backend
+        self._data: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.backend_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model_name: str, query: str) -> str:
+        return f"{model_name}:{normalize_query(query)}"
+
+    def get_local(self, key: str) -> Optional[List[float]]:
+        """只查询进程内LRU（不做I/O，可在事件循环中调用）"""
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+                self.hits += 1
+            return value
+
+    def get(self, key: str) -> Optional[List[float]]:
+        """查询LRU，未命中时查询持久化后端并回填LRU"""
+        value = self.get_local(key)
+        if value is not None:
+            return value
+        if self.backend is not None:
+            try:
+                raw = self.backend.get(key)
+            except Exception as e:
+                logger.warning(f"查询嵌入缓存后端读取失败: {e}")
+                raw = None
+            if raw is not None:
+                value = np.frombuffer(raw, dtype=np.float32).tolist()
+                self._put_local(key, value)
+                with self._lock:
+                    self.backend_hits += 1
+                return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _put_local(self, key: str, value: List[float]):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def put(self, key: str, value: List[float]):
+        self._put_local(key, value)
+        if self.backend is not None:
+            try:
+                self.backend.set(key, np.asarray(value, dtype=np.float32).tobytes())
+            except Exception as e:
+                logger.warning(f"查询嵌入缓存后端写入失败: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.backend_hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "backend": type(self.backend).__name__ if self.backend else None,
+                "hits": self.hits,
+                "backend_hits": self.backend_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.backend_hits) / total if total else 0.0,
+            }
+
+
+_query_cache: Optional[QueryEmbeddingCache] = None
+_query_cache_lock = threading.Lock()
+
+
+def _create_backend(name: str):
+    if name == "sqlite":
+        path = config.get("etl.embedding.query_cache.path") or CACHE_PATH / "embeddings" / "query_embeddings.sqlite"
+        return _SqliteBackend(Path(path))
+    if name == "redis":
+        return _RedisBackend(ttl=config.get("etl.embedding.query_cache.ttl", 7 * 24 * 3600))
+    return None
+
+
+def get_query_embedding_cache() -> Optional[QueryEmbeddingCache]:
+    """获取进程内共享的查询嵌入缓存，未启用时返回None"""
+    global _query_cache
+    if not config.get("etl.embedding.query_cache.enabled", True):
+        return None
+    if _query_cache is None:
+        with _query_cache_lock:
+            if _query_cache is None:
+                backend_name = config.get("etl.embedding.query_cache.backend", "none")
+                try:
+                    backend = _create_backend(backend_name)
+                except Exception as e:
+                    logger.warning(f"查询嵌入缓存后端 {backend_name} 初始化失败，仅使用内存缓存: {e}")
+                    backend = None
+                _query_cache = QueryEmbeddingCache(
+                    max_size=config.get("etl.embedding.query_cache.size", 4096),
+                    backend=backend,
+                )
+    return _query_cache
@@ -22,11 +22,15 @@ sys.path.append(str(Path(__file__).resolve().parent.parent.parent))
 from config import Config
 from etl.load import db_core
 from etl.retrieval.retrievers import BM25Retriever
+from etl.retrieval.bm25_index import BM25BinaryIndex, BM25SegmentedIndex, read_index_meta, is_binary_index
+from etl.retrieval.bm25_tokenizer import tokenize_corpus
+from etl.rag.answer_cache import mark_sources_reindexed, source_keys
 from llama_index.core.schema import BaseNode, TextNode
 # 导入ETL模块的统一路径配置
-from etl import (INDEX_PATH, NLTK_PATH, RAW_PATH, BM25_ENABLE_CHUNKING, CHUNK_SIZE, CHUNK_OVERLAP, BM25_NODES_PATH, STOPWORDS_PATH)
+from etl import (INDEX_PATH, NLTK_PATH, RAW_PATH, BM25_ENABLE_CHUNKING, CHUNK_SIZE, CHUNK_OVERLAP, BM25_NODES_PATH, BM25_INDEX_DIR, STOPWORDS_PATH)
 
 logger = logging.getLogger(__name__)
+config = Config()
 
 
 class BM25Indexer:
@@ -40,6 +44,13 @@ class BM25Indexer:
         
         # 使用ETL模块统一配置的路径
         self.output_path = BM25_NODES_PATH
+        self.index_dir = BM25_INDEX_DIR
+        # 旧版pickle格式仅在显式开启时写出（兼容尚未升级的读取端）
+        self.save_pickle = config.get('etl.retrieval.bm25.save_pickle', False)
+        
+        # 段合并阈值：段数超过上限或已删除文档比例过高时压缩
+        self.compaction_max_segments = config.get('etl.retrieval.bm25.compaction.max_segments', 8)
+        self.compaction_max_deleted_ratio = config.get('etl.retrieval.bm25.compaction.max_deleted_ratio', 0.2)
         self.stopwords_path = STOPWORDS_PATH
         
         # 分块参数（可选，用于支持长文档）
@@ -70,7 +81,7 @@ class BM25Indexer:
         Returns:
             构建结果统计
         """
-        self.logger.info(f"开始构建BM25索引，输出路径: {self.output_path}")
+        self.logger.info(f"开始构建BM25索引，输出路径: {self.index_dir}")
         
         try:
             # 确保输出目录存在
@@ -123,10 +134,8 @@ class BM25Indexer:
             if not test_mode:
                 print("💾 保存索引文件...")
                 with tqdm(total=1, desc="保存索引", unit="文件") as pbar:
-                    # 使用BM25检索器的自定义保存方法
-                    bm25_retriever.save_to_pickle(self.output_path)
+                    await self._save_index(bm25_retriever)
                     pbar.update(1)
-                self.logger.info(f"BM25检索器已保存到: {self.output_path}")
             else:
                 self.logger.info("测试模式：跳过文件保存")
             
@@ -134,7 +143,7 @@ class BM25Indexer:
             return {
                 "total_nodes": len(nodes),
                 "success": True,
-                "output_path": self.output_path,
+                "output_path": self.index_dir,
                 "bm25_type": bm25_type,
                 "message": f"成功构建BM25索引，包含 {len(nodes)} 个节点"
             }
@@ -179,18 +188,18 @@ class BM25Indexer:
                 nodes, jieba, stopwords, bm25_type
             )
             
-            # 保存索引文件
+            # 保存索引文件，全量重建后所有缓存答案失效
             if not test_mode:
                 await aiofiles.os.makedirs(os.path.dirname(self.output_path), exist_ok=True)
-                bm25_retriever.save_to_pickle(self.output_path)
-                self.logger.info(f"BM25检索器已保存到: {self.output_path}")
+                await self._save_index(bm25_retriever)
+                await asyncio.to_thread(mark_sources_reindexed, None)
             else:
                 self.logger.info("测试模式：跳过文件保存")
             
             return {
                 "success": True,
                 "total_nodes": len(nodes),
-                "output_path": self.output_path,
+                "output_path": self.index_dir,
                 "message": f"成功从 {len(nodes)} 个节点构建了BM25索引。"
             }
             
@@ -198,6 +207,120 @@ class BM25Indexer:
             self.logger.error(f"从节点构建BM25索引时出错: {e}")
             return {"success": False, "error": str(e)}
 
+    async def update_from_nodes(self,
+                                nodes: List[BaseNode],
+                                deleted_node_ids: Optional[List[str]] = None,
+                                bm25_type: int = 0,
+                                test_mode: bool = False) -> Dict[str, Any]:
+        """
+        增量更新BM25索引：新节点作为新段追加，同一文档的旧节点和指定的节点ID
+        被标记删除，耗时与增量大小成正比。
+        
+        二进制索引不存在时，若有旧版pickle索引则先以其为基础迁移，再应用增量；
+        两者都不存在时拒绝更新——增量节点只是语料的一部分，不能用来建立完整索引。
+        
+        Args:
+            nodes: 新增或更新的节点
+            deleted_node_ids: 需要删除的节点ID
+            bm25_type: BM25算法类型（仅在全量构建时生效）
+            test_mode: 测试模式，不实际保存文件
+            
+        Returns:
+            更新结果统计
+        """
+        seed_from_pickle = False
+        if not is_binary_index(self.index_dir):
+            if not os.path.exists(self.output_path):
+                message = (f"BM25索引不存在（{self.index_dir} 与 {self.output_path} 均未找到），"
+                           "增量节点不足以构建完整索引，请先执行全量构建")
+                self.logger.error(message)
+                return {"success": False, "error": message}
+            self.logger.info(f"BM25二进制索引不存在，从旧版pickle索引 {self.output_path} 迁移后应用增量")
+            seed_from_pickle = True
+        
+        self.logger.info(f"开始增量更新BM25索引: 新增 {len(nodes)} 个节点，删除 {len(deleted_node_ids or [])} 个节点")
+        
+        try:
+            import jieba
+            stopwords = await self._load_stopwords()
+            loop = asyncio.get_running_loop()
+            
+            def _update():
+                if seed_from_pickle:
+                    retriever = BM25Retriever.load_from_pickle(self.output_path, tokenizer=jieba)
+                else:
+                    retriever = BM25Retriever.from_binary_index(self.index_dir, tokenizer=jieba, stopwords=stopwords)
+                replaced = retriever.add_nodes(nodes) if nodes else 0
+                deleted = retriever.delete_nodes(deleted_node_ids) if deleted_node_ids else 0
+                return retriever, replaced, deleted
+            
+            bm25_retriever, replaced, deleted = await loop.run_in_executor(None, _update)
+            index = bm25_retriever.bm25
+            compacted = False
+            
+            if test_mode:
+                self.logger.info("测试模式：跳过文件保存")
+            else:
+                await loop.run_in_executor(None, bm25_retriever.save_to_binary_index, self.index_dir)
+                await asyncio.to_thread(
+                    mark_sources_reindexed,
+                    [key for node in nodes for key in source_keys(node.metadata, node.node_id)]
+                    + list(deleted_node_ids or [])
+                )
+                self.logger.info(
+                    f"BM25增量更新已保存: 段数 {len(index.segments)}，存活文档 {index.corpus_size}，"
+                    f"已删除 {index.num_deleted}"
+                )
+                compacted = await self._maybe_compact(bm25_retriever)
+            
+            return {
+                "success": True,
+                "total_nodes": index.corpus_size,
+                "added_nodes": len(nodes),
+                "replaced_nodes": replaced,
+                "deleted_nodes": deleted,
+                "segments": len(bm25_retriever.bm25.segments),
+                "compacted": compacted,
+                "output_path": self.index_dir,
+                "message": f"增量更新BM25索引：新增 {len(nodes)} 个节点，替换 {replaced} 个，删除 {deleted} 个"
+            }
+        except Exception as e:
+            self.logger.error(f"增量更新BM25索引时出错: {e}")
+            return {"success": False, "error": str(e)}
+
+    async def _maybe_compact(self, bm25_retriever: BM25Retriever) -> bool:
+        """
+        在工作线程中合并段。增量数据此时已落盘，压缩失败不影响索引可用性；
+        正在服务的进程继续使用旧段，直到重新加载索引。
+        """
+        index = bm25_retriever.bm25
+        if not index.needs_compaction(self.compaction_max_segments, self.compaction_max_deleted_ratio):
+            return False
+        
+        self.logger.info(f"开始压缩BM25索引: {len(index.segments)} 个段，{index.num_deleted} 个已删除文档")
+        
+        def _compact():
+            bm25_retriever.compact()
+            bm25_retriever.save_to_binary_index(self.index_dir)
+        
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, _compact)
+            self.logger.info(f"BM25索引压缩完成，存活文档 {bm25_retriever.bm25.corpus_size}")
+            return True
+        except Exception as e:
+            self.logger.error(f"压缩BM25索引失败（增量数据已保存）: {e}")
+            return False
+
+    async def _save_index(self, bm25_retriever: BM25Retriever):
+        """保存BM25索引：默认写入memmap二进制索引目录，按配置额外写出旧版pickle"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, bm25_retriever.save_to_binary_index, self.index_dir)
+        self.logger.info(f"BM25二进制索引已保存到: {self.index_dir}")
+        
+        if self.save_pickle:
+            await loop.run_in_executor(None, bm25_retriever.save_to_pickle, self.output_path)
+            self.logger.info(f"BM25检索器pickle已保存到: {self.output_path}")
+
     async def _load_stopwords(self) -> List[str]:
         """异步加载停用词"""
         stopwords = []
@@ -570,21 +693,23 @@ class BM25Indexer:
         
         def _build_bm25():
             """在线程池中运行的同步构建函数"""
-            # 步骤1: 预处理文本和分词
-            corpus = []
+            # 步骤1: 预处理文本和分词（多进程 + 分词缓存，未变化的文档不会重复分词）
+            contents = []
+            for node in nodes:
+                try:
+                    contents.append(get_node_content(node, embed_type=0))
+                except Exception as e:
+                    self.logger.warning(f"获取节点内容失败: {e}")
+                    contents.append("")
             
-            with tqdm(nodes, desc="分词处理", unit="文档") as pbar:
-                for node in pbar:
-                    try:
-                        # 获取节点内容
-                        content = get_node_content(node, embed_type=0)
-                        # 分词并去除停用词
-                        tokens = tokenize_and_remove_stopwords(tokenizer, content, stopwords=stopwords)
-                        corpus.append(tokens)
-                        pbar.set_postfix({'已处理': len(corpus)})
-                    except Exception as e:
-                        self.logger.warning(f"分词处理节点失败: {e}")
-                        corpus.append([])  # 添加空列表避免索引错误
+            with tqdm(total=len(nodes), desc="分词处理", unit="文档") as pbar:
+                if tokenizer is jieba:
+                    corpus = tokenize_corpus(contents, stopwords, progress=pbar.update)
+                else:
+                    corpus = []
+                    for content in contents:
+                        corpus.append(tokenize_and_remove_stopwords(tokenizer, content, stopwords=stopwords))
+                        pbar.update(1)
             
             if not any(corpus):
                 raise ValueError("所有文档在分词后都为空")
@@ -592,7 +717,13 @@ class BM25Indexer:
             # 步骤2: 构建BM25索引
             with tqdm(total=1, desc="构建BM25索引", unit="索引") as pbar:
                 try:
-                    if bm25_type == 1:
+                    if not self.save_pickle:
+                        # 只写出二进制索引时直接构建倒排表，跳过rank_bm25的统计计算
+                        bm25_instance = BM25SegmentedIndex.from_index(
+                            BM25BinaryIndex.from_corpus(corpus, k1=1.5, b=0.75, epsilon=0.25, bm25_type=bm25_type),
+                            nodes,
+                        )
+                    elif bm25_type == 1:
                         import bm25s
                         bm25_instance = bm25s.BM25(k1=1.5, b=0.75)
                         bm25_instance.index(corpus)
@@ -611,7 +742,8 @@ class BM25Indexer:
                     tokenizer=tokenizer,
                     stopwords=stopwords,
                     bm25_type=bm25_type,
-                    fast_mode=False,  # 确保立即初始化
+                    fast_mode=True,  # 索引已在上面构建，避免检索器内部重复分词
+                    lazy_init=True,
                     verbose=True
                 )
                 # 手动设置已构建的BM25索引和语料库
@@ -660,7 +792,27 @@ class BM25Indexer:
             return text.split()  # 降级到简单空格分割
     
     async def validate_index(self) -> Dict[str, Any]:
-        """异步验证索引文件是否存在且有效"""
+        """异步验证索引文件是否存在且有效（优先检查二进制索引目录）"""
+        try:
+            meta = read_index_meta(self.index_dir)
+            if meta.get("num_docs", 0) <= 0:
+                return {
+                    "valid": False,
+                    "message": "索引目录为空"
+                }
+            return {
+                "valid": True,
+                "message": f"二进制索引有效，包含 {meta['num_docs']} 个节点",
+                "node_count": meta["num_docs"]
+            }
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            return {
+                "valid": False,
+                "message": f"读取索引目录时出错: {str(e)}"
+            }
+        
         exists = False
         try:
             await aiofiles.os.stat(self.output_path)
@@ -671,7 +823,7 @@ class BM25Indexer:
         if not exists:
             return {
                 "valid": False,
-                "message": f"索引文件不存在: {self.output_path}"
+                "message": f"索引文件不存在: {self.index_dir}"
             }
         
         def _load_pickle(data: bytes) -> Any:
@@ -682,7 +834,9 @@ class BM25Indexer:
                 data = await f.read()
             
             loop = asyncio.get_running_loop()
-            nodes = await loop.run_in_executor(None, _load_pickle, data)
+            state = await loop.run_in_executor(None, _load_pickle, data)
+            # 新格式pickle为状态字典，节点列表在'nodes'键下
+            nodes = state.get('nodes') if isinstance(state, dict) else state
             
             if not isinstance(nodes, list) or len(nodes) == 0:
                 return {
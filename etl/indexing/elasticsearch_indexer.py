@@ -24,6 +24,65 @@ from config import Config
 from etl.load import db_core
 # 导入ETL模块的统一路径配置
 from etl import (RAW_PATH, ES_INDEX_NAME, ES_HOST, ES_PORT, ES_ENABLE_CHUNKING, CHUNK_SIZE, CHUNK_OVERLAP)
+from etl.retrieval.es_query import WILDCARD_SUBFIELD
+from etl.rag.answer_cache import mark_sources_reindexed, source_keys
+
+
+def build_index_mapping(wildcard_acceleration: bool = True) -> Dict[str, Any]:
+    """
+    构建Elasticsearch索引的映射与设置
+    
+    Args:
+        wildcard_acceleration: 是否为title/content添加wildcard类型子字段（{field}.wc）。
+            wildcard字段以ngram近似索引加速任意位置的通配符，前导通配符不再扫描整个词典，
+            查询计划见 etl/retrieval/es_query.py
+    """
+    text_field = {
+        "type": "text",
+        "analyzer": "ik_max_word",
+        "search_analyzer": "ik_smart"
+    }
+    title_field = dict(text_field, fields={"keyword": {"type": "keyword", "ignore_above": 256}})
+    content_field = dict(text_field)
+    if wildcard_acceleration:
+        title_field["fields"][WILDCARD_SUBFIELD] = {"type": "wildcard"}
+        content_field["fields"] = {WILDCARD_SUBFIELD: {"type": "wildcard"}}
+    
+    return {
+        "mappings": {
+            "properties": {
+                "url": {
+                    "type": "keyword",
+                    "index": True
+                },
+                "title": title_field,
+                "content": content_field,
+                "publish_time": {
+                    "type": "date",
+                    "format": "yyyy-MM-dd||yyyy-MM-dd HH:mm:ss||epoch_millis"
+                },
+                "platform": {
+                    "type": "keyword",
+                    "index": True
+                },
+                "pagerank_score": {
+                    "type": "float"
+                }
+            }
+        },
+        "settings": {
+            "number_of_shards": 1,
+            "number_of_replicas": 0,
+            "analysis": {
+                "analyzer": {
+                    "default": {
+                        "type": "ik_max_word"
+                    }
+                }
+            }
+        }
+    }
+
 
 class ElasticsearchIndexer:
     """Elasticsearch索引构建器
@@ -170,6 +229,10 @@ class ElasticsearchIndexer:
 
             # 2. 使用 helpers.async_bulk 批量索引
             indexed, errors = await helpers.async_bulk(es_client, actions, chunk_size=batch_size)
+            await asyncio.to_thread(
+                mark_sources_reindexed,
+                [key for node in nodes for key in source_keys(node.metadata, node.id_)]
+            )
             
             result = {
                 "success": True,
@@ -241,48 +304,10 @@ class ElasticsearchIndexer:
             # 使用IK分析器进行中文分词
             self.logger.info("使用IK分析器进行中文分词")
             
-            mapping = {
-                "mappings": {
-                    "properties": {
-                        "url": {
-                            "type": "keyword",
-                            "index": True
-                        },
-                        "title": {
-                            "type": "text",
-                            "analyzer": "ik_max_word",
-                            "search_analyzer": "ik_smart"
-                        },
-                        "content": {
-                            "type": "text",
-                            "analyzer": "ik_max_word",
-                            "search_analyzer": "ik_smart"
-                        },
-                        "publish_time": {
-                            "type": "date",
-                            "format": "yyyy-MM-dd||yyyy-MM-dd HH:mm:ss||epoch_millis"
-                        },
-                        "platform": {
-                            "type": "keyword",
-                            "index": True
-                        },
-                        "pagerank_score": {
-                            "type": "float"
-                        }
-                    }
-                },
-                "settings": {
-                    "number_of_shards": 1,
-                    "number_of_replicas": 0,
-                    "analysis": {
-                        "analyzer": {
-                            "default": {
-                                "type": "ik_max_word"
-                            }
-                        }
-                    }
-                }
-            }
+            wildcard_acceleration = Config().get('etl.data.elasticsearch.wildcard_acceleration', True)
+            if wildcard_acceleration:
+                self.logger.info("为title/content添加wildcard子字段，加速通配符查询")
+            mapping = build_index_mapping(wildcard_acceleration)
             
             # 创建索引
             self.logger.info(f"创建新索引: {self.index_name}")
@@ -716,6 +741,10 @@ class ElasticsearchIndexer:
                         await asyncio.sleep(0.1)
 
             self.logger.info(f"索引完成: {success_count} 成功, {error_count} 失败")
+            await asyncio.to_thread(
+                mark_sources_reindexed,
+                [key for record in records for key in source_keys(record, record.get('id'))]
+            )
             print("✅ Elasticsearch索引构建完成!")
             
             return {
@@ -11,21 +11,67 @@ import json
 import logging
 import asyncio
 import re
-import networkx as nx
 from pathlib import Path
 from typing import List, Dict, Any, Optional, Tuple
 from tqdm import tqdm
 from datetime import datetime
 import sqlite3
+import time
 import aiofiles
 
 # 添加项目根目录到路径
 sys.path.append(str(Path(__file__).resolve().parent.parent.parent))
+from config import Config
 from etl import RAW_PATH
 from etl.load import db_core
+from etl.pagerank import PAGERANK_TOL
+from etl.pagerank.engine import LinkGraph, stream_link_graph, load_previous_scores, compute_pagerank
+from etl.pagerank.publish import publish_pagerank_scores, resync_content_scores
 from etl.processors.document import DocumentProcessor
 
 logger = logging.getLogger(__name__)
+config = Config()
+
+# 各表的upsert字段：columns为插入列，update为唯一键冲突时更新的列，
+# key为批量写入时的排序列（unique表示该列上有唯一索引，同一批内可按它去重）
+_UPSERT_SPECS = {
+    'website_nku': {
+        'columns': ['original_url', 'title', 'content', 'author', 'publish_time',
+                    'scrape_time', 'platform', 'pagerank_score', 'is_official'],
+        'update': ['title', 'content', 'author', 'publish_time', 'scrape_time', 'pagerank_score'],
+        'key': 'original_url',
+        'unique': True,
+    },
+    'wechat_nku': {
+        'columns': ['original_url', 'title', 'content', 'author', 'publish_time',
+                    'scrape_time', 'platform', 'view_count', 'like_count', 'is_official'],
+        'update': ['title', 'content', 'author', 'publish_time', 'scrape_time', 'view_count', 'like_count'],
+        'key': 'original_url',
+        'unique': True,
+    },
+    'wxapp_post': {
+        'columns': ['title', 'content', 'nickname', 'avatar_url', 'location',
+                    'category', 'platform', 'status', 'view_count', 'like_count', 'comment_count'],
+        'update': ['title', 'content', 'nickname', 'location', 'category',
+                   'view_count', 'like_count', 'comment_count'],
+        'key': 'title',
+        'unique': False,
+    },
+}
+_UPSERT_EXTRA = ["`update_time` = CURRENT_TIMESTAMP"]
+
+
+
+def _update_columns(table_name: str, include_pagerank: bool) -> List[str]:
+    """唯一键冲突时更新的列；不含PageRank的导入不覆盖已发布的 pagerank_score"""
+    update = _UPSERT_SPECS[table_name]['update']
+    if include_pagerank:
+        return update
+    return [column for column in update if column != 'pagerank_score']
+
+
+# _prepare_record 读取或解析文件出错时的返回值，与"无效文件跳过"（None）区分，计入导入失败
+_RECORD_FAILED = object()
 
 def _truncate_content(content: str) -> str:
     """按字节数安全截断内容
@@ -114,11 +160,14 @@ class MySQLIndexer:
             self.logger.error(f"创建数据库表失败: {e}")
             return False
     
-    async def import_crawler_data(self, include_pagerank: bool = False) -> bool:
+    async def import_crawler_data(self, include_pagerank: bool = False,
+                                  bulk: Optional[bool] = None, staging: bool = False) -> bool:
         """异步导入爬虫数据到MySQL数据库
         
         Args:
             include_pagerank: 是否包含PageRank分数（第二阶段）
+            bulk: 是否使用批量导入（多行upsert），默认取配置 etl.data.mysql.bulk_import.enabled
+            staging: 批量导入时先写入临时表再一次性合并，适合初次全量回填
         """
         try:
             data_path = Path(RAW_PATH)
@@ -132,17 +181,24 @@ class MySQLIndexer:
                 pagerank_scores = await self._get_pagerank_scores()
                 self.logger.info(f"加载了 {len(pagerank_scores)} 个PageRank分数")
             
-            # 导入网站数据
-            success_count = 0
-            error_count = 0
-            
             # 获取所有JSON文件
             json_files = list(data_path.rglob("*.json"))
             self.logger.info(f"找到 {len(json_files)} 个JSON文件")
+
+            if bulk is None:
+                bulk = config.get('etl.data.mysql.bulk_import.enabled', True)
+            if bulk:
+                stats = await self._bulk_import(json_files, pagerank_scores, staging=staging,
+                                                include_pagerank=include_pagerank)
+                return stats['errors'] == 0
+            
+            # 导入网站数据
+            success_count = 0
+            error_count = 0
+            start = time.perf_counter()
             
             # 批量处理文件 - 减少并发数量避免死锁
             batch_size = 10  # 减少批次大小避免数据库死锁
-            total_batches = (len(json_files) + batch_size - 1) // batch_size
             
             with tqdm(total=len(json_files), desc="导入MySQL数据", unit="files") as pbar:
                 for i in range(0, len(json_files), batch_size):
@@ -150,7 +206,8 @@ class MySQLIndexer:
                     tasks = [
                         self._import_single_file(
                             json_file, 
-                            pagerank_scores if include_pagerank else {}
+                            pagerank_scores if include_pagerank else {},
+                            include_pagerank=include_pagerank
                         ) for json_file in batch_files
                     ]
                     
@@ -176,40 +233,161 @@ class MySQLIndexer:
                     # 批量处理间添加短暂延迟，减少数据库压力
                     await asyncio.sleep(0.05)
             
-            self.logger.info(f"数据导入完成: 成功={success_count}, 失败={error_count}")
+            elapsed = time.perf_counter() - start
+            self.logger.info(
+                f"数据导入完成: 成功={success_count}, 失败={error_count}, "
+                f"耗时 {elapsed:.1f}s, 吞吐 {success_count / elapsed if elapsed else 0:.1f} 行/秒"
+            )
             return error_count == 0
             
         except Exception as e:
             self.logger.error(f"导入爬虫数据失败: {e}")
             return False
-    
-    async def calculate_pagerank(self, alpha: float = 0.85, max_iter: int = 100) -> bool:
-        """计算并保存PageRank分数"""
+
+    async def _bulk_import(self, json_files: List[Path], pagerank_scores: Dict[str, float],
+                           staging: bool = False, include_pagerank: bool = False) -> Dict[str, Any]:
+        """批量导入：有界并发读取文件，按表攒批后以多行upsert（或经临时表合并）写入
+
+        include_pagerank 为False时，已存在的行保留其 pagerank_score（新行写入0）。
+
+        配置项（etl.data.mysql.bulk_import.*）：
+            batch_size         每条upsert语句的行数，默认500
+            read_concurrency   同时读取解析的文件数，默认32
+            write_concurrency  每张表同时写入的批次数，默认2（临时表模式固定为1）
+        """
+        batch_size = config.get('etl.data.mysql.bulk_import.batch_size', 500)
+        read_concurrency = config.get('etl.data.mysql.bulk_import.read_concurrency', 32)
+        write_concurrency = 1 if staging else config.get('etl.data.mysql.bulk_import.write_concurrency', 2)
+        stats = {"files": len(json_files), "rows": 0, "skipped": 0, "errors": 0}
+        queues = {table: asyncio.Queue(maxsize=write_concurrency * 2) for table in _UPSERT_SPECS}
+
+        async def batches(table: str):
+            while True:
+                rows = await queues[table].get()
+                if rows is None:
+                    return
+                yield self._order_rows(table, rows)
+
+        async def write_worker(table: str):
+            spec = _UPSERT_SPECS[table]
+            async for rows in batches(table):
+                try:
+                    stats["rows"] += await db_core.bulk_upsert(
+                        table, spec['columns'], rows, _update_columns(table, include_pagerank),
+                        _UPSERT_EXTRA, batch_size=batch_size
+                    )
+                except Exception as e:
+                    stats["errors"] += len(rows)
+                    self.logger.error(f"批量写入 {table} 失败 ({len(rows)} 行): {e}")
+
+        async def stage_worker(table: str):
+            spec = _UPSERT_SPECS[table]
+            try:
+                stats["rows"] += await db_core.staged_upsert(
+                    table, spec['columns'], batches(table), _update_columns(table, include_pagerank),
+                    _UPSERT_EXTRA, order_by=spec['key']
+                )
+            except Exception as e:
+                self.logger.error(f"临时表导入 {table} 失败: {e}")
+                stats["errors"] += 1
+                # 继续消费队列，避免读取端阻塞
+                async for rows in batches(table):
+                    stats["errors"] += len(rows)
+
+        workers = [
+            asyncio.create_task(stage_worker(table) if staging else write_worker(table))
+            for table in _UPSERT_SPECS for _ in range(write_concurrency)
+        ]
+        buffers: Dict[str, List[Tuple]] = {table: [] for table in _UPSERT_SPECS}
+        start = time.perf_counter()
+        self.logger.info(
+            f"批量导入: 批大小 {batch_size}, 读取并发 {read_concurrency}, 写入并发 {write_concurrency}, "
+            f"{'经临时表合并' if staging else '多行upsert'}"
+        )
+
+        try:
+            with tqdm(total=len(json_files), desc="导入MySQL数据", unit="files") as pbar:
+                for i in range(0, len(json_files), read_concurrency):
+                    window = json_files[i:i + read_concurrency]
+                    records = await asyncio.gather(
+                        *(self._prepare_record(json_file, pagerank_scores) for json_file in window)
+                    )
+                    for record in records:
+                        if record is _RECORD_FAILED:
+                            stats["errors"] += 1
+                            continue
+                        if record is None or record[0] not in buffers:
+                            stats["skipped"] += 1
+                            continue
+                        table, row = record
+                        buffers[table].append(row)
+                        if len(buffers[table]) >= batch_size:
+                            await queues[table].put(buffers[table])
+                            buffers[table] = []
+                    pbar.update(len(window))
+                    elapsed = time.perf_counter() - start
+                    pbar.set_postfix({'写入': stats["rows"], '行/秒': f'{stats["rows"] / elapsed:.0f}' if elapsed else '0'})
+
+            for table, rows in buffers.items():
+                if rows:
+                    await queues[table].put(rows)
+                for _ in range(write_concurrency):
+                    await queues[table].put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                if not worker.done():
+                    worker.cancel()
+
+        stats["elapsed_seconds"] = time.perf_counter() - start
+        stats["rows_per_second"] = stats["rows"] / stats["elapsed_seconds"] if stats["elapsed_seconds"] else 0.0
+        self.last_import_stats = stats
+        self.logger.info(
+            f"批量导入完成: 文件 {stats['files']}, 写入 {stats['rows']} 行, 跳过 {stats['skipped']}, "
+            f"失败 {stats['errors']}, 耗时 {stats['elapsed_seconds']:.1f}s, 吞吐 {stats['rows_per_second']:.1f} 行/秒"
+        )
+        return stats
+
+    @staticmethod
+    def _order_rows(table_name: str, rows: List[Tuple]) -> List[Tuple]:
+        """按唯一键排序（有唯一索引时同一批内后出现的行覆盖先出现的），使并发写入以相同顺序加锁"""
+        spec = _UPSERT_SPECS[table_name]
+        key_index = spec['columns'].index(spec['key'])
+        if spec['unique']:
+            rows = list({row[key_index]: row for row in rows}.values())
+        return sorted(rows, key=lambda row: row[key_index] or '')
+    
+    async def calculate_pagerank(self, alpha: float = 0.85, max_iter: int = 100,
+                                 tol: float = PAGERANK_TOL, warm_start: bool = True) -> bool:
+        """计算并保存PageRank分数
+        
+        Args:
+            alpha: 阻尼系数
+            max_iter: 最大迭代次数
+            tol: 收敛阈值
+            warm_start: 以上一次的pagerank_scores作为初始向量，增量爬取后通常几轮即可收敛
+        """
         try:
             self.logger.info("开始计算PageRank分数...")
             
-            # 1. 从link_graph表加载链接数据
-            links = await self._load_link_graph()
-            if not links:
+            # 1. 从link_graph表流式加载链接数据
+            graph = await stream_link_graph(config.get('etl.pagerank.edge_chunk_size', 50000))
+            if graph.num_edges == 0:
                 self.logger.warning("没有链接数据，跳过PageRank计算")
                 return True
             
-            # 2. 计算PageRank分数
-            pagerank_scores = await self._compute_pagerank(links, alpha, max_iter)
+            # 2. 计算PageRank分数（稀疏矩阵幂迭代，在线程池中运行）
+            previous = await load_previous_scores() if warm_start else None
+            pagerank_scores = await asyncio.to_thread(compute_pagerank, graph, alpha, max_iter, tol, previous)
             if not pagerank_scores:
                 self.logger.error("PageRank计算失败")
                 return False
             
-            # 3. 保存到pagerank_scores表
-            if not await self._save_pagerank_scores(pagerank_scores):
+            # 3. 增量发布到pagerank_scores表和website_nku表（update_pagerank_scores 仍可用于全量重同步）
+            if not await self._save_pagerank_scores(pagerank_scores, previous, graph):
                 self.logger.error("保存PageRank分数失败")
                 return False
             
-            # 4. 更新website_nku表
-            if not await self.update_pagerank_scores():
-                self.logger.error("更新website_nku表失败")
-                return False
-            
             self.logger.info("PageRank计算和更新完成")
             return True
             
@@ -217,94 +395,17 @@ class MySQLIndexer:
             self.logger.error(f"计算PageRank失败: {e}")
             return False
     
-    async def _load_link_graph(self) -> List[Tuple[str, str]]:
-        """从MySQL的link_graph表加载链接关系"""
-        try:
-            self.logger.info("从link_graph表加载链接数据...")
-            
-            query = "SELECT source_url, target_url FROM link_graph"
-            records = await db_core.execute_query(query, fetch=True)
-            
-            if not records:
-                self.logger.warning("link_graph表中没有数据")
-                return []
-            
-            links = [(record['source_url'], record['target_url']) for record in records]
-            self.logger.info(f"成功加载 {len(links)} 条链接关系")
-            
-            return links
-            
-        except Exception as e:
-            self.logger.error(f"加载链接图数据失败: {e}")
-            return []
-    
-    async def _compute_pagerank(self, links: List[Tuple[str, str]], alpha: float = 0.85, max_iter: int = 100) -> Dict[str, float]:
-        """使用NetworkX计算PageRank分数（异步包装）"""
-        if not links:
-            return {}
-        
-        def _calculate():
-            """在线程池中运行的同步计算函数"""
-            self.logger.info("构建有向图...")
-            G = nx.DiGraph()
-            
-            # 添加边
-            for source, target in tqdm(links, desc="构建图", unit="链接"):
-                G.add_edge(source, target)
-            
-            self.logger.info(f"图构建完成: {G.number_of_nodes()} 个节点, {G.number_of_edges()} 条边")
-            
-            # 计算PageRank
-            self.logger.info(f"开始计算PageRank (alpha={alpha}, max_iter={max_iter})...")
-            pagerank_scores = nx.pagerank(G, alpha=alpha, max_iter=max_iter)
-            
-            # 显示分数统计
-            scores = list(pagerank_scores.values())
-            self.logger.info(f"PageRank计算完成: {len(pagerank_scores)} 个节点")
-            self.logger.info(f"分数统计 - 最大: {max(scores):.6f}, 最小: {min(scores):.6f}, 平均: {sum(scores)/len(scores):.6f}")
-            
-            return pagerank_scores
-        
-        # 在线程池中运行计算
-        loop = asyncio.get_running_loop()
-        return await loop.run_in_executor(None, _calculate)
-    
-    async def _save_pagerank_scores(self, pagerank_scores: Dict[str, float]) -> bool:
-        """将PageRank分数保存到pagerank_scores表"""
+    async def _save_pagerank_scores(self, pagerank_scores: Dict[str, float],
+                                    previous: Optional[Dict[str, float]] = None,
+                                    graph: Optional[LinkGraph] = None) -> bool:
+        """增量发布PageRank分数：只写入变化的URL，并在同一事务内更新website_nku"""
         if not pagerank_scores:
             return False
         
         try:
-            self.logger.info("清空现有的pagerank_scores表...")
-            await db_core.execute_query("DELETE FROM pagerank_scores", fetch=False)
-            
-            self.logger.info("保存PageRank分数到MySQL...")
-            
-            # 批量插入数据
-            batch_size = 1000
-            data_list = list(pagerank_scores.items())
-            
-            with tqdm(total=len(data_list), desc="保存PageRank分数", unit="记录") as pbar:
-                for i in range(0, len(data_list), batch_size):
-                    batch = data_list[i:i + batch_size]
-                    
-                    # 准备批量插入语句
-                    placeholders = ",".join(["(%s, %s)"] * len(batch))
-                    query = f"""INSERT INTO pagerank_scores (url, pagerank_score) VALUES {placeholders}
-                               ON DUPLICATE KEY UPDATE 
-                               pagerank_score = VALUES(pagerank_score),
-                               calculation_date = CURRENT_TIMESTAMP"""
-                    
-                    # 展平数据
-                    values = []
-                    for url, score in batch:
-                        values.extend([url, float(score)])
-                    
-                    # 执行插入
-                    await db_core.execute_query(query, values, fetch=False)
-                    pbar.update(len(batch))
-            
-            self.logger.info(f"成功保存 {len(pagerank_scores)} 个PageRank分数")
+            stats = await publish_pagerank_scores(pagerank_scores, previous=previous, graph=graph)
+            self.logger.info(f"成功发布PageRank分数: 变化 {stats['changed']} 个, 移除 {stats['removed']} 个, "
+                             f"website_nku更新 {stats['content_rows']} 行")
             return True
             
         except Exception as e:
@@ -312,18 +413,10 @@ class MySQLIndexer:
             return False
 
     async def update_pagerank_scores(self) -> bool:
-        """异步更新PageRank分数（第二阶段）"""
+        """全量重同步：把website_nku中与pagerank_scores不一致的分数修正为已发布的值"""
         try:
-            self.logger.info("更新website_nku表中的PageRank分数...")
-            
-            # 执行联合更新
-            query = """
-            UPDATE website_nku w 
-            JOIN pagerank_scores p ON w.original_url = p.url 
-            SET w.pagerank_score = p.pagerank_score
-            """
-            
-            await db_core.execute_query(query, fetch=False)
+            self.logger.info("重同步website_nku表中的PageRank分数...")
+            repaired = await resync_content_scores()
             
             # 统计更新结果
             stats_query = """
@@ -335,11 +428,10 @@ class MySQLIndexer:
             FROM website_nku
             """
             
-            stats = await db_core.execute_query(stats_query, fetch=True)
-            if stats:
-                stat = stats[0]
-                self.logger.info(f"更新统计: 总记录={stat['total']}, 已更新={stat['updated']}, "
-                               f"最大分数={stat['max_score']:.6f}, 平均分数={stat['avg_score']:.6f}")
+            stat = await db_core.execute_custom_query(stats_query, fetch='one')
+            if stat:
+                self.logger.info(f"更新统计: 修正={repaired}, 总记录={stat['total']}, 已更新={stat['updated']}, "
+                               f"最大分数={stat['max_score'] or 0:.6f}, 平均分数={stat['avg_score'] or 0:.6f}")
             
             return True
             
@@ -350,9 +442,9 @@ class MySQLIndexer:
     async def _get_pagerank_scores(self) -> Dict[str, float]:
         """异步获取PageRank分数映射"""
         try:
-            scores_data = await db_core.execute_query(
+            scores_data = await db_core.execute_custom_query(
                 "SELECT url, pagerank_score FROM pagerank_scores",
-                fetch=True
+                fetch='all'
             )
             return {item['url']: float(item['pagerank_score']) for item in scores_data} if scores_data else {}
         except Exception as e:
@@ -401,8 +493,28 @@ class MySQLIndexer:
             self.logger.debug(f"无法解析路径格式: {json_file}，使用默认表")
             return 'website_nku'
 
-    async def _import_single_file(self, json_file: Path, pagerank_scores: Dict[str, float]) -> bool:
+    async def _import_single_file(self, json_file: Path, pagerank_scores: Dict[str, float],
+                                  include_pagerank: bool = False) -> bool:
         """异步导入单个JSON文件"""
+        try:
+            record = await self._prepare_record(json_file, pagerank_scores)
+            if record is None or record is _RECORD_FAILED:
+                return False
+            table_name, row = record
+            if table_name not in _UPSERT_SPECS:
+                return True
+            spec = _UPSERT_SPECS[table_name]
+            await db_core.bulk_upsert(
+                table_name, spec['columns'], [row], _update_columns(table_name, include_pagerank), _UPSERT_EXTRA
+            )
+            return True
+            
+        except Exception as e:
+            self.logger.error(f"导入文件失败 {json_file}: {e}")
+            return False
+
+    async def _prepare_record(self, json_file: Path, pagerank_scores: Dict[str, float]) -> Optional[Tuple[str, Optional[Tuple]]]:
+        """读取并解析单个JSON文件，返回 (目标表, 待写入的行)；无效文件返回None，读取或解析出错返回 _RECORD_FAILED"""
         try:
             # 根据文件路径确定目标表
             target_table = self._determine_table_by_path(json_file)
@@ -416,7 +528,7 @@ class MySQLIndexer:
             if not isinstance(data, dict):
                 # 降级为debug日志，这只是一种正常的数据情况
                 self.logger.debug(f"跳过文件 {json_file}：期望的数据类型为dict，实际为{type(data)}")
-                return False
+                return None
 
             # 提取基本字段
             original_url = data.get('original_url', '')
@@ -424,7 +536,7 @@ class MySQLIndexer:
             content = data.get('content', '')
 
             if not original_url or not title:
-                return False
+                return None
             
             # 解析文档内容（如果是文档URL）
             file_url = data.get('file_url')
@@ -454,122 +566,60 @@ class MySQLIndexer:
             publish_time = self._parse_publish_time(data.get('publish_time'))
             scrape_time = self._parse_scrape_time(data.get('scrape_time'))
             
-            # 根据不同的表选择不同的插入逻辑
-            success = await self._insert_to_table(
-                target_table, data, original_url, title, content, 
+            row = self._build_row(
+                target_table, data, original_url, title, content,
                 publish_time, scrape_time, pagerank_score
             )
-            
-            return success
+            return target_table, row
             
         except Exception as e:
-            self.logger.error(f"导入文件失败 {json_file}: {e}")
-            return False
-    
-    async def _insert_to_table(self, table_name: str, data: dict, original_url: str, 
-                              title: str, content: str, publish_time, scrape_time, 
-                              pagerank_score: float) -> bool:
-        """根据表名插入数据到对应表"""
-        max_retries = 3
-        
-        for attempt in range(max_retries):
-            try:
-                if table_name == 'website_nku':
-                    await db_core.execute_query("""
-                        INSERT INTO website_nku (
-                            original_url, title, content, author, publish_time, 
-                            scrape_time, platform, pagerank_score, is_official
-                        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                        ON DUPLICATE KEY UPDATE
-                            title = VALUES(title),
-                            content = VALUES(content),
-                            author = VALUES(author),
-                            publish_time = VALUES(publish_time),
-                            scrape_time = VALUES(scrape_time),
-                            pagerank_score = VALUES(pagerank_score),
-                            update_time = CURRENT_TIMESTAMP
-                    """, [
-                        original_url,
-                        title,
-                        content,
-                        data.get('author', ''),
-                        publish_time,
-                        scrape_time,
-                        data.get('platform', 'website'),
-                        pagerank_score,
-                        1 if 'nankai.edu.cn' in original_url else 0
-                    ], fetch=False)
-                
-                elif table_name == 'wechat_nku':
-                    await db_core.execute_query("""
-                        INSERT INTO wechat_nku (
-                            original_url, title, content, author, publish_time, 
-                            scrape_time, platform, view_count, like_count, is_official
-                        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                        ON DUPLICATE KEY UPDATE
-                            title = VALUES(title),
-                            content = VALUES(content),
-                            author = VALUES(author),
-                            publish_time = VALUES(publish_time),
-                            scrape_time = VALUES(scrape_time),
-                            view_count = VALUES(view_count),
-                            like_count = VALUES(like_count),
-                            update_time = CURRENT_TIMESTAMP
-                    """, [
-                        original_url,
-                        title,
-                        content,
-                        data.get('author', ''),
-                        publish_time,
-                        scrape_time,
-                        data.get('platform', 'wechat'),
-                        data.get('view_count', 0),
-                        data.get('like_count', 0),
-                        1 if 'nankai' in title.lower() or 'nankai' in content.lower() else 0
-                    ], fetch=False)
-                
-                elif table_name == 'wxapp_post':
-                    await db_core.execute_query("""
-                        INSERT INTO wxapp_post (
-                            title, content, nickname, avatar_url, location, 
-                            category, platform, status, view_count, like_count, comment_count
-                        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                        ON DUPLICATE KEY UPDATE
-                            title = VALUES(title),
-                            content = VALUES(content),
-                            nickname = VALUES(nickname),
-                            location = VALUES(location),
-                            category = VALUES(category),
-                            view_count = VALUES(view_count),
-                            like_count = VALUES(like_count),
-                            comment_count = VALUES(comment_count),
-                            update_time = CURRENT_TIMESTAMP
-                    """, [
-                        title,
-                        content,
-                        data.get('nickname', data.get('author', '')),
-                        data.get('avatar_url', ''),
-                        data.get('location', ''),
-                        data.get('category', ''),
-                        data.get('platform', 'wxapp'),
-                        1,  # status = 1 (active)
-                        data.get('view_count', 0),
-                        data.get('like_count', 0),
-                        data.get('comment_count', 0)
-                    ], fetch=False)
-                
-                return True  # 成功则跳出重试循环
-                
-            except Exception as e:
-                if "Deadlock" in str(e) and attempt < max_retries - 1:
-                    # 死锁错误且还有重试机会，等待后重试
-                    await asyncio.sleep(0.1 * (attempt + 1))  # 递增等待时间
-                    continue
-                else:
-                    # 非死锁错误或已达最大重试次数，抛出异常
-                    raise e
-        
-        return False
+            self.logger.error(f"读取文件失败 {json_file}: {e}")
+            return _RECORD_FAILED
+    
+    def _build_row(self, table_name: str, data: dict, original_url: str, 
+                   title: str, content: str, publish_time, scrape_time, 
+                   pagerank_score: float) -> Optional[Tuple]:
+        """根据表名构造与 _UPSERT_SPECS[table_name]['columns'] 对应的行"""
+        if table_name == 'website_nku':
+            return (
+                original_url,
+                title,
+                content,
+                data.get('author', ''),
+                publish_time,
+                scrape_time,
+                data.get('platform', 'website'),
+                pagerank_score,
+                1 if 'nankai.edu.cn' in original_url else 0
+            )
+        elif table_name == 'wechat_nku':
+            return (
+                original_url,
+                title,
+                content,
+                data.get('author', ''),
+                publish_time,
+                scrape_time,
+                data.get('platform', 'wechat'),
+                data.get('view_count', 0),
+                data.get('like_count', 0),
+                1 if 'nankai' in title.lower() or 'nankai' in content.lower() else 0
+            )
+        elif table_name == 'wxapp_post':
+            return (
+                title,
+                content,
+                data.get('nickname', data.get('author', '')),
+                data.get('avatar_url', ''),
+                data.get('location', ''),
+                data.get('category', ''),
+                data.get('platform', 'wxapp'),
+                1,  # status = 1 (active)
+                data.get('view_count', 0),
+                data.get('like_count', 0),
+                data.get('comment_count', 0)
+            )
+        return None
     
     def _parse_publish_time(self, time_str: str) -> Optional[datetime]:
         """解析发布时间"""
@@ -608,12 +658,13 @@ class MySQLIndexer:
         """按字节数安全截断内容（调用全局函数）"""
         return _truncate_content(content)
     
-    async def build_indexes(self, dry_run: bool = False) -> bool:
+    async def build_indexes(self, dry_run: bool = False, staging: Optional[bool] = None) -> bool:
         """
         构建MySQL索引（包括创建表和导入数据）
         
         Args:
             dry_run: 是否为测试模式，测试模式下不实际写入数据
+            staging: 是否经临时表合并导入（初次全量回填），默认取配置 etl.data.mysql.bulk_import.staging
         """
         if dry_run:
             self.logger.info("测试模式，跳过MySQL索引构建")
@@ -625,7 +676,9 @@ class MySQLIndexer:
                 return False
             
             # 2. 导入数据
-            if not await self.import_crawler_data(include_pagerank=False):
+            if staging is None:
+                staging = config.get('etl.data.mysql.bulk_import.staging', False)
+            if not await self.import_crawler_data(include_pagerank=False, staging=staging):
                 return False
 
             self.logger.info("MySQL索引构建完成")
@@ -9,8 +9,9 @@ import sys
 import logging
 import asyncio
 import json
+import time
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncIterator
 import aiofiles
 import aiofiles.os
 from tqdm.asyncio import tqdm
@@ -22,11 +23,15 @@ from llama_index.vector_stores.qdrant import QdrantVectorStore
 from qdrant_client import models, AsyncQdrantClient
 from qdrant_client.http.models import UpdateStatus
 from etl.embedding.hf_embeddings import HuggingFaceEmbedding
+from etl.embedding.embedding_store import get_embedding_store, make_embedding_key
+from etl.processors.nodes import get_node_content
+from etl.rag.answer_cache import mark_sources_reindexed, source_keys
 from config import Config
 from core.utils.logger import register_logger
 from etl import QDRANT_URL, QDRANT_API_KEY, EMBEDDING_MODEL_PATH, CHUNK_SIZE, CHUNK_OVERLAP, MODELS_PATH, QDRANT_BATCH_SIZE
 
 logger = register_logger("etl.indexing.qdrant_indexer")
+config = Config()
 
 
 class QdrantIndexer:
@@ -163,13 +168,11 @@ class QdrantIndexer:
                     collection_name=self.collection_name
                 )
                 
-                # 为节点生成嵌入（带进度条）
-                print("🔮 生成向量嵌入...")
-                nodes = await self._generate_embeddings_with_progress(self.embed_model, nodes, batch_size)
-
-                # 异步批量添加节点到Qdrant（带进度条）
-                print("📤 上传向量到Qdrant...")
-                await self._upload_to_qdrant_with_progress(vector_store, nodes, batch_size)
+                # 嵌入生成与上传流水线并行（带进度条）
+                print("🔮 生成向量嵌入并上传到Qdrant...")
+                await self._embed_and_upload_pipelined(
+                    vector_store, self._iter_node_batches(nodes, batch_size), total=len(nodes)
+                )
                 
                 self.logger.info(f"Qdrant向量索引构建完成，集合: {self.collection_name}")
             else:
@@ -197,97 +200,182 @@ class QdrantIndexer:
                 "message": f"Qdrant索引构建失败: {str(e)}"
             }
 
-    async def _generate_embeddings_with_progress(self, embed_model, nodes: List[BaseNode], batch_size: int) -> List[BaseNode]:
-        """为节点生成嵌入并显示进度（优化内存管理）"""
+    @staticmethod
+    async def _iter_node_batches(nodes: List[BaseNode], batch_size: int) -> AsyncIterator[List[BaseNode]]:
+        """将已加载的节点列表切分为批次"""
         # 处理batch_size=-1的情况，表示不分批，一次性处理
         if batch_size == -1:
             batch_size = len(nodes)
-        
-        total_batches = (len(nodes) + batch_size - 1) // batch_size
-        
-        self.logger.info(f"开始生成嵌入: {len(nodes)} 个节点, 批次大小: {batch_size}, 总批次: {total_batches}")
-        
-        # 对于大数据集，在生成嵌入的同时进行垃圾回收以释放内存
-        import gc
-        
-        with tqdm(total=len(nodes), desc="生成向量嵌入", unit="节点") as pbar:
-            for i in range(0, len(nodes), batch_size):
-                batch = nodes[i:i + batch_size]
-                batch_num = i//batch_size + 1
-                
-                self.logger.debug(f"处理批次 {batch_num}/{total_batches}, 节点数: {len(batch)}")
-                
-                try:
-                    # 为批次节点生成嵌入
-                    batch_with_embeddings = await embed_model.acall(batch)
-                    # 更新原始nodes列表
-                    nodes[i:i + len(batch_with_embeddings)] = batch_with_embeddings
-                    pbar.update(len(batch))
-                    pbar.set_postfix({'批次': f"{batch_num}/{total_batches}"})
-                    
-                    self.logger.debug(f"批次 {batch_num} 完成, 处理了 {len(batch)} 个节点")
-                    
-                    # 每100批执行一次垃圾回收释放内存
-                    if batch_num % 100 == 0:
-                        gc.collect()
-                        self.logger.debug(f"批次 {batch_num} 后执行垃圾回收")
-                    
-                except Exception as e:
-                    self.logger.warning(f"批次 {batch_num} 嵌入生成失败: {e}")
-                    pbar.update(len(batch))
-        
-        self.logger.info(f"嵌入生成完成，总计处理 {len(nodes)} 个节点")
-        return nodes
+        for i in range(0, len(nodes), batch_size):
+            yield nodes[i:i + batch_size]
+
+    async def _iter_chunked_batches(self, doc_nodes: List[BaseNode], batch_size: int,
+                                    collected: List[BaseNode]) -> AsyncIterator[List[BaseNode]]:
+        """分组对文档分块并逐批产出，使分块与嵌入、上传重叠进行
+
+        分块结果会追加到 collected 中，供调用方在构建完成后返回。
+        """
+        from etl.processors.chunk_cache import chunk_documents_cached
 
-    async def _upload_to_qdrant_with_progress(self, vector_store, nodes: List[BaseNode], batch_size: int):
-        """将节点上传到Qdrant并显示进度（优化内存管理和错误处理）"""
-        # 处理batch_size=-1的情况，表示不分批，一次性处理
         if batch_size == -1:
-            batch_size = len(nodes)
-        
-        total_batches = (len(nodes) + batch_size - 1) // batch_size
-        
-        self.logger.info(f"开始上传到Qdrant: {len(nodes)} 个节点, 批次大小: {batch_size}, 总批次: {total_batches}")
-        
-        import gc
-        successful_uploads = 0
-        failed_uploads = 0
-        
-        with tqdm(total=len(nodes), desc="上传到Qdrant", unit="节点") as pbar:
-            for i in range(0, len(nodes), batch_size):
-                batch = nodes[i:i + batch_size]
-                batch_num = i//batch_size + 1
-                
-                self.logger.debug(f"上传批次 {batch_num}/{total_batches}, 节点数: {len(batch)}")
-                
-                try:
-                    await vector_store.async_add(nodes=batch)
-                    successful_uploads += len(batch)
-                    pbar.update(len(batch))
-                    pbar.set_postfix({
-                        '批次': f"{batch_num}/{total_batches}", 
-                        '成功': successful_uploads,
-                        '失败': failed_uploads
-                    })
-                    
-                    self.logger.debug(f"批次 {batch_num} 上传完成, 上传了 {len(batch)} 个节点")
-                    
-                    # 每50批执行一次垃圾回收
-                    if batch_num % 50 == 0:
-                        gc.collect()
-                        self.logger.debug(f"批次 {batch_num} 后执行垃圾回收")
-                    
-                except Exception as e:
-                    failed_uploads += len(batch)
-                    self.logger.warning(f"批次 {batch_num} 上传失败: {e}")
-                    pbar.update(len(batch))
-                    pbar.set_postfix({
-                        '批次': f"{batch_num}/{total_batches}", 
-                        '成功': successful_uploads,
-                        '失败': failed_uploads
-                    })
-        
-        self.logger.info(f"Qdrant上传完成，成功上传 {successful_uploads} 个节点，失败 {failed_uploads} 个节点")
+            batch_size = max(len(doc_nodes), 1)
+        pending: List[BaseNode] = []
+        for i in range(0, len(doc_nodes), batch_size):
+            chunks = await chunk_documents_cached(
+                doc_nodes=doc_nodes[i:i + batch_size],
+                chunk_size=self.chunk_size,
+                chunk_overlap=self.chunk_overlap,
+                force_refresh=False,
+                show_progress=False
+            )
+            collected.extend(chunks)
+            pending.extend(chunks)
+            while len(pending) >= batch_size:
+                yield pending[:batch_size]
+                pending = pending[batch_size:]
+        if pending:
+            yield pending
+
+    async def _embed_batch(self, batch: List[BaseNode]) -> int:
+        """为一批节点填充嵌入，优先从嵌入存储读取，只计算新增或内容变化的分块
+
+        Returns:
+            命中嵌入存储的节点数
+        """
+        store = get_embedding_store(self.embedding_model_name)
+        if store is None:
+            await self.embed_model.acall(batch)
+            return 0
+
+        embed_type = getattr(self.embed_model, '_embed_type', 1)
+        keys = [
+            make_embedding_key(self.embedding_model_name, embed_type, get_node_content(node, embed_type))
+            for node in batch
+        ]
+        cached = await asyncio.to_thread(store.get_many, keys)
+        misses = []
+        for node, embedding in zip(batch, cached):
+            if embedding is None:
+                misses.append(node)
+            else:
+                node.embedding = embedding
+        if misses:
+            await self.embed_model.acall(misses)
+            miss_keys = [key for key, embedding in zip(keys, cached) if embedding is None]
+            try:
+                await asyncio.to_thread(store.put_many, miss_keys, [node.embedding for node in misses])
+            except Exception as e:
+                self.logger.warning(f"写入嵌入存储失败: {e}")
+        return len(batch) - len(misses)
+
+    async def _embed_and_upload_pipelined(self, vector_store, batches: AsyncIterator[List[BaseNode]],
+                                          total: Optional[int] = None) -> Dict[str, Any]:
+        """流水线方式生成嵌入并上传到Qdrant
+
+        节点批次依次经过 来源(分块) -> 嵌入 -> 上传 三个阶段，阶段之间用有界队列连接：
+        下游处理不过来时上游会阻塞在队列上（背压），同时最多有 upload_concurrency 个上传请求在途。
+        上传完成后立即释放节点上的向量，内存峰值只有队列中的若干批，而不是整个语料。
+
+        配置项（etl.data.qdrant.*）：
+            upload_concurrency   并发上传数，默认4
+            pipeline_queue_depth 每个阶段间队列的最大批次数，默认为 upload_concurrency * 2
+
+        Args:
+            vector_store: 目标QdrantVectorStore
+            batches: 节点批次的异步迭代器
+            total: 节点总数（仅用于进度条，未知时为None）
+
+        Returns:
+            各阶段的节点计数和耗时统计
+        """
+        upload_concurrency = max(1, config.get('etl.data.qdrant.upload_concurrency', 4))
+        queue_depth = max(1, config.get('etl.data.qdrant.pipeline_queue_depth', upload_concurrency * 2))
+        embed_queue: asyncio.Queue = asyncio.Queue(maxsize=queue_depth)
+        upload_queue: asyncio.Queue = asyncio.Queue(maxsize=queue_depth)
+        stats = {
+            "total_nodes": 0, "embedded": 0, "embed_cache_hits": 0, "uploaded": 0,
+            "embed_failed": 0, "upload_failed": 0,
+            "embed_seconds": 0.0, "upload_seconds": 0.0,
+        }
+        reindexed_sources = set()
+
+        self.logger.info(f"开始流水线嵌入和上传: 并发上传数 {upload_concurrency}, 队列深度 {queue_depth}")
+        start = time.perf_counter()
+
+        with tqdm(total=total, desc="生成向量嵌入", unit="节点", position=0) as embed_pbar, \
+             tqdm(total=total, desc="上传到Qdrant", unit="节点", position=1) as upload_pbar:
+
+            async def produce():
+                async for batch in batches:
+                    if batch:
+                        stats["total_nodes"] += len(batch)
+                        await embed_queue.put(batch)
+                await embed_queue.put(None)
+
+            async def embed():
+                batch_num = 0
+                while True:
+                    batch = await embed_queue.get()
+                    if batch is None:
+                        break
+                    batch_num += 1
+                    t0 = time.perf_counter()
+                    try:
+                        stats["embed_cache_hits"] += await self._embed_batch(batch)
+                        stats["embedded"] += len(batch)
+                        await upload_queue.put(batch)
+                    except Exception as e:
+                        stats["embed_failed"] += len(batch)
+                        self.logger.warning(f"批次 {batch_num} 嵌入生成失败: {e}")
+                    finally:
+                        stats["embed_seconds"] += time.perf_counter() - t0
+                        embed_pbar.update(len(batch))
+                        embed_pbar.set_postfix({'队列': upload_queue.qsize()})
+                for _ in range(upload_concurrency):
+                    await upload_queue.put(None)
+
+            async def upload():
+                while True:
+                    batch = await upload_queue.get()
+                    if batch is None:
+                        break
+                    t0 = time.perf_counter()
+                    try:
+                        await vector_store.async_add(nodes=batch)
+                        stats["uploaded"] += len(batch)
+                        for node in batch:
+                            reindexed_sources.update(source_keys(node.metadata, node.node_id))
+                    except Exception as e:
+                        stats["upload_failed"] += len(batch)
+                        self.logger.warning(f"上传 {len(batch)} 个节点失败: {e}")
+                    finally:
+                        stats["upload_seconds"] += time.perf_counter() - t0
+                        # 向量已写入Qdrant，释放内存
+                        for node in batch:
+                            node.embedding = None
+                        upload_pbar.update(len(batch))
+                        upload_pbar.set_postfix({'成功': stats["uploaded"], '失败': stats["upload_failed"]})
+
+            tasks = [asyncio.create_task(produce()), asyncio.create_task(embed())]
+            tasks.extend(asyncio.create_task(upload()) for _ in range(upload_concurrency))
+            try:
+                await asyncio.gather(*tasks)
+            finally:
+                for task in tasks:
+                    if not task.done():
+                        task.cancel()
+                # 已写入的来源文档对应的缓存答案失效
+                await asyncio.to_thread(mark_sources_reindexed, reindexed_sources)
+
+        stats["elapsed_seconds"] = time.perf_counter() - start
+        self.logger.info(
+            f"流水线完成: 共 {stats['total_nodes']} 个节点, 嵌入缓存命中 {stats['embed_cache_hits']}, "
+            f"上传成功 {stats['uploaded']}, "
+            f"嵌入失败 {stats['embed_failed']}, 上传失败 {stats['upload_failed']}, "
+            f"总耗时 {stats['elapsed_seconds']:.1f}s (嵌入 {stats['embed_seconds']:.1f}s, "
+            f"上传累计 {stats['upload_seconds']:.1f}s)"
+        )
+        return stats
 
     async def _init_embedding_model(self) -> Optional[HuggingFaceEmbedding]:
         """异步初始化嵌入模型"""
@@ -858,11 +946,10 @@ class QdrantIndexer:
                 collection_name=self.collection_name
             )
 
-            self.logger.info("🔮 生成向量嵌入...")
-            nodes = await self._generate_embeddings_with_progress(self.embed_model, nodes, batch_size)
-
-            self.logger.info("📤 上传向量到Qdrant...")
-            await self._upload_to_qdrant_with_progress(vector_store, nodes, batch_size)
+            self.logger.info("🔮 生成向量嵌入并上传到Qdrant...")
+            await self._embed_and_upload_pipelined(
+                vector_store, self._iter_node_batches(nodes, batch_size), total=len(nodes)
+            )
 
             self.logger.info(f"Qdrant向量索引构建完成，集合: {self.collection_name}")
 
@@ -897,14 +984,15 @@ class QdrantIndexer:
         try:
             await self._ensure_collection_exists()
 
-            # 1. 从文件列表加载和分块节点
-            nodes = await self._load_nodes_from_file_list(file_paths)
-            if not nodes:
+            # 1. 从文件列表读取文档
+            doc_nodes = await self._read_docs_from_file_list(file_paths)
+            if not doc_nodes:
                 self.logger.warning("从提供的文件列表中没有加载到任何节点。")
                 return {"success": True, "nodes": [], "message": "没有加载到节点"}
 
-            # 2. 如果是测试模式，加载完节点后直接返回
+            # 2. 如果是测试模式，分块后直接返回
             if test_mode:
+                nodes = await self._chunk_nodes_with_progress(doc_nodes)
                 self.logger.info("测试模式：已加载节点，跳过索引构建。")
                 return {"success": True, "nodes": nodes}
             
@@ -920,11 +1008,12 @@ class QdrantIndexer:
                 collection_name=self.collection_name
             )
             
-            self.logger.info("🔮 生成向量嵌入...")
-            nodes = await self._generate_embeddings_with_progress(self.embed_model, nodes, batch_size)
-
-            self.logger.info("📤 上传向量到Qdrant...")
-            await self._upload_to_qdrant_with_progress(vector_store, nodes, batch_size)
+            # 分块、嵌入、上传三个阶段流水线并行
+            self.logger.info("🔮 分块、生成向量嵌入并上传到Qdrant...")
+            nodes: List[BaseNode] = []
+            await self._embed_and_upload_pipelined(
+                vector_store, self._iter_chunked_batches(doc_nodes, batch_size, nodes)
+            )
             
             self.logger.info(f"Qdrant向量索引构建完成，集合: {self.collection_name}")
             
@@ -950,6 +1039,24 @@ class QdrantIndexer:
         Returns:
             处理和分块后的节点列表。
         """
+        all_docs = await self._read_docs_from_file_list(file_paths)
+        if not all_docs:
+            return []
+        chunked_nodes = await self._chunk_nodes_with_progress(all_docs)
+        self.logger.info(f"分块完成，共生成 {len(chunked_nodes)} 个节点。")
+        
+        return chunked_nodes
+
+    async def _read_docs_from_file_list(self, file_paths: List[Path]) -> List[BaseNode]:
+        """
+        从一个文件路径列表读取并解析文档节点（不分块）。
+        
+        Args:
+            file_paths: JSON文件的路径列表。
+            
+        Returns:
+            文档节点列表。
+        """
         all_docs = []
         self.logger.info(f"开始从 {len(file_paths)} 个文件加载内容...")
         
@@ -974,11 +1081,8 @@ class QdrantIndexer:
             self.logger.warning("未能从任何文件创建有效节点。")
             return []
             
-        self.logger.info(f"成功从文件列表加载了 {len(all_docs)} 篇文档，现在开始分块...")
-        chunked_nodes = await self._chunk_nodes_with_progress(all_docs)
-        self.logger.info(f"分块完成，共生成 {len(chunked_nodes)} 个节点。")
-        
-        return chunked_nodes
+        self.logger.info(f"成功从文件列表加载了 {len(all_docs)} 篇文档")
+        return all_docs
 
 
 # 向后兼容的函数接口
@@ -226,4 +226,121 @@ async def execute_sql_list_in_transaction(sql_list: List[Tuple[str, Optional[Uni
     except Exception as e:
         logger.error(f"事务执行失败: {e}", exc_info=True)
         # 已经在连接池层面处理了回滚
-        return False
\ No newline at end of file
+        return False
+
+def _upsert_sql(table_name: str, columns: List[str], update_columns: List[str], row_count: int,
+                extra_updates: Optional[List[str]] = None) -> str:
+    """生成多行 INSERT ... ON DUPLICATE KEY UPDATE 语句"""
+    cols_sql = ", ".join(f"`{c}`" for c in columns)
+    row_sql = "(" + ", ".join(["%s"] * len(columns)) + ")"
+    updates = [f"`{c}` = VALUES(`{c}`)" for c in update_columns] + list(extra_updates or [])
+    return (
+        f"INSERT INTO `{table_name}` ({cols_sql}) VALUES {', '.join([row_sql] * row_count)} "
+        f"ON DUPLICATE KEY UPDATE {', '.join(updates)}"
+    )
+
+
+async def bulk_upsert(
+    table_name: str,
+    columns: List[str],
+    rows: List[Tuple],
+    update_columns: List[str],
+    extra_updates: Optional[List[str]] = None,
+    batch_size: int = 500,
+    max_retries: int = 3,
+) -> int:
+    """
+    多行upsert：每 batch_size 行合并为一条 INSERT ... ON DUPLICATE KEY UPDATE，每批单独提交。
+
+    调用方应事先按唯一键排序，使并发写入以相同顺序加锁，避免死锁；
+    仍发生死锁时整批回滚并重试。
+
+    Returns:
+        写入的行数
+    """
+    if not rows:
+        return 0
+
+    written = 0
+    async with get_db_connection() as conn:
+        async with conn.cursor() as cursor:
+            for i in range(0, len(rows), batch_size):
+                batch = rows[i:i + batch_size]
+                query = _upsert_sql(table_name, columns, update_columns, len(batch), extra_updates)
+                params = [value for row in batch for value in row]
+                for attempt in range(max_retries):
+                    try:
+                        await cursor.execute(query, params)
+                        await conn.commit()
+                        written += len(batch)
+                        break
+                    except Exception as e:
+                        await conn.rollback()
+                        if "Deadlock" in str(e) and attempt < max_retries - 1:
+                            await asyncio.sleep(0.1 * (attempt + 1))
+                            continue
+                        logger.error(f"批量upsert失败 ({table_name}, 起始索引 {i}, {len(batch)} 行): {e}")
+                        raise
+    return written
+
+
+async def staged_upsert(
+    table_name: str,
+    columns: List[str],
+    row_batches,
+    update_columns: List[str],
+    extra_updates: Optional[List[str]] = None,
+    order_by: Optional[str] = None,
+) -> int:
+    """
+    经临时表的批量导入：先把全部行用多行INSERT写入无索引的临时表，再用一条
+    INSERT ... SELECT ... ON DUPLICATE KEY UPDATE 合并到目标表。适合初次全量回填。
+
+    临时表只在当前连接可见，因此整个过程占用同一个连接。
+
+    Args:
+        row_batches: 行批次的异步迭代器（每批为元组列表）
+        order_by: 合并时的排序列（通常为唯一键），使加锁顺序确定
+
+    Returns:
+        写入临时表的行数
+    """
+    staging = f"_staging_{table_name}"
+    cols_sql = ", ".join(f"`{c}`" for c in columns)
+    updates = [f"`{c}` = VALUES(`{c}`)" for c in update_columns] + list(extra_updates or [])
+    staged = 0
+
+    async with get_db_connection() as conn:
+        async with conn.cursor() as cursor:
+            try:
+                await cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS `{staging}`")
+                await cursor.execute(
+                    f"CREATE TEMPORARY TABLE `{staging}` ENGINE=InnoDB AS SELECT {cols_sql} FROM `{table_name}` WHERE 1 = 0"
+                )
+                row_sql = "(" + ", ".join(["%s"] * len(columns)) + ")"
+                async for batch in row_batches:
+                    if not batch:
+                        continue
+                    await cursor.execute(
+                        f"INSERT INTO `{staging}` ({cols_sql}) VALUES {', '.join([row_sql] * len(batch))}",
+                        [value for row in batch for value in row],
+                    )
+                    staged += len(batch)
+                await conn.commit()
+
+                order_sql = f" ORDER BY `{order_by}`" if order_by else ""
+                await cursor.execute(
+                    f"INSERT INTO `{table_name}` ({cols_sql}) SELECT {cols_sql} FROM `{staging}`{order_sql} "
+                    f"ON DUPLICATE KEY UPDATE {', '.join(updates)}"
+                )
+                await conn.commit()
+            except Exception as e:
+                await conn.rollback()
+                logger.error(f"临时表导入失败 ({table_name}): {e}", exc_info=True)
+                raise
+            finally:
+                try:
+                    await cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS `{staging}`")
+                except Exception:
+                    pass
+    return staged
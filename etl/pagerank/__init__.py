@@ -4,8 +4,8 @@ PageRank计算模块
 负责计算网页的PageRank分数，提供链接图分析和权威性评估功能。
 
 主要功能：
-- 从MySQL链接图数据计算PageRank分数
-- 支持增量更新和批量处理
+- 从MySQL链接图数据计算PageRank分数（稀疏矩阵幂迭代，见 engine.py）
+- 支持增量更新和批量处理（分数只按差异发布，见 publish.py）
 - 集成到检索排序系统中
 """
 
@@ -22,10 +22,14 @@ from .calculate_pagerank_mysql import (
     update_website_nku_pagerank,
     main as calculate_pagerank_main
 )
+from .engine import LinkGraph, compute_pagerank, stream_link_graph, load_previous_scores
+from .publish import publish_pagerank_scores
 
 __all__ = [
     'PAGERANK_ALPHA', 'PAGERANK_MAX_ITER', 'PAGERANK_TOL',
     'load_link_graph_from_mysql', 'calculate_pagerank', 
     'save_pagerank_to_mysql', 'update_website_nku_pagerank',
-    'calculate_pagerank_main'
+    'calculate_pagerank_main',
+    'LinkGraph', 'compute_pagerank', 'stream_link_graph', 'load_previous_scores',
+    'publish_pagerank_scores'
 ] 
\ No newline at end of file
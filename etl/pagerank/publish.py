@@ -0,0 +1,182 @@
+"""
+PageRank分数增量发布
+
+原先的发布流程先 DELETE 整张 pagerank_scores 表，再分批插入全部分数，最后对内容表做一次全表关联UPDATE，
+期间读者会看到空的或只写了一部分的分数，且长时间锁表。这里改为：
+
+    1. 与上一次的分数比较，只挑出变化超过 epsilon 的URL（以及新出现、已消失的URL）
+    2. 在同一个连接、同一个事务内：变化行写入临时表 -> 合并到 pagerank_scores -> 只按变化的URL更新内容表
+    3. 提交后新分数一次性可见（InnoDB MVCC），未变化的行完全不被触碰
+
+内容表与 pagerank_scores 出现偏差时（如旧版导入覆盖了分数），由 resync_content_scores()
+按主键范围分批单独修正，不放在发布事务中。
+
+配置项（etl.pagerank.*）：
+    publish_epsilon     分数变化阈值，默认1e-9
+    resync_batch_size   resync_content_scores 每批的主键范围，默认5000
+"""
+from typing import Dict, List, Optional, Tuple
+
+from config import Config
+from core.utils.logger import register_logger
+from etl.load.db_pool_manager import get_db_connection
+from etl.pagerank.engine import LinkGraph, load_previous_scores
+
+logger = register_logger("etl.pagerank.publish")
+config = Config()
+
+# 带 pagerank_score 列的内容表及其URL列
+CONTENT_TABLES: List[Tuple[str, str]] = [("website_nku", "original_url")]
+
+_DELTA_TABLE = "_pagerank_delta"
+_BATCH_SIZE = 1000
+
+
+def _repair_sql(table: str, url_column: str) -> str:
+    """把一段主键范围内内容表的分数修正为pagerank_scores中的值（不在表中的URL为0），只写入不一致的行"""
+    return (
+        f"UPDATE `{table}` t LEFT JOIN pagerank_scores p ON t.`{url_column}` = p.url "
+        "SET t.pagerank_score = COALESCE(p.pagerank_score, 0) "
+        "WHERE t.id > %s AND t.id <= %s AND NOT (t.pagerank_score <=> COALESCE(p.pagerank_score, 0))"
+    )
+
+
+async def resync_content_scores(batch_size: Optional[int] = None) -> int:
+    """
+    全量重同步内容表分数，返回修正的行数
+
+    不属于发布流程，由 update_pagerank_scores 等显式调用；按主键范围分批、每批单独提交，
+    任一时刻只锁住一个范围内的行。
+
+    Args:
+        batch_size: 每批的主键范围，默认取配置 etl.pagerank.resync_batch_size
+    """
+    if batch_size is None:
+        batch_size = config.get("etl.pagerank.resync_batch_size", 5000)
+    repaired = 0
+    async with get_db_connection() as conn:
+        async with conn.cursor() as cursor:
+            for table, url_column in CONTENT_TABLES:
+                await cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM `{table}`")
+                max_id = (await cursor.fetchone())[0]
+                sql = _repair_sql(table, url_column)
+                for low in range(0, max_id, batch_size):
+                    try:
+                        await cursor.execute(sql, (low, low + batch_size))
+                        repaired += cursor.rowcount
+                        await conn.commit()
+                    except Exception:
+                        await conn.rollback()
+                        raise
+    if repaired:
+        logger.info(f"内容表PageRank分数重同步: 修正 {repaired} 行")
+    return repaired
+
+
+def diff_scores(scores: Dict[str, float], previous: Dict[str, float],
+                epsilon: float) -> Tuple[List[Tuple[str, float]], List[str]]:
+    """返回 (新增或变化的 (url, 分数), 已不在图中的url)"""
+    changed = [
+        (url, score) for url, score in scores.items()
+        if url not in previous or abs(score - previous[url]) > epsilon
+    ]
+    removed = [url for url in previous if url not in scores]
+    return changed, removed
+
+
+async def publish_pagerank_scores(scores: Dict[str, float],
+                                  previous: Optional[Dict[str, float]] = None,
+                                  graph: Optional[LinkGraph] = None,
+                                  epsilon: Optional[float] = None) -> Dict[str, int]:
+    """
+    增量发布PageRank分数
+
+    Args:
+        scores: 本次计算的 {url: 分数}
+        previous: 上一次发布的分数，未提供时从 pagerank_scores 表读取
+        graph: 本次的链接图，用于写入出入度
+        epsilon: 分数变化阈值，默认取配置 etl.pagerank.publish_epsilon
+
+    Returns:
+        变化、删除的URL数和内容表更新的行数
+    """
+    if previous is None:
+        previous = await load_previous_scores()
+    if epsilon is None:
+        epsilon = config.get("etl.pagerank.publish_epsilon", 1e-9)
+
+    changed, removed = diff_scores(scores, previous, epsilon)
+    stats = {"total": len(scores), "changed": len(changed), "removed": len(removed), "content_rows": 0}
+    logger.info(f"PageRank分数差异: 共 {len(scores)} 个URL，变化 {len(changed)} 个，移除 {len(removed)} 个")
+    if not changed and not removed:
+        return stats
+
+    in_degree = out_degree = None
+    if graph is not None:
+        in_degree, out_degree = graph.in_degree, graph.out_degree
+
+    def degrees(url: str) -> Tuple[int, int]:
+        node_id = graph.url_to_id.get(url) if graph is not None else None
+        if node_id is None:
+            return 0, 0
+        return int(in_degree[node_id]), int(out_degree[node_id])
+
+    async with get_db_connection() as conn:
+        async with conn.cursor() as cursor:
+            try:
+                await cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS `{_DELTA_TABLE}`")
+                await cursor.execute(
+                    f"CREATE TEMPORARY TABLE `{_DELTA_TABLE}` ("
+                    "url varchar(255) NOT NULL PRIMARY KEY, score double NOT NULL, "
+                    "in_degree int NOT NULL DEFAULT 0, out_degree int NOT NULL DEFAULT 0"
+                    ") ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"
+                )
+                for i in range(0, len(changed), _BATCH_SIZE):
+                    batch = changed[i:i + _BATCH_SIZE]
+                    params = []
+                    for url, score in batch:
+                        params.extend([url, float(score), *degrees(url)])
+                    await cursor.execute(
+                        f"INSERT INTO `{_DELTA_TABLE}` (url, score, in_degree, out_degree) VALUES "
+                        + ", ".join(["(%s, %s, %s, %s)"] * len(batch))
+                        + " ON DUPLICATE KEY UPDATE score = VALUES(score)",
+                        params,
+                    )
+
+                # 按URL顺序合并，加锁顺序确定
+                await cursor.execute(
+                    "INSERT INTO pagerank_scores (url, pagerank_score, in_degree, out_degree) "
+                    f"SELECT url, score, in_degree, out_degree FROM `{_DELTA_TABLE}` ORDER BY url "
+                    "ON DUPLICATE KEY UPDATE pagerank_score = VALUES(pagerank_score), "
+                    "in_degree = VALUES(in_degree), out_degree = VALUES(out_degree), "
+                    "calculation_date = CURRENT_TIMESTAMP"
+                )
+                for table, url_column in CONTENT_TABLES:
+                    await cursor.execute(
+                        f"UPDATE `{table}` t JOIN `{_DELTA_TABLE}` d ON t.`{url_column}` = d.url "
+                        "SET t.pagerank_score = d.score"
+                    )
+                    stats["content_rows"] += cursor.rowcount
+
+                for i in range(0, len(removed), _BATCH_SIZE):
+                    batch = removed[i:i + _BATCH_SIZE]
+                    placeholders = ", ".join(["%s"] * len(batch))
+                    await cursor.execute(f"DELETE FROM pagerank_scores WHERE url IN ({placeholders})", batch)
+                    for table, url_column in CONTENT_TABLES:
+                        await cursor.execute(
+                            f"UPDATE `{table}` SET pagerank_score = 0 WHERE `{url_column}` IN ({placeholders})", batch
+                        )
+                        stats["content_rows"] += cursor.rowcount
+
+                await conn.commit()
+            except Exception:
+                await conn.rollback()
+                raise
+            finally:
+                try:
+                    await cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS `{_DELTA_TABLE}`")
+                except Exception:
+                    pass
+
+    logger.info(f"PageRank分数发布完成: 更新内容表 {stats['content_rows']} 行")
+    return stats
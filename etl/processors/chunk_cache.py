@@ -3,335 +3,325 @@
 通用文本分块缓存管理器
 
 提供分块结果的持久化缓存，避免重复分块计算，提高索引构建效率。
-支持多种缓存策略和自动过期机制。
+
+缓存以单篇文档为粒度：键为 sha1(分块参数, 文档文本, 参与分块长度计算的元数据字符串)，
+新增或修改一篇文档只会使这一篇的缓存失效，其余文档的分块结果直接复用。
+所有条目保存在同一个sqlite文件中（追加写入，按最近访问时间做TTL淘汰），
+不再为每个批次生成单独的pickle文件和整体重写的JSON元数据。
 """
 
-import os
 import pickle
 import hashlib
-import json
+import sqlite3
+import threading
 import asyncio
+import time
 from pathlib import Path
-from typing import List, Dict, Any, Optional, Union
-from datetime import datetime, timedelta
-import aiofiles
+from typing import List, Dict, Any, Optional, Tuple
+from datetime import timedelta
 from tqdm import tqdm
 
-from llama_index.core.schema import BaseNode, TextNode
+from llama_index.core.schema import BaseNode, MetadataMode, NodeRelationship
 from llama_index.core.node_parser import SentenceSplitter
 from core.utils import register_logger
 from etl import CACHE_PATH, CHUNK_OVERLAP, CHUNK_SIZE
 
+# sqlite单条语句的参数数量上限
+_SQLITE_MAX_PARAMS = 900
+
 
 class ChunkCacheManager:
-    """文本分块缓存管理器"""
-    
-    def __init__(self, cache_ttl_days: int = 30, logger=None):
+    """文本分块缓存管理器（按文档内容寻址）"""
+
+    def __init__(self,
+                 cache_dir: Optional[str] = None,
+                 chunk_size: int = CHUNK_SIZE,
+                 chunk_overlap: int = CHUNK_OVERLAP,
+                 cache_ttl_days: int = 30,
+                 logger=None):
         """
         初始化分块缓存管理器
-        
+
         Args:
-            cache_ttl_days: 缓存有效期（天）
+            cache_dir: 缓存目录，默认 CACHE_PATH/chunks
+            chunk_size: 分块大小
+            chunk_overlap: 分块重叠
+            cache_ttl_days: 缓存有效期（天），按最近一次访问计算
             logger: 日志器
         """
-        self.cache_dir = CACHE_PATH / "chunks"
-        self.chunk_size = CHUNK_SIZE
-        self.chunk_overlap = CHUNK_OVERLAP
+        self.cache_dir = Path(cache_dir) if cache_dir else CACHE_PATH / "chunks"
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
         self.cache_ttl = timedelta(days=cache_ttl_days)
         self.logger = logger or register_logger("chunk_cache")
-        
+
         # 创建缓存目录
         self.cache_dir.mkdir(parents=True, exist_ok=True)
-        
+
         # 初始化分割器
         self.splitter = SentenceSplitter(
             chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap
         )
-        
-        # 缓存元数据文件
-        self.metadata_file = self.cache_dir / "cache_metadata.json"
-        self.metadata = self._load_metadata()
-        
-        self.logger.info(f"分块缓存管理器初始化完成: {self.cache_dir}")
+        self._params_str = f"{type(self.splitter).__name__}:chunk_size={self.chunk_size},chunk_overlap={self.chunk_overlap}"
+
+        self.db_path = self.cache_dir / "chunks.sqlite"
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "key TEXT PRIMARY KEY, chunks BLOB NOT NULL, chunk_count INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_accessed_at ON chunks (accessed_at)")
+        self._conn.commit()
+
+        self.hits = 0
+        self.misses = 0
+        expired = self._evict_expired()
+
+        self.logger.info(f"分块缓存管理器初始化完成: {self.db_path}")
         self.logger.info(f"分块参数: chunk_size={self.chunk_size}, chunk_overlap={self.chunk_overlap}")
-    
-    def _load_metadata(self) -> Dict[str, Any]:
-        """加载缓存元数据"""
-        try:
-            if self.metadata_file.exists():
-                with open(self.metadata_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-        except Exception as e:
-            self.logger.warning(f"加载缓存元数据失败: {e}")
-        
-        return {
-            "cache_version": "1.0",
-            "chunk_params": {
-                "chunk_size": self.chunk_size,
-                "chunk_overlap": self.chunk_overlap
-            },
-            "cached_items": {}
-        }
-    
-    def _save_metadata(self):
-        """保存缓存元数据"""
-        try:
-            with open(self.metadata_file, 'w', encoding='utf-8') as f:
-                json.dump(self.metadata, f, indent=2, ensure_ascii=False)
-        except Exception as e:
-            self.logger.error(f"保存缓存元数据失败: {e}")
-    
-    def _generate_cache_key(self, doc_nodes: List[BaseNode]) -> str:
-        """生成缓存键"""
-        # 基于文档内容和分块参数生成哈希
-        content_hash = hashlib.md5()
-        
-        # 添加分块参数
-        params_str = f"chunk_size={self.chunk_size},chunk_overlap={self.chunk_overlap}"
-        content_hash.update(params_str.encode('utf-8'))
-        
-        # 添加文档内容（取前1000个字符的哈希，避免过长）
-        for node in doc_nodes[:100]:  # 限制节点数量避免哈希过长
-            text_sample = node.text[:1000] if hasattr(node, 'text') else str(node)[:1000]
-            content_hash.update(text_sample.encode('utf-8'))
-        
-        # 添加文档数量信息
-        count_info = f"total_docs={len(doc_nodes)}"
-        content_hash.update(count_info.encode('utf-8'))
-        
+        if expired:
+            self.logger.info(f"清理了 {expired} 个过期缓存项")
+
+    def _generate_cache_key(self, doc_node: BaseNode) -> str:
+        """生成单篇文档的缓存键"""
+        content_hash = hashlib.sha1()
+        content_hash.update(self._params_str.encode('utf-8'))
+        content_hash.update(b"\x00")
+        content_hash.update(doc_node.get_content(metadata_mode=MetadataMode.NONE).encode('utf-8'))
+        # SentenceSplitter会扣除元数据字符串的长度来决定块边界，因此参与计算的元数据也计入键
+        for mode in (MetadataMode.EMBED, MetadataMode.LLM):
+            content_hash.update(b"\x00")
+            content_hash.update(doc_node.get_metadata_str(mode=mode).encode('utf-8'))
         return content_hash.hexdigest()
-    
-    def _get_cache_path(self, cache_key: str) -> Path:
-        """获取缓存文件路径"""
-        return self.cache_dir / f"chunks_{cache_key}.pkl"
-    
-    def _is_cache_valid(self, cache_key: str) -> bool:
-        """检查缓存是否有效"""
-        # 检查缓存文件是否存在
-        cache_path = self._get_cache_path(cache_key)
-        if not cache_path.exists():
-            return False
-        
-        # 检查分块参数是否匹配
-        cached_params = self.metadata.get("chunk_params", {})
-        current_params = {
-            "chunk_size": self.chunk_size,
-            "chunk_overlap": self.chunk_overlap
-        }
-        if cached_params != current_params:
-            self.logger.info(f"分块参数已变更，缓存失效: {cache_key}")
-            return False
-        
-        # 检查缓存时间
-        cache_info = self.metadata.get("cached_items", {}).get(cache_key)
-        if cache_info:
-            cache_time = datetime.fromisoformat(cache_info["created_at"])
-            if datetime.now() - cache_time > self.cache_ttl:
-                self.logger.info(f"缓存已过期，失效: {cache_key}")
-                return False
-        
-        return True
-    
-    async def _load_chunks_from_cache(self, cache_key: str) -> Optional[List[BaseNode]]:
-        """从缓存加载分块结果"""
-        try:
-            cache_path = self._get_cache_path(cache_key)
-            
-            def _load():
-                with open(cache_path, 'rb') as f:
-                    return pickle.load(f)
-            
-            loop = asyncio.get_running_loop()
-            chunks = await loop.run_in_executor(None, _load)
-            
-            self.logger.info(f"从缓存加载 {len(chunks)} 个分块: {cache_key}")
-            return chunks
-            
-        except Exception as e:
-            self.logger.warning(f"从缓存加载分块失败: {e}")
-            return None
-    
-    async def _save_chunks_to_cache(self, cache_key: str, chunks: List[BaseNode]):
-        """保存分块结果到缓存"""
-        try:
-            cache_path = self._get_cache_path(cache_key)
-            
-            def _save():
-                with open(cache_path, 'wb') as f:
-                    pickle.dump(chunks, f)
-            
-            loop = asyncio.get_running_loop()
-            await loop.run_in_executor(None, _save)
-            
-            # 更新元数据
-            self.metadata["cached_items"][cache_key] = {
-                "created_at": datetime.now().isoformat(),
-                "chunk_count": len(chunks),
-                "file_size": cache_path.stat().st_size
-            }
-            self._save_metadata()
-            
-            self.logger.info(f"保存 {len(chunks)} 个分块到缓存: {cache_key}")
-            
-        except Exception as e:
-            self.logger.error(f"保存分块到缓存失败: {e}")
-    
-    async def chunk_documents_with_cache(self, doc_nodes: List[BaseNode], 
+
+    def _evict_expired(self) -> int:
+        """删除超过TTL未被访问的条目"""
+        cutoff = time.time() - self.cache_ttl.total_seconds()
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM chunks WHERE accessed_at < ?", (cutoff,))
+            self._conn.commit()
+            return cursor.rowcount
+
+    def _get_many(self, keys: List[str]) -> Dict[str, bytes]:
+        """批量读取缓存（序列化后的分块列表）并刷新访问时间"""
+        result = {}
+        with self._lock:
+            for start in range(0, len(keys), _SQLITE_MAX_PARAMS):
+                batch = keys[start:start + _SQLITE_MAX_PARAMS]
+                placeholders = ','.join('?' * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, chunks FROM chunks WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                if rows:
+                    result.update(rows)
+                    self._conn.execute(
+                        f"UPDATE chunks SET accessed_at = ? WHERE key IN ({placeholders})", [time.time(), *batch]
+                    )
+            self._conn.commit()
+        return result
+
+    def _put_many(self, items: List[Tuple[str, bytes, int]]):
+        """批量写入缓存 (键, 序列化后的分块列表, 分块数)"""
+        now = time.time()
+        rows = [(key, blob, count, now, now) for key, blob, count in items]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunks (key, chunks, chunk_count, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)", rows
+            )
+            self._conn.commit()
+
+    @staticmethod
+    def _attach_to_document(chunks: List[BaseNode], doc_node: BaseNode) -> List[BaseNode]:
+        """为缓存的分块套用当前文档的元数据和来源关系"""
+        for chunk in chunks:
+            chunk.metadata.update(doc_node.metadata)
+            chunk.relationships[NodeRelationship.SOURCE] = doc_node.as_related_node_info()
+        return chunks
+
+    async def chunk_documents_with_cache(self, doc_nodes: List[BaseNode],
                                        force_refresh: bool = False,
                                        show_progress: bool = True) -> List[BaseNode]:
         """
         对文档进行分块，使用缓存优化
-        
+
+        只有缓存中不存在（新增或内容变化）的文档才会重新分块，返回顺序与输入文档顺序一致。
+
         Args:
             doc_nodes: 原始文档节点列表
             force_refresh: 强制刷新缓存
             show_progress: 显示进度条
-            
+
         Returns:
             分块后的节点列表
         """
         if not doc_nodes:
             return []
-        
-        # 生成缓存键
-        cache_key = self._generate_cache_key(doc_nodes)
-        
-        # 尝试从缓存加载
-        if not force_refresh and self._is_cache_valid(cache_key):
-            cached_chunks = await self._load_chunks_from_cache(cache_key)
-            if cached_chunks is not None:
-                return cached_chunks
-        
-        # 缓存未命中，执行分块
-        self.logger.info(f"缓存未命中，开始分块 {len(doc_nodes)} 个文档")
-        chunks = await self._chunk_documents(doc_nodes, show_progress)
-        
-        # 保存到缓存
-        if chunks:
-            await self._save_chunks_to_cache(cache_key, chunks)
-        
-        return chunks
-    
-    async def _chunk_documents(self, doc_nodes: List[BaseNode], show_progress: bool = True) -> List[BaseNode]:
-        """执行实际的文档分块"""
+
+        keys = [self._generate_cache_key(doc_node) for doc_node in doc_nodes]
+        blobs: Dict[str, bytes] = {}
+        if not force_refresh:
+            try:
+                blobs = await asyncio.to_thread(self._get_many, list(dict.fromkeys(keys)))
+            except Exception as e:
+                self.logger.warning(f"读取分块缓存失败: {e}")
+
+        # 内容相同的文档只分块一次
+        missing = sorted({key: i for i, key in reversed(list(enumerate(keys))) if key not in blobs}.values())
+        hit_count = sum(1 for key in keys if key in blobs)
+        self.hits += hit_count
+        self.misses += len(doc_nodes) - hit_count
+        if len(doc_nodes) > 1:
+            self.logger.info(f"分块缓存: {len(doc_nodes)} 篇文档，命中 {hit_count} 篇，需分块 {len(missing)} 篇")
+
+        fresh: Dict[str, List[BaseNode]] = {}
+        if missing:
+            chunked = await self._chunk_documents([doc_nodes[i] for i in missing], show_progress)
+            new_items = []
+            for i, chunks in zip(missing, chunked):
+                if chunks is None:
+                    continue
+                blobs[keys[i]] = pickle.dumps(chunks)
+                fresh[keys[i]] = chunks
+                new_items.append((keys[i], blobs[keys[i]], len(chunks)))
+            if new_items:
+                try:
+                    await asyncio.to_thread(self._put_many, new_items)
+                except Exception as e:
+                    self.logger.error(f"保存分块到缓存失败: {e}")
+
         chunked_nodes = []
-        
+        for doc_node, key in zip(doc_nodes, keys):
+            if key in fresh:
+                chunked_nodes.extend(fresh.pop(key))
+            elif key in blobs:
+                # 每篇文档反序列化出独立的节点对象，再套用当前文档的元数据
+                try:
+                    chunks = pickle.loads(blobs[key])
+                except Exception as e:
+                    self.logger.warning(f"缓存条目损坏，重新分块: {e}")
+                    chunks = (await self._chunk_documents([doc_node], show_progress=False))[0] or []
+                chunked_nodes.extend(self._attach_to_document(chunks, doc_node))
+
+        return chunked_nodes
+
+    async def _chunk_documents(self, doc_nodes: List[BaseNode], show_progress: bool = True) -> List[Optional[List[BaseNode]]]:
+        """执行实际的文档分块，返回与输入一一对应的分块列表（失败的文档为None）"""
+        results: List[Optional[List[BaseNode]]] = []
+        total_chunks = 0
+
         progress_bar = tqdm(doc_nodes, desc="文本分块", unit="文档", disable=not show_progress)
-        
+
         for doc_node in progress_bar:
             try:
                 # 文本分块
                 chunks = self.splitter.get_nodes_from_documents([doc_node])
-                
+
                 # 为每个分块添加原始元数据
                 for chunk in chunks:
                     chunk.metadata.update(doc_node.metadata)
-                    chunked_nodes.append(chunk)
-                
+                results.append(chunks)
+                total_chunks += len(chunks)
+
                 if show_progress:
-                    progress_bar.set_postfix({'总块数': len(chunked_nodes)})
-                
+                    progress_bar.set_postfix({'总块数': total_chunks})
+
             except Exception as e:
                 self.logger.warning(f"分块文档时出错: {e}")
-                continue
-        
+                results.append(None)
+
         if show_progress:
             progress_bar.close()
-        
-        self.logger.info(f"分块完成，总计 {len(chunked_nodes)} 个文本块")
-        return chunked_nodes
-    
+
+        if len(doc_nodes) > 1:
+            self.logger.info(f"分块完成，总计 {total_chunks} 个文本块")
+        return results
+
     def get_cache_stats(self) -> Dict[str, Any]:
         """获取缓存统计信息"""
-        cached_items = self.metadata.get("cached_items", {})
-        total_items = len(cached_items)
-        total_chunks = sum(item.get("chunk_count", 0) for item in cached_items.values())
-        
-        # 计算总文件大小
-        total_size = 0
-        for cache_key in cached_items:
-            cache_path = self._get_cache_path(cache_key)
-            if cache_path.exists():
-                total_size += cache_path.stat().st_size
-        
+        with self._lock:
+            total_items, total_chunks = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(chunk_count), 0) FROM chunks"
+            ).fetchone()
+        total_size = sum(
+            path.stat().st_size
+            for path in self.cache_dir.glob(f"{self.db_path.name}*")
+            if path.is_file()
+        )
+        lookups = self.hits + self.misses
+
         return {
             "cache_dir": str(self.cache_dir),
             "total_cached_items": total_items,
             "total_chunks": total_chunks,
             "total_size_mb": round(total_size / (1024 * 1024), 2),
-            "chunk_params": self.metadata.get("chunk_params", {}),
-            "cache_ttl_days": self.cache_ttl.days
+            "chunk_params": {
+                "chunk_size": self.chunk_size,
+                "chunk_overlap": self.chunk_overlap
+            },
+            "cache_ttl_days": self.cache_ttl.days,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0
         }
-    
+
     async def cleanup_expired_cache(self):
         """清理过期缓存"""
-        cached_items = self.metadata.get("cached_items", {})
-        expired_keys = []
-        
-        for cache_key, cache_info in cached_items.items():
-            try:
-                cache_time = datetime.fromisoformat(cache_info["created_at"])
-                if datetime.now() - cache_time > self.cache_ttl:
-                    expired_keys.append(cache_key)
-            except Exception as e:
-                self.logger.warning(f"检查缓存项时出错: {e}")
-                expired_keys.append(cache_key)
-        
-        # 删除过期缓存
-        for cache_key in expired_keys:
-            cache_path = self._get_cache_path(cache_key)
-            try:
-                if cache_path.exists():
-                    cache_path.unlink()
-                del cached_items[cache_key]
-                self.logger.info(f"删除过期缓存: {cache_key}")
-            except Exception as e:
-                self.logger.error(f"删除过期缓存失败 {cache_key}: {e}")
-        
-        if expired_keys:
-            self._save_metadata()
-            self.logger.info(f"清理了 {len(expired_keys)} 个过期缓存项")
-    
+        expired = await asyncio.to_thread(self._evict_expired)
+        if expired:
+            self.logger.info(f"清理了 {expired} 个过期缓存项")
+
     async def clear_all_cache(self):
         """清空所有缓存"""
         try:
-            # 删除所有缓存文件
+            def _clear():
+                with self._lock:
+                    self._conn.execute("DELETE FROM chunks")
+                    self._conn.commit()
+                    self._conn.execute("VACUUM")
+
+            await asyncio.to_thread(_clear)
+
+            # 删除旧版按批次保存的缓存文件
             for cache_file in self.cache_dir.glob("chunks_*.pkl"):
                 cache_file.unlink()
-            
-            # 重置元数据
-            self.metadata["cached_items"] = {}
-            self._save_metadata()
-            
+            legacy_metadata = self.cache_dir / "cache_metadata.json"
+            if legacy_metadata.exists():
+                legacy_metadata.unlink()
+
             self.logger.info("已清空所有分块缓存")
-            
+
         except Exception as e:
             self.logger.error(f"清空缓存失败: {e}")
 
 
-# 全局缓存管理器实例
-_global_chunk_cache: Optional[ChunkCacheManager] = None
+# 全局缓存管理器实例（按分块参数区分）
+_global_chunk_caches: Dict[Tuple[int, int], ChunkCacheManager] = {}
+_global_chunk_caches_lock = threading.Lock()
 
 
-def get_chunk_cache_manager(cache_dir: str = None, 
-                          chunk_size: int = 512, 
+def get_chunk_cache_manager(cache_dir: str = None,
+                          chunk_size: int = 512,
                           chunk_overlap: int = 200,
                           cache_ttl_days: int = 30) -> ChunkCacheManager:
     """获取全局分块缓存管理器实例"""
-    global _global_chunk_cache
-    
-    if _global_chunk_cache is None:
-        from etl import CACHE_PATH
-        default_cache_dir = str(CACHE_PATH / "chunks")
-        
-        _global_chunk_cache = ChunkCacheManager(
-            cache_dir=cache_dir or default_cache_dir,
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap,
-            cache_ttl_days=cache_ttl_days
-        )
-    
-    return _global_chunk_cache
+    key = (chunk_size, chunk_overlap)
+    with _global_chunk_caches_lock:
+        manager = _global_chunk_caches.get(key)
+        if manager is None:
+            manager = ChunkCacheManager(
+                cache_dir=cache_dir,
+                chunk_size=chunk_size,
+                chunk_overlap=chunk_overlap,
+                cache_ttl_days=cache_ttl_days
+            )
+            _global_chunk_caches[key] = manager
+
+    return manager
 
 
 async def chunk_documents_cached(doc_nodes: List[BaseNode],
@@ -341,14 +331,14 @@ async def chunk_documents_cached(doc_nodes: List[BaseNode],
                                show_progress: bool = True) -> List[BaseNode]:
     """
     便捷函数：使用缓存进行文档分块
-    
+
     Args:
         doc_nodes: 原始文档节点列表
         chunk_size: 分块大小
         chunk_overlap: 分块重叠
         force_refresh: 强制刷新缓存
         show_progress: 显示进度条
-        
+
     Returns:
         分块后的节点列表
     """
@@ -356,9 +346,9 @@ async def chunk_documents_cached(doc_nodes: List[BaseNode],
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap
     )
-    
+
     return await cache_manager.chunk_documents_with_cache(
         doc_nodes=doc_nodes,
         force_refresh=force_refresh,
         show_progress=show_progress
-    ) 
\ No newline at end of file
+    )
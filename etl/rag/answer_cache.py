@@ -0,0 +1,315 @@
+"""
+语义答案缓存
+
+同学们对同一问题的不同问法非常常见（"图书馆几点开门" / "图书馆开放时间"），RagPipeline.run 每次都要
+经过检索、重排和远程LLM生成。SemanticAnswerCache 保存 (查询向量, 来源文档, 答案)，
+新查询与已缓存查询的余弦相似度超过阈值、且检索参数相同时直接返回缓存的答案。
+
+- 本地向量索引：预分配的归一化向量矩阵，查询时一次矩阵乘法求出全部余弦相似度，满时淘汰最久未命中的条目
+- 按来源失效：每个条目记录其来源文档键（original_url 和节点ID），索引器重新写入某个来源时，
+  引用它的答案全部失效。索引器与API通常不在同一进程，失效记录写入本地sqlite日志，
+  缓存在查询前按间隔读取新增记录；同一进程内的失效立即生效
+- 条目超过 ttl 后过期，避免时效性通知的旧答案长期存在
+
+配置项（etl.rag.answer_cache.*）：
+    enabled               是否启用，默认True
+    size                  最大条目数，默认2048
+    threshold             命中所需的最小余弦相似度，默认0.92
+    ttl                   条目有效期（秒），默认86400
+    invalidation_path     失效日志路径，默认 CACHE_PATH/rag/answer_cache_invalidations.sqlite
+    invalidation_interval 读取失效日志的最小间隔（秒），默认5
+"""
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from config import Config
+from core.utils.logger import register_logger
+from etl import CACHE_PATH
+from etl.embedding.query_cache import normalize_query
+
+logger = register_logger("etl.rag.answer_cache")
+config = Config()
+
+# 表示"全部来源"的失效记录
+ALL_SOURCES = "*"
+
+# 单次失效的来源数超过该值时记为全部失效（全量重建）
+_MAX_LOGGED_SOURCES = 10000
+
+
+def source_keys(metadata: Optional[Dict[str, Any]], node_id: Optional[str] = None) -> List[str]:
+    """来源文档的失效键：original_url（或url）与节点ID"""
+    metadata = metadata or {}
+    keys = []
+    url = metadata.get("original_url") or metadata.get("url")
+    if url:
+        keys.append(str(url))
+    if node_id:
+        keys.append(str(node_id))
+    return keys
+
+
+class _InvalidationLog:
+    """只追加的跨进程失效日志"""
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS invalidations (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "source TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def append(self, sources: List[str]):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO invalidations (source, created_at) VALUES (?, ?)", [(s, now) for s in sources]
+            )
+            # 早于缓存有效期的记录已不可能影响任何条目
+            retention = config.get("etl.rag.answer_cache.ttl", 86400) * 2
+            self._conn.execute("DELETE FROM invalidations WHERE created_at < ?", (now - retention,))
+            self._conn.commit()
+
+    def last_id(self) -> int:
+        with self._lock:
+            row = self._conn.execute("SELECT MAX(id) FROM invalidations").fetchone()
+        return row[0] or 0
+
+    def read_since(self, last_id: int) -> Tuple[int, List[str]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, source FROM invalidations WHERE id > ? ORDER BY id", (last_id,)
+            ).fetchall()
+        if not rows:
+            return last_id, []
+        return rows[-1][0], [source for _, source in rows]
+
+
+class SemanticAnswerCache:
+    """基于本地向量索引的语义答案缓存（线程安全）"""
+
+    def __init__(self, max_size: int = 2048, threshold: float = 0.92, ttl: float = 86400,
+                 invalidation_log: Optional[_InvalidationLog] = None, invalidation_interval: float = 5.0):
+        self.max_size = max_size
+        self.threshold = threshold
+        self.ttl = ttl
+        self._log = invalidation_log
+        self._interval = invalidation_interval
+        self._log_position = invalidation_log.last_id() if invalidation_log is not None else 0
+        self._last_log_check = time.monotonic()
+
+        self._lock = threading.Lock()
+        self._vectors: Optional[np.ndarray] = None
+        self._occupied = np.zeros(max_size, dtype=bool)
+        self._created = np.zeros(max_size, dtype=np.float64)
+        self._scopes: List[Optional[str]] = [None] * max_size
+        self._entries: Dict[int, Dict[str, Any]] = {}
+        self._by_source: Dict[str, Set[int]] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm > 0 else vector
+
+    def _drop(self, slot: int):
+        entry = self._entries.pop(slot, None)
+        if entry is None:
+            return
+        self._occupied[slot] = False
+        self._scopes[slot] = None
+        for key in entry["sources"]:
+            slots = self._by_source.get(key)
+            if slots is not None:
+                slots.discard(slot)
+                if not slots:
+                    del self._by_source[key]
+
+    def _apply_invalidations(self, sources: Iterable[str]) -> int:
+        dropped = 0
+        for source in sources:
+            if source == ALL_SOURCES:
+                dropped += len(self._entries)
+                for slot in list(self._entries):
+                    self._drop(slot)
+                continue
+            for slot in list(self._by_source.get(source, ())):
+                self._drop(slot)
+                dropped += 1
+        self.invalidated += dropped
+        return dropped
+
+    def _sync_invalidations(self):
+        """按间隔读取其他进程写入的失效记录"""
+        if self._log is None or time.monotonic() - self._last_log_check < self._interval:
+            return
+        self._last_log_check = time.monotonic()
+        try:
+            position, sources = self._log.read_since(self._log_position)
+        except Exception as e:
+            logger.warning(f"读取答案缓存失效日志失败: {e}")
+            return
+        if sources:
+            with self._lock:
+                dropped = self._apply_invalidations(sources)
+            self._log_position = position
+            if dropped:
+                logger.info(f"来源文档已重新索引，失效 {dropped} 条缓存答案")
+
+    def lookup(self, embedding, scope: str) -> Optional[Tuple[Dict[str, Any], float]]:
+        """
+        查找语义相近的缓存答案
+
+        Args:
+            embedding: 查询向量
+            scope: 检索参数标识，只在参数相同的条目中查找
+
+        Returns:
+            (缓存的结果, 相似度)，未命中时为None
+        """
+        self._sync_invalidations()
+        query = self._normalize(embedding)
+        with self._lock:
+            if not self._entries or self._vectors is None or self._vectors.shape[1] != query.shape[0]:
+                self.misses += 1
+                return None
+            # 先清理过期条目，避免过期的最近邻挡住仍然有效的次近邻
+            for slot in np.flatnonzero(self._occupied & (time.time() - self._created > self.ttl)):
+                self._drop(int(slot))
+            mask = self._occupied & np.array([s == scope for s in self._scopes])
+            if not mask.any():
+                self.misses += 1
+                return None
+            similarities = np.where(mask, self._vectors @ query, -1.0)
+            slot = int(np.argmax(similarities))
+            similarity = float(similarities[slot])
+            entry = self._entries[slot]
+            if similarity < self.threshold:
+                self.misses += 1
+                return None
+            entry["last_hit"] = time.monotonic()
+            entry["hits"] += 1
+            self.hits += 1
+            return entry["result"], similarity
+
+    def put(self, embedding, scope: str, query: str, result: Dict[str, Any], sources: Iterable[str]):
+        """写入一条答案，来源文档键用于失效"""
+        vector = self._normalize(embedding)
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != vector.shape[0]:
+                # 首次写入或嵌入模型维度变化时重建索引
+                for slot in list(self._entries):
+                    self._drop(slot)
+                self._vectors = np.zeros((self.max_size, vector.shape[0]), dtype=np.float32)
+            free = np.flatnonzero(~self._occupied)
+            if free.size:
+                slot = int(free[0])
+            else:
+                slot = min(self._entries, key=lambda s: self._entries[s]["last_hit"])
+                self._drop(slot)
+            source_set = set(sources)
+            self._vectors[slot] = vector
+            created_at = time.time()
+            self._occupied[slot] = True
+            self._created[slot] = created_at
+            self._scopes[slot] = scope
+            self._entries[slot] = {
+                "query": normalize_query(query),
+                "result": result,
+                "sources": source_set,
+                "created_at": created_at,
+                "last_hit": time.monotonic(),
+                "hits": 0,
+            }
+            for key in source_set:
+                self._by_source.setdefault(key, set()).add(slot)
+
+    def invalidate_sources(self, sources: Optional[Iterable[str]] = None) -> int:
+        """本进程内立即失效引用这些来源的答案，sources为None时全部失效"""
+        with self._lock:
+            return self._apply_invalidations([ALL_SOURCES] if sources is None else sources)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidated": self.invalidated,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+_answer_cache: Optional[SemanticAnswerCache] = None
+_answer_cache_lock = threading.Lock()
+_invalidation_log: Optional[_InvalidationLog] = None
+
+
+def _get_invalidation_log() -> Optional[_InvalidationLog]:
+    global _invalidation_log
+    if _invalidation_log is None:
+        path = config.get("etl.rag.answer_cache.invalidation_path") or \
+            CACHE_PATH / "rag" / "answer_cache_invalidations.sqlite"
+        try:
+            _invalidation_log = _InvalidationLog(Path(path))
+        except Exception as e:
+            logger.warning(f"答案缓存失效日志 {path} 初始化失败: {e}")
+    return _invalidation_log
+
+
+def get_answer_cache() -> Optional[SemanticAnswerCache]:
+    """获取进程内共享的语义答案缓存，未启用时返回None"""
+    global _answer_cache
+    if not config.get("etl.rag.answer_cache.enabled", True):
+        return None
+    if _answer_cache is None:
+        with _answer_cache_lock:
+            if _answer_cache is None:
+                _answer_cache = SemanticAnswerCache(
+                    max_size=config.get("etl.rag.answer_cache.size", 2048),
+                    threshold=config.get("etl.rag.answer_cache.threshold", 0.92),
+                    ttl=config.get("etl.rag.answer_cache.ttl", 86400),
+                    invalidation_log=_get_invalidation_log(),
+                    invalidation_interval=config.get("etl.rag.answer_cache.invalidation_interval", 5),
+                )
+    return _answer_cache
+
+
+def mark_sources_reindexed(sources: Optional[Iterable[str]] = None):
+    """
+    索引器写入来源文档后调用，使引用这些来源的缓存答案失效
+
+    Args:
+        sources: 来源文档键（见 source_keys），None 表示全部失效（全量重建）
+    """
+    if not config.get("etl.rag.answer_cache.enabled", True):
+        return
+    keys = None if sources is None else sorted(set(sources))
+    if keys is not None and not keys:
+        return
+    if keys is None or len(keys) > _MAX_LOGGED_SOURCES:
+        keys = [ALL_SOURCES]
+    if _answer_cache is not None:
+        _answer_cache.invalidate_sources(keys)
+    log = _get_invalidation_log()
+    if log is not None:
+        try:
+            log.append(keys)
+        except Exception as e:
+            logger.warning(f"写入答案缓存失效日志失败: {e}")
@@ -6,11 +6,13 @@ from qdrant_client import QdrantClient
 from llama_index.vector_stores.qdrant import QdrantVectorStore
 
 from config import Config
+from etl import BM25_INDEX_DIR
 from core.utils import register_logger
 from core.agent.agent_factory import get_agent
 from etl.embedding.hf_embeddings import HuggingFaceEmbedding
 from etl.retrieval.rerankers import SentenceTransformerRerank, LLMRerank
 from etl.retrieval.retrievers import QdrantRetriever, BM25Retriever, HybridRetriever, ElasticsearchRetriever
+from etl.retrieval.bm25_index import is_binary_index
 
 config = Config()
 logger = register_logger(__name__)
@@ -73,7 +75,14 @@ def init_reranker(model_name: str, pagerank_weight: float):
     if "bge-reranker" in model_name.lower():
         return LLMRerank(model=model_name, top_n=10, pagerank_weight=pagerank_weight)
     else:
-        return SentenceTransformerRerank(model=model_name, top_n=10, pagerank_weight=pagerank_weight)
+        return SentenceTransformerRerank(
+            model=model_name,
+            top_n=10,
+            pagerank_weight=pagerank_weight,
+            online=config.get('etl.retrieval.rerank.online', True),
+            num_workers=config.get('etl.retrieval.rerank.num_workers', 2),
+            batch_size=config.get('etl.retrieval.rerank.batch_size', 16),
+        )
 
 
 def load_stopwords():
@@ -97,14 +106,27 @@ def init_vector_retriever(collection_name: str, embed_model):
 
 def init_bm25_retriever():
     logger.info("Initializing BM25Retriever using fast mode.")
+    index_dir = config.get('etl.retrieval.bm25.index_dir', BM25_INDEX_DIR)
     nodes_path = config.get('etl.retrieval.bm25.nodes_path')
+    stopwords = load_stopwords()
+    
+    # 优先使用memmap二进制索引，加载几乎无需计算且多进程共享页缓存
+    if is_binary_index(index_dir):
+        try:
+            return BM25Retriever.from_binary_index(
+                index_dir=index_dir,
+                tokenizer=jieba,
+                stopwords=stopwords,
+                similarity_top_k=10
+            )
+        except Exception as e:
+            logger.error(f"BM25二进制索引加载失败，尝试pickle格式: {e}")
     
     if not nodes_path or not os.path.exists(nodes_path):
         logger.warning(f"BM25节点文件不存在: {nodes_path}. BM25检索器将被禁用.")
         return None
     
     try:
-        stopwords = load_stopwords()
         return BM25Retriever.from_pickle_fast(
             nodes_path=nodes_path,
             tokenizer=jieba,
@@ -123,7 +145,10 @@ def init_hybrid_retriever(vector_retriever, bm25_retriever, pagerank_weight: flo
         return HybridRetriever(
             dense_retriever=vector_retriever,
             sparse_retriever=bm25_retriever,
-            pagerank_weight=pagerank_weight
+            retrieval_type=3,
+            pagerank_weight=pagerank_weight,
+            dense_timeout=config.get('etl.retrieval.hybrid.dense_timeout', 10.0),
+            sparse_timeout=config.get('etl.retrieval.hybrid.sparse_timeout', 10.0)
         )
     logger.warning("Cannot initialize HybridRetriever: missing vector or BM25 retriever.")
     return None
@@ -139,7 +164,9 @@ def init_es_retriever(index_name: str):
             index_name=index_name, 
             es_host=es_host, 
             es_port=es_port, 
-            similarity_top_k=10
+            similarity_top_k=10,
+            request_timeout=config.get('etl.data.elasticsearch.search_timeout', 5),
+            wildcard_acceleration=config.get('etl.data.elasticsearch.wildcard_acceleration', True)
         )
     except Exception as e:
         logger.warning(f"Failed to initialize ElasticsearchRetriever: {e}. Wildcard search will be disabled.")
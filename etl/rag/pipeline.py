@@ -130,7 +130,7 @@ result = rag.run("深度学习", filters=filters)
 
 ## 性能优化建议
 
-1. **缓存策略**: 启用嵌入模型缓存
+1. **缓存策略**: 启用嵌入模型缓存；语义相近的重复问题由语义答案缓存直接返回（见 `answer_cache.py`，配置 `etl.rag.answer_cache.*`）
 2. **批处理**: 对大量查询使用批处理
 3. **服务预热**: 提前加载模型和索引
 4. **资源监控**: 监控内存和计算资源使用
@@ -153,7 +153,7 @@ import asyncio
 import time
 from pathlib import Path
 import logging
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 import jieba
 import nest_asyncio
 
@@ -169,6 +169,7 @@ sys.path.append(str(Path(__file__).resolve().parent.parent))
 from config import Config
 from core.utils import register_logger
 from . import components
+from .answer_cache import get_answer_cache, source_keys
 from .strategies import RetrievalStrategy, RerankStrategy
 
 # 配置日志和全局设置
@@ -283,6 +284,49 @@ class RagPipeline:
 
         self.logger.info("RAG pipeline initialized successfully.")
 
+    def warmup(self, query: str = "南开大学") -> Dict[str, float]:
+        """
+        预热管道中的模型和索引，避免首个请求承担懒加载开销。
+
+        Args:
+            query: 用于预热的示例查询
+
+        Returns:
+            各组件预热耗时（秒）
+        """
+        timings = {}
+
+        if self.embed_model is not None:
+            start = time.time()
+            try:
+                self.embed_model.get_query_embedding(query)
+            except Exception as e:
+                self.logger.warning(f"嵌入模型预热失败: {e}")
+            timings["embedding"] = time.time() - start
+
+        if self.bm25_retriever is not None:
+            start = time.time()
+            try:
+                self.bm25_retriever._ensure_initialized()
+            except Exception as e:
+                self.logger.warning(f"BM25索引预热失败: {e}")
+            timings["bm25"] = time.time() - start
+
+        if self.reranker is not None:
+            start = time.time()
+            try:
+                from llama_index.core.schema import TextNode
+                self.reranker.postprocess_nodes(
+                    [NodeWithScore(node=TextNode(text=query), score=0.0)],
+                    query_bundle=QueryBundle(query_str=query)
+                )
+            except Exception as e:
+                self.logger.warning(f"重排序模型预热失败: {e}")
+            timings["reranker"] = time.time() - start
+
+        self.logger.info(f"RAG pipeline warmup finished: {timings}")
+        return timings
+
     def _check_available_retrievers(self) -> Dict[str, bool]:
         """检查可用的检索器"""
         return {
@@ -351,9 +395,8 @@ class RagPipeline:
             if not self.vector_retriever:
                 logger.error("Vector retriever not available")
                 return []
-            if filters and hasattr(self.vector_retriever, 'filters'):
-                self.vector_retriever.filters = filters
-            retrieved_nodes = self.vector_retriever._retrieve(query_bundle)
+            # 过滤器按调用传入，不写到共享的检索器实例上
+            retrieved_nodes = self.vector_retriever._retrieve(query_bundle, filters=filters or None)
             
         elif strategy == RetrievalStrategy.BM25_ONLY:
             if not self.bm25_retriever:
@@ -365,9 +408,7 @@ class RagPipeline:
             if not self.hybrid_retriever:
                 logger.error("Hybrid retriever not available")
                 return []
-            if filters and self.vector_retriever and hasattr(self.vector_retriever, 'filters'):
-                self.vector_retriever.filters = filters
-            retrieved_nodes = self.hybrid_retriever._retrieve(query_bundle)
+            retrieved_nodes = self.hybrid_retriever._retrieve(query_bundle, filters=filters or None)
             
         elif strategy == RetrievalStrategy.ELASTICSEARCH_ONLY:
             if not self.es_retriever:
@@ -468,6 +509,10 @@ class RagPipeline:
         """
         根据上下文节点生成最终答案。
         """
+        return self._generate_answer(query, context_nodes)[0]
+
+    def _generate_answer(self, query: str, context_nodes: List[NodeWithScore]) -> Tuple[str, bool]:
+        """生成答案，返回 (答案, 是否由LLM成功生成)；失败时的兜底文本不应被缓存"""
         logger.info("Generating final answer.")
         
         # 构建参考资料文本，格式与rag.py保持一致
@@ -518,19 +563,21 @@ class RagPipeline:
                 if answer and (answer.startswith("回答：") or answer.startswith("回答:")):
                     answer = answer[3:].strip()
                     
-                return answer or "抱歉，未能生成有效回答。"
+                if answer and not answer.startswith("请求失败"):
+                    return answer, True
+                return answer or "抱歉，未能生成有效回答。", False
             else:
                 logger.warning("Coze返回的结果格式不正确")
-                return "抱歉，回答格式出现问题。"
+                return "抱歉，回答格式出现问题。", False
         except Exception as e:
             logger.error(f"生成答案时出错: {e}")
             # 如果LLM失败，返回基于上下文的简单摘要
             if context_nodes:
-                return f"根据找到的相关信息，{sources_text[:300]}..."
-            return f"抱歉，在生成答案时遇到了问题: {str(e)}"
+                return f"根据找到的相关信息，{sources_text[:300]}...", False
+            return f"抱歉，在生成答案时遇到了问题: {str(e)}", False
 
-    async def _get_user_search_history(self, user_id: str, limit: int = 10) -> List[str]:
-        """获取用户最近的搜索历史"""
+    async def get_user_search_history(self, user_id: str, limit: int = 10) -> List[str]:
+        """获取用户最近的搜索历史；在事件循环中调用后通过 run(search_history=...) 传入"""
         if not user_id:
             return []
         try:
@@ -557,7 +604,8 @@ class RagPipeline:
            skip_generation: bool = False,
            retrieval_strategy: Optional[RetrievalStrategy] = None,
            rerank_strategy: Optional[RerankStrategy] = None,
-           filters=None) -> dict:
+           filters=None,
+           search_history: Optional[List[str]] = None) -> dict:
         """
         执行完整的RAG流程：检索 -> 重排 -> 生成。
         
@@ -570,19 +618,43 @@ class RagPipeline:
             retrieval_strategy: 检索策略
             rerank_strategy: 重排序策略
             filters: Qdrant过滤器
+            search_history: 调用方已获取的用户搜索历史；为None且提供了user_id时在此查询，
+                此时不能在运行中的事件循环里调用（服务端应先 await get_user_search_history）
         """
         logger.info(f"--- Running RAG pipeline for query: '{query}' for user: {user_id} ---")
         logger.info(f"Retrieval strategy: {retrieval_strategy or 'default'}, Rerank strategy: {rerank_strategy or 'default'}")
 
-        # 1. 获取用户历史（用于个性化）
-        search_history = []
-        if user_id:
+        # 0. 获取用户历史（用于个性化）
+        if search_history is None:
+            search_history = []
+            if user_id:
+                try:
+                    search_history = asyncio.run(self.get_user_search_history(user_id))
+                except Exception as e:
+                    logger.warning(f"获取用户搜索历史失败: {e}")
+                    search_history = []
+
+        # 1. 语义答案缓存：问法不同但语义相同的问题直接返回已生成的答案
+        answer_cache = None if skip_generation else get_answer_cache()
+        cache_scope = query_embedding = None
+        if answer_cache is not None:
+            cache_scope = self._answer_cache_scope(
+                top_k_retrieve, top_k_rerank, retrieval_strategy, rerank_strategy, filters,
+                personalized=bool(user_id or search_history)
+            )
+        if cache_scope is not None:
             try:
-                search_history = asyncio.run(self._get_user_search_history(user_id))
+                # 检索阶段会再次嵌入同一查询，由查询嵌入缓存命中，不会重复计算
+                query_embedding = self.embed_model.get_query_embedding(query)
+                cached = answer_cache.lookup(query_embedding, cache_scope)
             except Exception as e:
-                logger.warning(f"获取用户搜索历史失败: {e}")
-                search_history = []
-        
+                logger.warning(f"语义答案缓存查询失败: {e}")
+                query_embedding = cached = None
+            if cached is not None:
+                result, similarity = cached
+                logger.info(f"--- RAG pipeline served from answer cache (similarity={similarity:.3f}) ---")
+                return {**result, "cache_hit": True, "cache_similarity": similarity}
+
         # 2. 检索
         retrieved_nodes = self.retrieve(
             query=query, 
@@ -637,16 +709,38 @@ class RagPipeline:
             }
         
         # 4. 生成
-        answer = self.generate(query, reranked_nodes)
+        answer, generated = self._generate_answer(query, reranked_nodes)
         
         logger.info(f"--- RAG pipeline finished ---")
-        return {
+        result = {
             "answer": answer, 
             "contexts": reranked_nodes,
             "retrieved_texts": retrieved_texts,
             "used_retrieval_strategy": used_strategy.value,
             "used_rerank_strategy": (rerank_strategy or self.default_rerank_strategy).value
         }
+        
+        # 5. 只缓存LLM成功生成的答案，记录来源文档以便重新索引时失效
+        if query_embedding is not None and generated:
+            sources = [key for node in reranked_nodes
+                       for key in source_keys(getattr(node.node, 'metadata', None), node.node.node_id)]
+            answer_cache.put(query_embedding, cache_scope, query, result, sources)
+        return result
+
+    def _answer_cache_scope(self, top_k_retrieve: int, top_k_rerank: int,
+                            retrieval_strategy: Optional[RetrievalStrategy],
+                            rerank_strategy: Optional[RerankStrategy], filters,
+                            personalized: bool = False) -> Optional[str]:
+        """
+        语义答案缓存的检索参数标识；带过滤器或带用户（除NO_RERANK外各重排策略都会按用户历史提权，
+        ES结果未启用重排时也会改为个性化提权）的结果因请求而异，不缓存
+        """
+        rerank_strategy = rerank_strategy or self.default_rerank_strategy
+        if self.embed_model is None or filters is not None or personalized \
+                or rerank_strategy == RerankStrategy.PERSONALIZED:
+            return None
+        retrieval_strategy = retrieval_strategy or self.default_retrieval_strategy
+        return f"{retrieval_strategy.value}|{rerank_strategy.value}|{top_k_retrieve}|{top_k_rerank}"
 
     def retrieve_only(self, 
                      query: str, 
@@ -655,7 +749,8 @@ class RagPipeline:
                      user_id: Optional[str] = None,
                      retrieval_strategy: Optional[RetrievalStrategy] = None,
                      rerank_strategy: Optional[RerankStrategy] = None,
-                     filters=None) -> dict:
+                     filters=None,
+                     search_history: Optional[List[str]] = None) -> dict:
         """
         只执行检索和重排，跳过LLM生成步骤。
         """
@@ -667,7 +762,8 @@ class RagPipeline:
             skip_generation=True,
             retrieval_strategy=retrieval_strategy,
             rerank_strategy=rerank_strategy,
-            filters=filters
+            filters=filters,
+            search_history=search_history
         )
 
     def get_strategy_combinations(self) -> Dict[str, List[str]]:
@@ -0,0 +1,229 @@
+"""
+RAG管道实例管理模块
+
+在进程内维护一个共享的RagPipeline实例，避免每个请求重复加载嵌入模型、
+重排序模型和检索索引。实例在应用启动时创建并预热，索引重建后可通过
+reload_rag_pipeline() 原子替换，正在处理的请求继续持有旧实例直到完成。
+
+实例是进程内的：多worker部署时 request_rag_pipeline_reload() 写入共享的重载标记文件，
+其他worker在下一次 get_or_init_rag_pipeline() 时发现标记更新，在后台各自热替换。
+加载失败后在 etl.retrieval.pipeline.retry_interval 秒内不再重试，避免每个请求都持锁重新加载。
+"""
+import asyncio
+import os
+import time
+from pathlib import Path
+from typing import Optional, Dict, Any
+
+from config import Config
+from core.utils.logger import register_logger
+from etl import CACHE_PATH
+from etl.rag.pipeline import RagPipeline
+from etl.embedding.query_cache import get_query_embedding_cache
+from etl.retrieval.rerank_cache import get_rerank_score_cache
+from etl.rag.answer_cache import get_answer_cache
+
+logger = register_logger('etl.rag.pipeline_manager')
+config = Config()
+
+# 全局RAG管道实例
+rag_pipeline: Optional[RagPipeline] = None
+
+# 串行化初始化与热替换，避免并发重复加载模型
+_pipeline_lock: Optional[asyncio.Lock] = None
+
+# 当前实例的状态信息
+_pipeline_state: Dict[str, Any] = {
+    "version": 0,
+    "loaded_at": None,
+    "load_time": None,
+    "warmup": {},
+    "last_error": None,
+    "last_failure": None,
+    "reload_stamp": 0.0,
+}
+
+# 上次检查重载标记的时间
+_last_stamp_check = 0.0
+_reload_task: Optional[asyncio.Task] = None
+
+
+def _get_lock() -> asyncio.Lock:
+    global _pipeline_lock
+    if _pipeline_lock is None:
+        _pipeline_lock = asyncio.Lock()
+    return _pipeline_lock
+
+
+def _build_pipeline(warmup: bool, **kwargs) -> RagPipeline:
+    """在线程池中运行的同步构建函数"""
+    pipeline = RagPipeline(**kwargs)
+    if warmup:
+        _pipeline_state["warmup"] = pipeline.warmup()
+    return pipeline
+
+
+async def _load_pipeline(**kwargs) -> Optional[RagPipeline]:
+    """构建新的管道实例并替换全局引用，调用方需持有锁"""
+    global rag_pipeline
+    warmup = config.get("etl.retrieval.pipeline.warmup", True)
+    start_time = time.time()
+    try:
+        loop = asyncio.get_running_loop()
+        new_pipeline = await loop.run_in_executor(
+            None, lambda: _build_pipeline(warmup, **kwargs)
+        )
+    except Exception as e:
+        logger.error(f"RAG管道加载失败: {e}", exc_info=True)
+        _pipeline_state["last_error"] = str(e)
+        _pipeline_state["last_failure"] = time.time()
+        return None
+
+    # 单次引用赋值即为原子替换，旧实例在其请求结束后由GC回收
+    rag_pipeline = new_pipeline
+    _pipeline_state.update({
+        "version": _pipeline_state["version"] + 1,
+        "loaded_at": time.time(),
+        "load_time": time.time() - start_time,
+        "last_error": None,
+        "last_failure": None,
+    })
+    logger.info(
+        f"RAG管道已加载 (version={_pipeline_state['version']}, "
+        f"耗时={_pipeline_state['load_time']:.2f}秒)"
+    )
+    return new_pipeline
+
+
+async def init_rag_pipeline(**kwargs) -> Optional[RagPipeline]:
+    """
+    初始化共享的RAG管道实例。
+    此函数应在应用启动时调用，重复调用不会重新加载。
+    """
+    if rag_pipeline is not None:
+        return rag_pipeline
+
+    async with _get_lock():
+        if rag_pipeline is not None:
+            return rag_pipeline
+        if _in_failure_backoff():
+            return None
+        logger.info("正在初始化共享RAG管道...")
+        return await _load_pipeline(**kwargs)
+
+
+def _in_failure_backoff() -> bool:
+    """上次加载失败后的重试间隔内返回True"""
+    last_failure = _pipeline_state["last_failure"]
+    if last_failure is None:
+        return False
+    return time.time() - last_failure < config.get("etl.retrieval.pipeline.retry_interval", 60)
+
+
+async def reload_rag_pipeline(**kwargs) -> Optional[RagPipeline]:
+    """
+    重新加载RAG管道（如索引重建后）。
+
+    新实例完全构建并预热后才会替换旧实例；加载失败时保留旧实例继续服务。
+    """
+    async with _get_lock():
+        logger.info("正在热替换RAG管道...")
+        new_pipeline = await _load_pipeline(**kwargs)
+        if new_pipeline is None:
+            logger.warning("RAG管道热替换失败，继续使用旧实例")
+            return rag_pipeline
+        return new_pipeline
+
+
+def get_rag_pipeline() -> Optional[RagPipeline]:
+    """获取当前共享的RAG管道实例，未初始化时返回None"""
+    return rag_pipeline
+
+
+async def get_or_init_rag_pipeline() -> Optional[RagPipeline]:
+    """获取共享RAG管道实例，未初始化时按需加载；其他worker请求过重载时在后台热替换"""
+    if rag_pipeline is not None:
+        _check_reload_stamp()
+        return rag_pipeline
+    if _in_failure_backoff():
+        return None
+    return await init_rag_pipeline()
+
+
+def _reload_stamp_path() -> Path:
+    return Path(config.get("etl.retrieval.pipeline.reload_stamp_path") or CACHE_PATH / "rag" / "pipeline_reload")
+
+
+def _read_reload_stamp() -> float:
+    try:
+        return float(_reload_stamp_path().read_text().strip() or 0)
+    except (OSError, ValueError):
+        return 0.0
+
+
+def request_rag_pipeline_reload() -> float:
+    """写入重载标记，通知同一部署中的所有worker重新加载RAG管道"""
+    stamp = time.time()
+    path = _reload_stamp_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    tmp_path.write_text(str(stamp))
+    tmp_path.replace(path)
+    return stamp
+
+
+def _check_reload_stamp():
+    """按间隔检查重载标记，标记比当前实例更新时在后台热替换"""
+    global _last_stamp_check, _reload_task
+    now = time.monotonic()
+    if now - _last_stamp_check < config.get("etl.retrieval.pipeline.reload_check_interval", 5):
+        return
+    _last_stamp_check = now
+    if _reload_task is not None and not _reload_task.done():
+        return
+    stamp = _read_reload_stamp()
+    if stamp <= _pipeline_state["reload_stamp"]:
+        return
+    # 每个标记只处理一次，本进程加载时间晚于标记时说明已是新索引
+    _pipeline_state["reload_stamp"] = stamp
+    if (_pipeline_state["loaded_at"] or 0) >= stamp:
+        return
+    logger.info("检测到其他worker请求重载RAG管道，开始后台热替换")
+    _reload_task = asyncio.ensure_future(reload_rag_pipeline())
+
+
+async def close_rag_pipeline():
+    """
+    释放RAG管道实例。
+    此函数应在应用关闭时调用。
+    """
+    global rag_pipeline
+    async with _get_lock():
+        if rag_pipeline is not None:
+            rag_pipeline = None
+            logger.info("RAG管道已释放。")
+
+
+def get_rag_pipeline_status() -> Dict[str, Any]:
+    """获取RAG管道状态信息"""
+    status = dict(_pipeline_state)
+    status["pid"] = os.getpid()
+    status["initialized"] = rag_pipeline is not None
+    if rag_pipeline is not None:
+        status["available_retrievers"] = rag_pipeline.available_retrievers
+    embed_model = getattr(rag_pipeline, "embed_model", None) if rag_pipeline is not None else None
+    if embed_model is not None and hasattr(embed_model, "batcher_stats"):
+        status["embedding_batcher"] = embed_model.batcher_stats()
+    reranker = getattr(rag_pipeline, "reranker", None) if rag_pipeline is not None else None
+    if reranker is not None and hasattr(reranker, "latency_stats"):
+        status["reranker_latency"] = reranker.latency_stats()
+    query_cache = get_query_embedding_cache()
+    if query_cache is not None:
+        status["query_embedding_cache"] = query_cache.stats()
+    rerank_cache = get_rerank_score_cache()
+    if rerank_cache is not None:
+        status["rerank_score_cache"] = rerank_cache.stats()
+    answer_cache = get_answer_cache()
+    if answer_cache is not None:
+        status["answer_cache"] = answer_cache.stats()
+    return status
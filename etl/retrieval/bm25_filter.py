@@ -0,0 +1,207 @@
+"""
+BM25元数据过滤
+
+将节点的常用过滤字段（平台、来源、发布时间、标签）保存为numpy列，
+过滤时直接生成布尔掩码与分数向量相与，避免逐个节点读取metadata。
+
+每列由排好序的类别表和整数编码组成：
+    categories   类别值（统一转为字符串）升序列表
+    codes        int32，单值字段为每个文档一个编码（-1表示缺失）；
+                 多值字段（如标签列表）为所有值的编码拼接
+    indptr       多值字段的CSR行指针，单值字段为None
+
+过滤值语义（与原先的 metadata[key] == value 兼容）：
+    标量               精确匹配；多值字段为包含该值
+    list/tuple/set     匹配其中任意一个值
+    dict               范围匹配，支持 gte/gt/lte/lt（按字符串顺序，适用于ISO格式时间）
+"""
+import bisect
+import json
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+DEFAULT_FILTER_FIELDS = ("platform", "source", "publish_time", "tag")
+
+_COLUMNS_FILE = "columns.json"
+
+
+def _normalize(value) -> Optional[str]:
+    if value is None or value == "":
+        return None
+    return str(value)
+
+
+class MetadataColumn:
+    """单个元数据字段的列式存储"""
+
+    def __init__(self, categories: List[str], codes: np.ndarray, indptr: Optional[np.ndarray] = None):
+        self.categories = categories
+        self.codes = codes
+        self.indptr = indptr
+
+    @property
+    def multi(self) -> bool:
+        return self.indptr is not None
+
+    def __len__(self) -> int:
+        return len(self.indptr) - 1 if self.multi else len(self.codes)
+
+    @classmethod
+    def from_values(cls, values: Sequence) -> "MetadataColumn":
+        """由每个文档的字段值构建列，值为list/tuple/set时构建为多值列"""
+        multi = any(isinstance(v, (list, tuple, set)) for v in values)
+        if multi:
+            per_doc = [
+                [_normalize(x) for x in (v if isinstance(v, (list, tuple, set)) else [v])]
+                for v in values
+            ]
+            per_doc = [[x for x in doc if x is not None] for doc in per_doc]
+        else:
+            per_doc = [_normalize(v) for v in values]
+
+        flat = [x for doc in per_doc for x in doc] if multi else [x for x in per_doc if x is not None]
+        categories = sorted(set(flat))
+        lookup = {c: i for i, c in enumerate(categories)}
+
+        if multi:
+            indptr = np.zeros(len(per_doc) + 1, dtype=np.int64)
+            np.cumsum([len(doc) for doc in per_doc], out=indptr[1:])
+            codes = np.fromiter((lookup[x] for doc in per_doc for x in doc), dtype=np.int32, count=int(indptr[-1]))
+            return cls(categories, codes, indptr)
+        codes = np.fromiter((lookup[x] if x is not None else -1 for x in per_doc), dtype=np.int32, count=len(per_doc))
+        return cls(categories, codes)
+
+    def _allowed(self, value) -> np.ndarray:
+        """返回按编码+1索引的布尔查找表（下标0对应缺失值）"""
+        allowed = np.zeros(len(self.categories) + 1, dtype=bool)
+        if isinstance(value, dict):
+            lo, hi = 0, len(self.categories)
+            if "gte" in value:
+                lo = max(lo, bisect.bisect_left(self.categories, str(value["gte"])))
+            if "gt" in value:
+                lo = max(lo, bisect.bisect_right(self.categories, str(value["gt"])))
+            if "lte" in value:
+                hi = min(hi, bisect.bisect_right(self.categories, str(value["lte"])))
+            if "lt" in value:
+                hi = min(hi, bisect.bisect_left(self.categories, str(value["lt"])))
+            if lo < hi:
+                allowed[lo + 1:hi + 1] = True
+            return allowed
+        wanted = value if isinstance(value, (list, tuple, set)) else [value]
+        for item in wanted:
+            item = _normalize(item)
+            if item is None:
+                continue
+            pos = bisect.bisect_left(self.categories, item)
+            if pos < len(self.categories) and self.categories[pos] == item:
+                allowed[pos + 1] = True
+        return allowed
+
+    def mask(self, value) -> np.ndarray:
+        """计算匹配过滤值的文档布尔掩码"""
+        allowed = self._allowed(value)
+        hits = allowed[self.codes + 1]
+        if not self.multi:
+            return hits
+        doc_of_value = np.repeat(np.arange(len(self), dtype=np.int64), np.diff(self.indptr))
+        return np.bincount(doc_of_value[hits], minlength=len(self)) > 0
+
+    def values(self) -> List[Union[str, List[str], None]]:
+        """还原每个文档的字段值（合并列时使用）"""
+        if self.multi:
+            return [
+                [self.categories[c] for c in self.codes[self.indptr[i]:self.indptr[i + 1]]]
+                for i in range(len(self))
+            ]
+        return [self.categories[c] if c >= 0 else None for c in self.codes]
+
+    def take(self, positions: np.ndarray) -> "MetadataColumn":
+        """按文档位置选取子集，类别表保持不变"""
+        if not self.multi:
+            return MetadataColumn(self.categories, self.codes[positions])
+        lengths = np.diff(self.indptr)[positions]
+        indptr = np.zeros(len(positions) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        starts = np.asarray(self.indptr)[positions]
+        value_positions = np.repeat(starts - indptr[:-1], lengths) + np.arange(indptr[-1])
+        return MetadataColumn(self.categories, self.codes[value_positions], indptr)
+
+
+class MetadataColumns:
+    """一组元数据列，对应一个索引段（或一个内存中的节点列表）"""
+
+    def __init__(self, columns: Dict[str, MetadataColumn], num_docs: int):
+        self.columns = columns
+        self.num_docs = num_docs
+
+    @classmethod
+    def from_metadata(cls, metadata_list: Sequence[Dict[str, Any]], fields=DEFAULT_FILTER_FIELDS) -> "MetadataColumns":
+        columns = {
+            field: MetadataColumn.from_values([(m or {}).get(field) for m in metadata_list])
+            for field in fields
+        }
+        return cls(columns, len(metadata_list))
+
+    @classmethod
+    def from_nodes(cls, nodes: Sequence, fields=DEFAULT_FILTER_FIELDS) -> "MetadataColumns":
+        return cls.from_metadata([node.metadata for node in nodes], fields)
+
+    @classmethod
+    def concat(cls, parts: List["MetadataColumns"]) -> "MetadataColumns":
+        """拼接多个段的列（合并类别表后重新编码）"""
+        fields = set.intersection(*(set(p.columns) for p in parts)) if parts else set()
+        columns = {}
+        for field in fields:
+            values = []
+            for part in parts:
+                values.extend(part.columns[field].values())
+            columns[field] = MetadataColumn.from_values(values)
+        return cls(columns, sum(p.num_docs for p in parts))
+
+    def take(self, positions: np.ndarray) -> "MetadataColumns":
+        return MetadataColumns({f: c.take(positions) for f, c in self.columns.items()}, len(positions))
+
+    def mask(self, filters: Dict[str, Any]) -> Tuple[Optional[np.ndarray], Dict[str, Any]]:
+        """
+        计算过滤条件的掩码。返回 (掩码, 未建列的剩余条件)，
+        所有条件都未建列时掩码为None，剩余条件需由调用方逐个节点检查。
+        """
+        mask = None
+        residual = {}
+        for key, value in filters.items():
+            column = self.columns.get(key)
+            if column is None:
+                residual[key] = value
+                continue
+            column_mask = column.mask(value)
+            mask = column_mask if mask is None else (mask & column_mask)
+        return mask, residual
+
+    def save(self, index_dir: Union[str, Path]):
+        index_dir = Path(index_dir)
+        layout = {}
+        for field, column in self.columns.items():
+            np.save(index_dir / f"col_{field}_codes.npy", column.codes)
+            if column.multi:
+                np.save(index_dir / f"col_{field}_indptr.npy", column.indptr)
+            layout[field] = {"categories": column.categories, "multi": column.multi}
+        with open(index_dir / _COLUMNS_FILE, "w", encoding="utf-8") as f:
+            json.dump({"num_docs": self.num_docs, "fields": layout}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, index_dir: Union[str, Path], mmap: bool = True) -> Optional["MetadataColumns"]:
+        """加载段目录中的元数据列，不存在时返回None"""
+        index_dir = Path(index_dir)
+        if not (index_dir / _COLUMNS_FILE).exists():
+            return None
+        with open(index_dir / _COLUMNS_FILE, "r", encoding="utf-8") as f:
+            layout = json.load(f)
+        mmap_mode = "r" if mmap else None
+        columns = {}
+        for field, info in layout["fields"].items():
+            codes = np.load(index_dir / f"col_{field}_codes.npy", mmap_mode=mmap_mode)
+            indptr = np.load(index_dir / f"col_{field}_indptr.npy", mmap_mode=mmap_mode) if info["multi"] else None
+            columns[field] = MetadataColumn(info["categories"], codes, indptr)
+        return cls(columns, layout["num_docs"])
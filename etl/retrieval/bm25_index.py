@@ -0,0 +1,831 @@
+"""
+BM25二进制索引格式
+
+将BM25索引以列式二进制文件存储在一个目录中，通过numpy memmap加载：
+启动时不需要反序列化整个语料库或重新计算统计量，多个uvicorn工作进程
+通过操作系统页缓存共享同一份索引数据。
+
+索引目录由若干不可变的段（segment）和一个清单文件组成，增量更新时只写入
+新段并在清单中记录被删除（墓碑）的文档，IDF等全局统计量在加载时由各段的
+倒排表合并得到，段数或删除比例过高时再合并压缩为单个段。
+
+索引目录布局：
+    manifest.json      格式版本、BM25参数、段列表及各段被删除的文档序号、待删除的旧段
+    seg-000000/        段目录（见下）
+    seg-000001/        ...
+
+段目录布局（format_version=1，早期版本的单段索引直接位于索引目录下）：
+    meta.json          格式版本、BM25参数、文档数、平均文档长度、停用词等
+    vocab.json         词项 -> 词项ID
+    idf.npy            float32[num_terms]   每个词项的IDF
+    indptr.npy         int64[num_terms+1]   CSR行指针（按词项组织的倒排表）
+    doc_ids.npy        int32[nnz]           倒排表中的文档ID
+    term_freqs.npy     float32[nnz]         倒排表中的词频
+    doc_lens.npy       float32[num_docs]    文档长度
+    doc_norms.npy      float32[num_docs]    k1*(1-b+b*dl/avgdl)，查询时免除除法
+    nodes.bin          逐个pickle的节点数据（按需反序列化）
+    node_offsets.npy   int64[num_docs+1]    nodes.bin中每个节点的字节偏移
+    ids.json           每个文档的节点ID和所属文档标识（用于删除和替换）
+    columns.json       元数据过滤列的类别表，编码见 col_*.npy（见 bm25_filter）
+"""
+import os
+import json
+import time
+import pickle
+import shutil
+import bisect
+from array import array
+from collections import Counter
+from collections.abc import Sequence
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Union
+
+import numpy as np
+
+from etl.retrieval import logger
+from etl.retrieval.bm25_filter import MetadataColumns
+
+BM25_INDEX_FORMAT_VERSION = 1
+
+_MANIFEST_FILE = "manifest.json"
+_META_FILE = "meta.json"
+_VOCAB_FILE = "vocab.json"
+_NODES_FILE = "nodes.bin"
+_IDS_FILE = "ids.json"
+_ARRAY_FILES = ("idf", "indptr", "doc_ids", "term_freqs", "doc_lens", "doc_norms", "node_offsets")
+
+# 增量保存后不再被清单引用的段保留的时长（秒）：读取旧清单、尚未映射完段文件的进程仍能完成加载，
+# 映射完成后删除目录不影响已打开的memmap
+RETIRED_SEGMENT_GRACE_SECONDS = 600
+
+
+def compute_idf(doc_freqs: np.ndarray, num_docs: int, bm25_type: int = 0, epsilon: float = 0.25) -> np.ndarray:
+    """计算IDF，与rank_bm25.BM25Okapi (bm25_type=0) 和 bm25s (bm25_type=1) 保持一致"""
+    df = doc_freqs.astype(np.float64)
+    if bm25_type == 1:
+        idf = np.log(1.0 + (num_docs - df + 0.5) / (df + 0.5))
+    else:
+        idf = np.log(num_docs - df + 0.5) - np.log(df + 0.5)
+        if len(idf):
+            # BM25Okapi: 负IDF替换为 epsilon * 平均IDF
+            eps = epsilon * idf.mean()
+            idf[idf < 0] = eps
+    return idf.astype(np.float32)
+
+
+def compute_doc_norms(doc_lens: np.ndarray, k1: float, b: float, avgdl: Optional[float] = None) -> np.ndarray:
+    """计算文档长度归一化项 k1*(1-b+b*dl/avgdl)"""
+    if avgdl is None:
+        avgdl = float(doc_lens.mean()) if len(doc_lens) else 0.0
+    if not avgdl:
+        return np.full(len(doc_lens), k1, dtype=np.float32)
+    return (k1 * (1 - b + b * np.asarray(doc_lens, dtype=np.float32) / avgdl)).astype(np.float32)
+
+
+def document_key(node) -> str:
+    """节点所属文档的稳定标识，增量更新时用于替换同一文档的旧节点"""
+    metadata = getattr(node, "metadata", None) or {}
+    for key in ("url", "file_path", "source_file"):
+        if metadata.get(key):
+            return str(metadata[key])
+    return node.node_id
+
+
+class BM25NodeStore(Sequence):
+    """按需反序列化的只读节点序列，节点数据保留在页缓存而非Python堆中"""
+
+    def __init__(self, index_dir: Union[str, Path]):
+        index_dir = Path(index_dir)
+        self._offsets = np.load(index_dir / "node_offsets.npy", mmap_mode="r")
+        self._blob = np.memmap(index_dir / _NODES_FILE, dtype=np.uint8, mode="r")
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("node index out of range")
+        return pickle.loads(self.raw(index))
+
+    def raw(self, index: int) -> bytes:
+        """返回节点的序列化数据，合并段时直接复制而无需反序列化"""
+        start, end = int(self._offsets[index]), int(self._offsets[index + 1])
+        return self._blob[start:end].tobytes()
+
+
+class ChainedNodes(Sequence):
+    """将多个段的节点序列拼接为一个只读序列"""
+
+    def __init__(self, parts: List[Sequence]):
+        self._parts = parts
+        self._offsets = [0]
+        for part in parts:
+            self._offsets.append(self._offsets[-1] + len(part))
+
+    def __len__(self) -> int:
+        return self._offsets[-1]
+
+    def _locate(self, index: int):
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("node index out of range")
+        part = bisect.bisect_right(self._offsets, index) - 1
+        return self._parts[part], index - self._offsets[part]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        part, local = self._locate(index)
+        return part[local]
+
+    def raw(self, index: int) -> bytes:
+        part, local = self._locate(index)
+        if hasattr(part, "raw"):
+            return part.raw(local)
+        return pickle.dumps(part[local], protocol=pickle.HIGHEST_PROTOCOL)
+
+
+class _NodeSelection(Sequence):
+    """按位置选取节点序列的子集（压缩时用于跳过已删除文档）"""
+
+    def __init__(self, nodes: Sequence, positions: np.ndarray):
+        self._nodes = nodes
+        self._positions = positions
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def __getitem__(self, index):
+        return self._nodes[int(self._positions[index])]
+
+    def raw(self, index: int) -> bytes:
+        return self._nodes.raw(int(self._positions[index]))
+
+
+class BM25BinaryIndex:
+    """基于CSR倒排表的BM25打分器，接口与rank_bm25保持一致（get_scores）"""
+
+    def __init__(
+        self,
+        vocab: Dict[str, int],
+        idf: np.ndarray,
+        indptr: np.ndarray,
+        doc_ids: np.ndarray,
+        term_freqs: np.ndarray,
+        doc_lens: np.ndarray,
+        doc_norms: np.ndarray,
+        k1: float = 1.5,
+        b: float = 0.75,
+        epsilon: float = 0.25,
+        bm25_type: int = 0,
+    ):
+        self.vocab = vocab
+        self.idf = idf
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.term_freqs = term_freqs
+        self.doc_lens = doc_lens
+        self.doc_norms = doc_norms
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.bm25_type = bm25_type
+        self.corpus_size = len(doc_lens)
+        self.avgdl = float(doc_lens.mean()) if len(doc_lens) else 0.0
+
+    @classmethod
+    def from_corpus(
+        cls,
+        corpus: List[List[str]],
+        k1: float = 1.5,
+        b: float = 0.75,
+        epsilon: float = 0.25,
+        bm25_type: int = 0,
+    ) -> "BM25BinaryIndex":
+        """从分词后的语料库构建倒排表"""
+        vocab: Dict[str, int] = {}
+        term_ids = array("i")
+        doc_ids = array("i")
+        term_freqs = array("f")
+        doc_lens = np.empty(len(corpus), dtype=np.float32)
+
+        for doc_id, tokens in enumerate(corpus):
+            doc_lens[doc_id] = len(tokens)
+            for term, freq in Counter(tokens).items():
+                term_id = vocab.get(term)
+                if term_id is None:
+                    term_id = vocab[term] = len(vocab)
+                term_ids.append(term_id)
+                doc_ids.append(doc_id)
+                term_freqs.append(freq)
+
+        term_ids_np = np.frombuffer(term_ids, dtype=np.int32)
+        # 稳定排序保证同一词项下文档ID保持升序
+        order = np.argsort(term_ids_np, kind="stable")
+        doc_freqs = np.bincount(term_ids_np, minlength=len(vocab))
+        indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(doc_freqs, out=indptr[1:])
+
+        return cls(
+            vocab=vocab,
+            idf=compute_idf(doc_freqs, len(corpus), bm25_type, epsilon),
+            indptr=indptr,
+            doc_ids=np.frombuffer(doc_ids, dtype=np.int32)[order],
+            term_freqs=np.frombuffer(term_freqs, dtype=np.float32)[order],
+            doc_lens=doc_lens,
+            doc_norms=compute_doc_norms(doc_lens, k1, b),
+            k1=k1,
+            b=b,
+            epsilon=epsilon,
+            bm25_type=bm25_type,
+        )
+
+    def get_scores(self, query: List[str]) -> np.ndarray:
+        """计算查询对所有文档的BM25分数，重复的查询词按出现次数累加（与rank_bm25一致）"""
+        scores = np.zeros(self.corpus_size, dtype=np.float32)
+        for term in query:
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            docs = self.doc_ids[start:end]
+            tf = self.term_freqs[start:end]
+            scores[docs] += self.idf[term_id] * tf * (self.k1 + 1) / (tf + self.doc_norms[docs])
+        return scores
+
+    def postings_term_ids(self) -> np.ndarray:
+        """每个倒排项对应的词项ID（CSR行号展开）"""
+        return np.repeat(np.arange(len(self.indptr) - 1, dtype=np.int64), np.diff(self.indptr))
+
+    def save(
+        self,
+        index_dir: Union[str, Path],
+        nodes: Sequence,
+        extra_meta: Optional[Dict[str, Any]] = None,
+        ids: Optional[Dict[str, List[str]]] = None,
+        columns: Optional[MetadataColumns] = None,
+    ) -> None:
+        """
+        写入段目录。先写入临时目录再整体替换，正在使用旧索引的进程不受影响
+        （已映射的文件在被替换后仍然有效）。
+        """
+        index_dir = Path(index_dir)
+        tmp_dir = index_dir.with_name(f"{index_dir.name}.tmp-{os.getpid()}")
+        if tmp_dir.exists():
+            shutil.rmtree(tmp_dir)
+        tmp_dir.mkdir(parents=True)
+
+        offsets = np.zeros(len(nodes) + 1, dtype=np.int64)
+        collect = ids is None or columns is None
+        collected_ids = {"node_ids": [], "doc_keys": []}
+        metadata_list = []
+        with open(tmp_dir / _NODES_FILE, "wb") as f:
+            for i in range(len(nodes)):
+                if hasattr(nodes, "raw") and not collect:
+                    data = nodes.raw(i)
+                else:
+                    node = nodes[i]
+                    data = pickle.dumps(node, protocol=pickle.HIGHEST_PROTOCOL)
+                    if collect:
+                        collected_ids["node_ids"].append(node.node_id)
+                        collected_ids["doc_keys"].append(document_key(node))
+                        metadata_list.append(node.metadata)
+                f.write(data)
+                offsets[i + 1] = offsets[i] + len(data)
+
+        with open(tmp_dir / _IDS_FILE, "w", encoding="utf-8") as f:
+            json.dump(ids if ids is not None else collected_ids, f, ensure_ascii=False)
+        if columns is None:
+            columns = MetadataColumns.from_metadata(metadata_list)
+        columns.save(tmp_dir)
+
+        arrays = {
+            "idf": self.idf,
+            "indptr": self.indptr,
+            "doc_ids": self.doc_ids,
+            "term_freqs": self.term_freqs,
+            "doc_lens": self.doc_lens,
+            "doc_norms": self.doc_norms,
+            "node_offsets": offsets,
+        }
+        for name, arr in arrays.items():
+            np.save(tmp_dir / f"{name}.npy", np.ascontiguousarray(arr))
+
+        with open(tmp_dir / _VOCAB_FILE, "w", encoding="utf-8") as f:
+            json.dump(self.vocab, f, ensure_ascii=False)
+
+        meta = {
+            "format_version": BM25_INDEX_FORMAT_VERSION,
+            "bm25_type": self.bm25_type,
+            "k1": self.k1,
+            "b": self.b,
+            "epsilon": self.epsilon,
+            "num_docs": self.corpus_size,
+            "num_terms": len(self.vocab),
+            "num_postings": int(len(self.doc_ids)),
+            "avgdl": self.avgdl,
+        }
+        meta.update(extra_meta or {})
+        with open(tmp_dir / _META_FILE, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+        _swap_dir(tmp_dir, index_dir)
+
+        logger.debug(
+            f"BM25索引段已保存到: {index_dir} "
+            f"(文档={meta['num_docs']}, 词项={meta['num_terms']}, 倒排项={meta['num_postings']})"
+        )
+
+    @classmethod
+    def load(cls, index_dir: Union[str, Path], mmap: bool = True) -> "BM25BinaryIndex":
+        """以memmap方式加载段目录"""
+        index_dir = Path(index_dir)
+        meta = _read_json(index_dir / _META_FILE)
+        _check_version(meta)
+        mmap_mode = "r" if mmap else None
+        arrays = {
+            name: np.load(index_dir / f"{name}.npy", mmap_mode=mmap_mode)
+            for name in _ARRAY_FILES if name != "node_offsets"
+        }
+        with open(index_dir / _VOCAB_FILE, "r", encoding="utf-8") as f:
+            vocab = json.load(f)
+        return cls(
+            vocab=vocab,
+            k1=meta["k1"],
+            b=meta["b"],
+            epsilon=meta["epsilon"],
+            bm25_type=meta["bm25_type"],
+            **arrays,
+        )
+
+
+class _Segment:
+    """索引段：倒排表、节点序列及其ID，name为None表示尚未写入磁盘"""
+
+    def __init__(self, index: BM25BinaryIndex, nodes: Sequence, ids: Dict[str, List[str]],
+                 name: Optional[str] = None, deleted: Optional[np.ndarray] = None,
+                 columns: Optional[MetadataColumns] = None):
+        self.index = index
+        self.nodes = nodes
+        self.ids = ids
+        self.name = name
+        self.deleted = np.zeros(index.corpus_size, dtype=bool) if deleted is None else deleted
+        self._columns = columns
+
+    @property
+    def size(self) -> int:
+        return self.index.corpus_size
+
+    @property
+    def columns(self) -> MetadataColumns:
+        """元数据过滤列，旧版段目录中不存在时首次使用才从节点构建"""
+        if self._columns is None:
+            self._columns = MetadataColumns.from_nodes(self.nodes)
+        return self._columns
+
+
+class BM25SegmentedIndex:
+    """
+    由多个不可变段组成的BM25索引，支持追加文档和按节点ID删除文档。
+
+    IDF、平均文档长度等全局统计量由各段倒排表在墓碑过滤后合并计算，
+    与对全部存活文档重新构建索引得到的分数一致，但无需重新分词。
+    """
+
+    def __init__(
+        self,
+        segments: List[_Segment],
+        k1: float = 1.5,
+        b: float = 0.75,
+        epsilon: float = 0.25,
+        bm25_type: int = 0,
+        index_dir: Optional[Union[str, Path]] = None,
+        next_segment: int = 0,
+    ):
+        self.segments = segments
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.bm25_type = bm25_type
+        self.index_dir = Path(index_dir) if index_dir else None
+        self.next_segment = next_segment
+        self._refresh()
+
+    # ---------------------------------------------------------------- 统计量
+
+    def _refresh(self):
+        """重新计算全局词表、文档频率、IDF和长度归一化项"""
+        self._offsets = np.zeros(len(self.segments) + 1, dtype=np.int64)
+        for i, seg in enumerate(self.segments):
+            self._offsets[i + 1] = self._offsets[i] + seg.size
+
+        if len(self.segments) == 1:
+            # 单段（最常见情况）直接复用段内词表
+            self.vocab = self.segments[0].index.vocab
+            local_to_global = [None]
+        else:
+            self.vocab = {}
+            local_to_global = []
+            for seg in self.segments:
+                mapping = np.empty(len(seg.index.vocab), dtype=np.int64)
+                for term, local_id in seg.index.vocab.items():
+                    global_id = self.vocab.get(term)
+                    if global_id is None:
+                        global_id = self.vocab[term] = len(self.vocab)
+                    mapping[local_id] = global_id
+                local_to_global.append(mapping)
+        self._local_to_global = local_to_global
+
+        self.live = np.concatenate([~seg.deleted for seg in self.segments]) if self.segments else np.zeros(0, dtype=bool)
+        self.doc_lens = np.concatenate([np.asarray(seg.index.doc_lens) for seg in self.segments]) if self.segments else np.zeros(0, dtype=np.float32)
+
+        doc_freqs = np.zeros(len(self.vocab), dtype=np.int64)
+        for seg, mapping in zip(self.segments, local_to_global):
+            if seg.deleted.any():
+                term_ids = seg.index.postings_term_ids()
+                term_ids = term_ids[~seg.deleted[np.asarray(seg.index.doc_ids)]]
+                local_df = np.bincount(term_ids, minlength=len(seg.index.vocab))
+            else:
+                local_df = np.diff(np.asarray(seg.index.indptr))
+            if mapping is None:
+                doc_freqs += local_df
+            else:
+                np.add.at(doc_freqs, mapping, local_df)
+        self.doc_freqs = doc_freqs
+
+        self.corpus_size = int(self.live.sum())
+        live_lens = self.doc_lens[self.live]
+        self.avgdl = float(live_lens.mean()) if len(live_lens) else 0.0
+
+        present = doc_freqs > 0
+        self.idf = np.zeros(len(self.vocab), dtype=np.float32)
+        self.idf[present] = compute_idf(doc_freqs[present], self.corpus_size, self.bm25_type, self.epsilon)
+        self.doc_norms = compute_doc_norms(self.doc_lens, self.k1, self.b, self.avgdl)
+        self._positions = None
+
+    @property
+    def total_docs(self) -> int:
+        """包含已删除文档在内的文档总数（即分数数组长度）"""
+        return int(self._offsets[-1])
+
+    @property
+    def num_deleted(self) -> int:
+        return self.total_docs - self.corpus_size
+
+    @property
+    def nodes(self) -> ChainedNodes:
+        return ChainedNodes([seg.nodes for seg in self.segments])
+
+    # ---------------------------------------------------------------- 查询
+
+    def get_scores(self, query: List[str]) -> np.ndarray:
+        """计算查询对所有文档的BM25分数，已删除文档的分数为0"""
+        scores = np.zeros(self.total_docs, dtype=np.float32)
+        for term in query:
+            global_id = self.vocab.get(term)
+            if global_id is None or self.doc_freqs[global_id] == 0:
+                continue
+            idf = self.idf[global_id]
+            for i, seg in enumerate(self.segments):
+                local_id = seg.index.vocab.get(term)
+                if local_id is None:
+                    continue
+                start, end = seg.index.indptr[local_id], seg.index.indptr[local_id + 1]
+                docs = seg.index.doc_ids[start:end] + self._offsets[i]
+                tf = seg.index.term_freqs[start:end]
+                scores[docs] += idf * tf * (self.k1 + 1) / (tf + self.doc_norms[docs])
+        if self.num_deleted:
+            scores[~self.live] = 0
+        return scores
+
+    def metadata_mask(self, filters: Dict[str, Any]):
+        """
+        计算元数据过滤掩码，返回 (掩码, 剩余条件)，语义同 MetadataColumns.mask。
+        只有所有段都建列的字段才走向量化过滤。
+        """
+        indexed = set.intersection(*(set(seg.columns.columns) for seg in self.segments)) if self.segments else set()
+        column_filters = {k: v for k, v in filters.items() if k in indexed}
+        residual = {k: v for k, v in filters.items() if k not in indexed}
+        if not column_filters:
+            return None, residual
+        masks = [seg.columns.mask(column_filters)[0] for seg in self.segments]
+        return np.concatenate(masks), residual
+
+    # ---------------------------------------------------------------- 增删
+
+    def _position_map(self) -> Dict[str, List[int]]:
+        if self._positions is None:
+            positions: Dict[str, List[int]] = {}
+            offset = 0
+            for seg in self.segments:
+                for i, node_id in enumerate(seg.ids["node_ids"]):
+                    positions.setdefault(node_id, []).append(offset + i)
+                offset += seg.size
+            self._positions = positions
+        return self._positions
+
+    def _mark_deleted(self, positions: List[int]) -> int:
+        count = 0
+        for pos in positions:
+            seg_idx = int(np.searchsorted(self._offsets, pos, side="right")) - 1
+            seg = self.segments[seg_idx]
+            local = pos - int(self._offsets[seg_idx])
+            if not seg.deleted[local]:
+                seg.deleted[local] = True
+                count += 1
+        return count
+
+    def delete(self, node_ids: List[str], refresh: bool = True) -> int:
+        """按节点ID删除文档（写入墓碑），返回新删除的文档数"""
+        position_map = self._position_map()
+        positions = [pos for node_id in node_ids for pos in position_map.get(node_id, [])]
+        count = self._mark_deleted(positions)
+        if refresh and count:
+            self._refresh()
+        return count
+
+    def delete_documents(self, doc_keys: List[str], refresh: bool = True) -> int:
+        """按文档标识删除该文档的全部节点，返回新删除的文档数"""
+        keys = set(doc_keys)
+        positions = []
+        offset = 0
+        for seg in self.segments:
+            positions.extend(offset + i for i, key in enumerate(seg.ids["doc_keys"]) if key in keys)
+            offset += seg.size
+        count = self._mark_deleted(positions)
+        if refresh and count:
+            self._refresh()
+        return count
+
+    def add(self, corpus: List[List[str]], nodes: List, replace: bool = True) -> int:
+        """
+        以新段的形式追加已分词的文档。replace为True时，已存在的同一文档
+        （相同节点ID或文档标识）的旧节点会被标记删除。返回被替换的文档数。
+        """
+        if len(corpus) != len(nodes):
+            raise ValueError("corpus与nodes长度不一致")
+        ids = {
+            "node_ids": [node.node_id for node in nodes],
+            "doc_keys": [document_key(node) for node in nodes],
+        }
+        replaced = 0
+        if replace and self.segments:
+            replaced += self.delete(ids["node_ids"], refresh=False)
+            replaced += self.delete_documents(ids["doc_keys"], refresh=False)
+        index = BM25BinaryIndex.from_corpus(corpus, k1=self.k1, b=self.b, epsilon=self.epsilon, bm25_type=self.bm25_type)
+        self.segments.append(_Segment(index, list(nodes), ids, columns=MetadataColumns.from_nodes(nodes)))
+        self._refresh()
+        return replaced
+
+    # ---------------------------------------------------------------- 压缩
+
+    def needs_compaction(self, max_segments: int = 8, max_deleted_ratio: float = 0.2) -> bool:
+        """段数过多或已删除文档比例过高时需要压缩"""
+        if len(self.segments) > max_segments:
+            return True
+        return self.total_docs > 0 and self.num_deleted / self.total_docs > max_deleted_ratio
+
+    def compacted(self) -> "BM25SegmentedIndex":
+        """
+        将所有段合并为一个段并丢弃已删除文档，直接重排已有倒排表，无需重新分词。
+        返回新的索引对象（尚未写入磁盘），当前对象保持不变，可在后台线程中执行。
+        """
+        remap = np.cumsum(self.live) - 1
+        term_parts, doc_parts, tf_parts = [], [], []
+        for i, seg in enumerate(self.segments):
+            doc_ids = np.asarray(seg.index.doc_ids, dtype=np.int64) + self._offsets[i]
+            keep = self.live[doc_ids]
+            term_ids = seg.index.postings_term_ids()
+            if self._local_to_global[i] is not None:
+                term_ids = self._local_to_global[i][term_ids]
+            term_parts.append(term_ids[keep])
+            doc_parts.append(remap[doc_ids[keep]])
+            tf_parts.append(np.asarray(seg.index.term_freqs)[keep])
+
+        term_ids = np.concatenate(term_parts) if term_parts else np.zeros(0, dtype=np.int64)
+        doc_ids = np.concatenate(doc_parts) if doc_parts else np.zeros(0, dtype=np.int64)
+        term_freqs = np.concatenate(tf_parts) if tf_parts else np.zeros(0, dtype=np.float32)
+
+        # 只保留仍有存活文档的词项，重新编号
+        used = np.flatnonzero(self.doc_freqs > 0)
+        new_ids = np.full(len(self.vocab), -1, dtype=np.int64)
+        new_ids[used] = np.arange(len(used))
+        term_ids = new_ids[term_ids]
+        order = np.lexsort((doc_ids, term_ids))
+        indptr = np.zeros(len(used) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(used)), out=indptr[1:])
+
+        terms = [None] * len(self.vocab)
+        for term, global_id in self.vocab.items():
+            terms[global_id] = term
+        vocab = {terms[global_id]: new_id for new_id, global_id in enumerate(used)}
+
+        doc_lens = self.doc_lens[self.live].astype(np.float32)
+        index = BM25BinaryIndex(
+            vocab=vocab,
+            idf=self.idf[used],
+            indptr=indptr,
+            doc_ids=doc_ids[order].astype(np.int32),
+            term_freqs=term_freqs[order].astype(np.float32),
+            doc_lens=doc_lens,
+            doc_norms=compute_doc_norms(doc_lens, self.k1, self.b),
+            k1=self.k1,
+            b=self.b,
+            epsilon=self.epsilon,
+            bm25_type=self.bm25_type,
+        )
+        live_positions = np.flatnonzero(self.live)
+        all_ids = {
+            key: [value for seg in self.segments for value in seg.ids[key]]
+            for key in ("node_ids", "doc_keys")
+        }
+        ids = {key: [values[pos] for pos in live_positions] for key, values in all_ids.items()}
+        columns = MetadataColumns.concat([seg.columns for seg in self.segments]).take(live_positions)
+        segment = _Segment(index, _NodeSelection(self.nodes, live_positions), ids, columns=columns)
+        return BM25SegmentedIndex(
+            [segment], k1=self.k1, b=self.b, epsilon=self.epsilon, bm25_type=self.bm25_type,
+            index_dir=self.index_dir, next_segment=self.next_segment,
+        )
+
+    # ---------------------------------------------------------------- 持久化
+
+    def save(self, index_dir: Union[str, Path], extra_meta: Optional[Dict[str, Any]] = None) -> None:
+        """
+        写入索引目录。若目录就是当前索引的来源目录，只写入新增的段并更新清单
+        （写入代价与增量成正比）；否则在临时目录中完整写出后整体替换。
+        """
+        index_dir = Path(index_dir)
+        incremental = (
+            self.index_dir is not None
+            and index_dir.resolve() == self.index_dir.resolve()
+            and (index_dir / _MANIFEST_FILE).exists()
+        )
+        if incremental:
+            target = index_dir
+        else:
+            target = index_dir.with_name(f"{index_dir.name}.tmp-{os.getpid()}")
+            if target.exists():
+                shutil.rmtree(target)
+            target.mkdir(parents=True)
+            for seg in self.segments:
+                seg.name = None
+
+        for seg in self.segments:
+            if seg.name is None:
+                seg.name = f"seg-{self.next_segment:06d}"
+                self.next_segment += 1
+                seg.index.save(target / seg.name, seg.nodes, ids=seg.ids, columns=seg._columns)
+
+        meta = {
+            "format_version": BM25_INDEX_FORMAT_VERSION,
+            "bm25_type": self.bm25_type,
+            "k1": self.k1,
+            "b": self.b,
+            "epsilon": self.epsilon,
+            "num_docs": self.corpus_size,
+            "num_deleted": self.num_deleted,
+            "num_terms": int((self.doc_freqs > 0).sum()),
+            "avgdl": self.avgdl,
+            "next_segment": self.next_segment,
+            "segments": [
+                {"name": seg.name, "deleted": np.flatnonzero(seg.deleted).tolist()}
+                for seg in self.segments
+            ],
+        }
+        retired: Dict[str, float] = {}
+        if incremental:
+            now = time.time()
+            names = {seg.name for seg in self.segments}
+            previous = _read_json(index_dir / _MANIFEST_FILE).get("retired", [])
+            retired = {
+                entry["name"]: entry["retired_at"] for entry in previous
+                if entry["name"] not in names and (index_dir / entry["name"]).is_dir()
+            }
+            for path in index_dir.glob("seg-*"):
+                if path.is_dir() and path.name not in names:
+                    retired.setdefault(path.name, now)
+            meta["retired"] = [{"name": name, "retired_at": ts} for name, ts in sorted(retired.items())]
+        meta.update(extra_meta or {})
+        tmp_manifest = target / f"{_MANIFEST_FILE}.tmp-{os.getpid()}"
+        with open(tmp_manifest, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_manifest, target / _MANIFEST_FILE)
+
+        if incremental:
+            # 新清单已生效；不再被引用的段（如压缩前的旧段）超过宽限期后才删除，
+            # 仍在按旧清单加载的读取进程不会遇到段目录缺失，宽限期内的段留待之后的保存清理
+            for name, retired_at in retired.items():
+                if now - retired_at >= RETIRED_SEGMENT_GRACE_SECONDS:
+                    shutil.rmtree(index_dir / name, ignore_errors=True)
+        else:
+            _swap_dir(target, index_dir)
+        self.index_dir = index_dir
+
+        # 节点改为从已写入的段文件按需读取，释放内存中的节点对象
+        for seg in self.segments:
+            if not isinstance(seg.nodes, BM25NodeStore) or not incremental:
+                seg.nodes = BM25NodeStore(index_dir / seg.name)
+
+        logger.info(
+            f"BM25二进制索引已保存到: {index_dir} "
+            f"(段={len(self.segments)}, 文档={meta['num_docs']}, 已删除={meta['num_deleted']}, 词项={meta['num_terms']})"
+        )
+
+    @classmethod
+    def load(cls, index_dir: Union[str, Path], mmap: bool = True) -> "BM25SegmentedIndex":
+        """以memmap方式加载索引目录，兼容早期的单段布局"""
+        index_dir = Path(index_dir)
+        meta = read_index_meta(index_dir)
+        if (index_dir / _MANIFEST_FILE).exists():
+            entries = meta["segments"]
+        else:
+            entries = [{"name": ".", "deleted": []}]
+
+        segments = []
+        for entry in entries:
+            seg_dir = index_dir / entry["name"]
+            index = BM25BinaryIndex.load(seg_dir, mmap=mmap)
+            nodes = BM25NodeStore(seg_dir)
+            if (seg_dir / _IDS_FILE).exists():
+                ids = _read_json(seg_dir / _IDS_FILE)
+            else:
+                ids = {
+                    "node_ids": [node.node_id for node in nodes],
+                    "doc_keys": [document_key(node) for node in nodes],
+                }
+            deleted = np.zeros(index.corpus_size, dtype=bool)
+            deleted[np.asarray(entry["deleted"], dtype=np.int64)] = True
+            segments.append(_Segment(
+                index, nodes, ids, name=entry["name"], deleted=deleted,
+                columns=MetadataColumns.load(seg_dir, mmap=mmap),
+            ))
+
+        return cls(
+            segments,
+            k1=meta["k1"],
+            b=meta["b"],
+            epsilon=meta["epsilon"],
+            bm25_type=meta["bm25_type"],
+            # 单段旧布局无法增量写入，保存时完整重写
+            index_dir=index_dir if (index_dir / _MANIFEST_FILE).exists() else None,
+            next_segment=meta.get("next_segment", len(segments)),
+        )
+
+    @classmethod
+    def from_index(cls, index: BM25BinaryIndex, nodes: Sequence) -> "BM25SegmentedIndex":
+        """由单个内存中的索引构建分段索引"""
+        ids = {
+            "node_ids": [node.node_id for node in nodes],
+            "doc_keys": [document_key(node) for node in nodes],
+        }
+        return cls(
+            [_Segment(index, nodes, ids)],
+            k1=index.k1, b=index.b, epsilon=index.epsilon, bm25_type=index.bm25_type,
+        )
+
+
+def _read_json(path: Path) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _check_version(meta: Dict[str, Any]):
+    version = meta.get("format_version")
+    if version != BM25_INDEX_FORMAT_VERSION:
+        raise ValueError(f"不支持的BM25索引格式版本: {version}（期望 {BM25_INDEX_FORMAT_VERSION}）")
+
+
+def _swap_dir(tmp_dir: Path, index_dir: Path):
+    """用临时目录整体替换目标目录"""
+    old_dir = index_dir.with_name(f"{index_dir.name}.old-{os.getpid()}")
+    if index_dir.exists():
+        os.replace(index_dir, old_dir)
+    os.replace(tmp_dir, index_dir)
+    if old_dir.exists():
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def read_index_meta(index_dir: Union[str, Path]) -> Dict[str, Any]:
+    """读取并校验索引元数据（分段索引读取清单，早期单段索引读取meta.json）"""
+    index_dir = Path(index_dir)
+    meta_path = index_dir / _MANIFEST_FILE
+    if not meta_path.exists():
+        meta_path = index_dir / _META_FILE
+    if not meta_path.exists():
+        raise FileNotFoundError(f"BM25索引元数据不存在: {meta_path}")
+    meta = _read_json(meta_path)
+    _check_version(meta)
+    return meta
+
+
+def is_binary_index(index_dir: Union[str, Path, None]) -> bool:
+    """判断目录下是否存在BM25二进制索引"""
+    if not index_dir:
+        return False
+    index_dir = Path(index_dir)
+    return (index_dir / _MANIFEST_FILE).exists() or (index_dir / _META_FILE).exists()
@@ -0,0 +1,186 @@
+"""
+BM25语料分词
+
+索引构建时的分词是重建BM25索引的主要耗时。本模块提供：
+    TokenCache       以文本内容哈希为键的分词结果缓存（sqlite），未变化的文档在多次构建之间不再重复分词
+    tokenize_corpus  缓存未命中的文本分批交给进程池分词，每个工作进程只加载一次jieba词典
+
+缓存保存的是jieba的原始切分结果，停用词过滤在读取后进行，因此修改停用词表不会使缓存失效。
+"""
+import os
+import json
+import sqlite3
+import hashlib
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Iterable, Optional, Callable, Union
+
+import jieba
+
+from config import Config
+from etl import CACHE_PATH
+from etl.retrieval import logger
+
+config = Config()
+
+# 与 tokenize_and_remove_stopwords 保持一致的占位token
+DUMMY_TOKEN = "dummy_token"
+
+# 少于该数量的未命中文本直接在当前进程分词，避免进程池启动开销
+_MIN_PARALLEL_TEXTS = 2000
+_BATCH_SIZE = 500
+
+
+def _content_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class TokenCache:
+    """基于sqlite的分词结果缓存，键为 sha1(文本)，按jieba版本区分命名空间"""
+
+    def __init__(self, path: Union[str, Path, None] = None):
+        self.path = Path(path) if path else CACHE_PATH / "tokens" / "bm25_tokens.sqlite"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.namespace = f"jieba-{getattr(jieba, '__version__', 'unknown')}"
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS tokens (key TEXT PRIMARY KEY, tokens TEXT NOT NULL)"
+        )
+        self._conn.commit()
+
+    def _key(self, content_hash: str) -> str:
+        return f"{self.namespace}:{content_hash}"
+
+    def get_many(self, hashes: List[str]) -> dict:
+        """批量读取，返回 {内容哈希: token列表}"""
+        result = {}
+        with self._lock:
+            for start in range(0, len(hashes), 900):  # sqlite参数数量上限
+                batch = hashes[start:start + 900]
+                keys = [self._key(h) for h in batch]
+                rows = self._conn.execute(
+                    f"SELECT key, tokens FROM tokens WHERE key IN ({','.join('?' * len(keys))})", keys
+                ).fetchall()
+                prefix = len(self.namespace) + 1
+                for key, tokens in rows:
+                    result[key[prefix:]] = json.loads(tokens)
+        return result
+
+    def put_many(self, items: Iterable):
+        """批量写入 (内容哈希, token列表)"""
+        rows = [(self._key(h), json.dumps(tokens, ensure_ascii=False)) for h, tokens in items]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO tokens (key, tokens) VALUES (?, ?)", rows)
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_token_cache: Optional[TokenCache] = None
+
+
+def get_token_cache() -> Optional[TokenCache]:
+    """获取进程内共享的分词缓存，配置关闭或初始化失败时返回None"""
+    global _token_cache
+    if not config.get("etl.retrieval.bm25.token_cache", True):
+        return None
+    if _token_cache is None:
+        try:
+            _token_cache = TokenCache(config.get("etl.retrieval.bm25.token_cache_path"))
+        except Exception as e:
+            logger.warning(f"分词缓存初始化失败，将不使用缓存: {e}")
+            return None
+    return _token_cache
+
+
+def _init_worker():
+    """工作进程初始化：加载一次jieba词典"""
+    jieba.setLogLevel(60)
+    jieba.initialize()
+
+
+def _cut_batch(texts: List[str]) -> List[List[str]]:
+    return [jieba.lcut(text) for text in texts]
+
+
+def _filter_tokens(words: List[str], stopwords: set) -> List[str]:
+    filtered = [w for w in words if w not in stopwords and w != ' ' and len(w.strip()) > 0]
+    return filtered if filtered else [DUMMY_TOKEN]
+
+
+def tokenize_corpus(
+    texts: List[str],
+    stopwords: Iterable[str],
+    workers: Optional[int] = None,
+    use_cache: bool = True,
+    progress: Optional[Callable[[int], None]] = None,
+) -> List[List[str]]:
+    """
+    对语料分词并去除停用词，结果与逐条调用 tokenize_and_remove_stopwords(jieba, ...) 一致。
+
+    Args:
+        texts: 文本列表
+        stopwords: 停用词
+        workers: 进程数，默认取配置 etl.retrieval.bm25.tokenize_workers 或CPU核数
+        use_cache: 是否使用分词缓存
+        progress: 进度回调，参数为本次新完成的文本数
+    """
+    stopwords = set(stopwords or [])
+    corpus: List[Optional[List[str]]] = [None] * len(texts)
+
+    pending = {}
+    for i, text in enumerate(texts):
+        if not text or not isinstance(text, str):
+            corpus[i] = [DUMMY_TOKEN]
+        else:
+            pending.setdefault(_content_hash(text), []).append(i)
+    if progress and len(texts) > sum(len(v) for v in pending.values()):
+        progress(len(texts) - sum(len(v) for v in pending.values()))
+
+    cache = get_token_cache() if use_cache else None
+    if cache is not None and pending:
+        for content_hash, words in cache.get_many(list(pending)).items():
+            indices = pending.pop(content_hash)
+            tokens = _filter_tokens(words, stopwords)
+            for i in indices:
+                corpus[i] = tokens
+            if progress:
+                progress(len(indices))
+
+    misses = list(pending.items())
+    if misses:
+        hit_count = len(texts) - sum(len(v) for _, v in misses)
+        logger.info(f"分词: {len(texts)} 篇文档，缓存命中 {hit_count} 篇，需分词 {len(misses)} 篇")
+
+        workers = workers or config.get("etl.retrieval.bm25.tokenize_workers") or os.cpu_count() or 1
+        batches = [misses[i:i + _BATCH_SIZE] for i in range(0, len(misses), _BATCH_SIZE)]
+        batch_texts = [[texts[indices[0]] for _, indices in batch] for batch in batches]
+
+        def _consume(results):
+            for batch, words_list in zip(batches, results):
+                cache_items = []
+                for (content_hash, indices), words in zip(batch, words_list):
+                    tokens = _filter_tokens(words, stopwords)
+                    for i in indices:
+                        corpus[i] = tokens
+                    cache_items.append((content_hash, words))
+                if cache is not None:
+                    cache.put_many(cache_items)
+                if progress:
+                    progress(sum(len(indices) for _, indices in batch))
+
+        if workers > 1 and len(misses) >= _MIN_PARALLEL_TEXTS:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+                _consume(executor.map(_cut_batch, batch_texts))
+        else:
+            _consume(map(_cut_batch, batch_texts))
+
+    return corpus
@@ -0,0 +1,175 @@
+"""
+Elasticsearch异步客户端管理模块
+
+在进程内维护一个长期存活的 AsyncElasticsearch 客户端，底层aiohttp连接池通过keep-alive复用连接，
+避免每次搜索都新建、关闭客户端而重复建立TCP连接。客户端在应用启动时创建、关闭时释放，
+ES暂时不可用时客户端仍保留，由后续请求和健康检查更新健康状态。
+
+配置项（etl.data.elasticsearch.*）：
+    host / port             ES地址
+    connections_per_node    每个节点的连接池大小，默认10
+    request_timeout         默认请求超时（秒），默认10
+    max_retries             失败重试次数，默认2
+    health_check_interval   主动健康检查的最小间隔（秒），默认30
+"""
+import asyncio
+import time
+from typing import Any, Dict, Optional
+
+from elasticsearch import AsyncElasticsearch
+
+from config import Config
+from core.utils.logger import register_logger
+
+logger = register_logger('etl.retrieval.es_client')
+config = Config()
+
+# 全局ES客户端
+es_client: Optional[AsyncElasticsearch] = None
+
+_es_lock: Optional[asyncio.Lock] = None
+
+# 客户端健康状态与请求统计
+_es_state: Dict[str, Any] = {
+    "healthy": False,
+    "last_check": None,
+    "last_error": None,
+    "requests": 0,
+    "failures": 0,
+    "total_time": 0.0,
+}
+
+
+def _get_lock() -> asyncio.Lock:
+    global _es_lock
+    if _es_lock is None:
+        _es_lock = asyncio.Lock()
+    return _es_lock
+
+
+def _mark(healthy: bool, error: Optional[Exception] = None):
+    _es_state["healthy"] = healthy
+    _es_state["last_check"] = time.time()
+    _es_state["last_error"] = str(error) if error else None
+
+
+async def init_es_client() -> Optional[AsyncElasticsearch]:
+    """
+    初始化共享的AsyncElasticsearch客户端。
+    此函数应在应用启动时调用，重复调用不会重新创建。
+    """
+    global es_client
+    if es_client is not None:
+        return es_client
+
+    async with _get_lock():
+        if es_client is not None:
+            return es_client
+        host = config.get('etl.data.elasticsearch.host', 'localhost')
+        port = config.get('etl.data.elasticsearch.port', 9200)
+        logger.info(f"正在初始化Elasticsearch客户端 ({host}:{port})...")
+        try:
+            es_client = AsyncElasticsearch(
+                [f"http://{host}:{port}"],
+                connections_per_node=config.get('etl.data.elasticsearch.connections_per_node', 10),
+                request_timeout=config.get('etl.data.elasticsearch.request_timeout', 10),
+                max_retries=config.get('etl.data.elasticsearch.max_retries', 2),
+                retry_on_timeout=True,
+            )
+        except Exception as e:
+            logger.error(f"Elasticsearch客户端初始化失败: {e}")
+            _mark(False, e)
+            return None
+
+    await check_es_health(force=True)
+    return es_client
+
+
+def get_es_client() -> Optional[AsyncElasticsearch]:
+    """获取共享的ES客户端，未初始化时返回None"""
+    return es_client
+
+
+async def get_or_init_es_client() -> Optional[AsyncElasticsearch]:
+    """获取共享的ES客户端，未初始化时按需创建（如离线脚本中使用）"""
+    if es_client is not None:
+        return es_client
+    return await init_es_client()
+
+
+async def check_es_health(force: bool = False) -> bool:
+    """ping ES并更新健康状态；未到检查间隔时直接返回上次结果"""
+    client = es_client
+    if client is None:
+        return False
+    interval = config.get('etl.data.elasticsearch.health_check_interval', 30)
+    last_check = _es_state["last_check"]
+    if not force and last_check is not None and time.time() - last_check < interval:
+        return _es_state["healthy"]
+    try:
+        healthy = bool(await client.options(request_timeout=3).ping())
+        _mark(healthy, None if healthy else ConnectionError("ping失败"))
+    except Exception as e:
+        _mark(False, e)
+    if not _es_state["healthy"]:
+        logger.warning(f"Elasticsearch不可用: {_es_state['last_error']}")
+    return _es_state["healthy"]
+
+
+async def es_search(index: str, body: Dict[str, Any], timeout: Optional[float] = None, **kwargs) -> Dict[str, Any]:
+    """
+    使用共享客户端执行搜索
+
+    Args:
+        index: 索引名称
+        body: 查询体
+        timeout: 本次请求的超时（秒），默认使用客户端的request_timeout
+        **kwargs: 透传给search的其他参数
+
+    Returns:
+        ES响应体（dict）
+    """
+    client = await get_or_init_es_client()
+    if client is None:
+        raise ConnectionError("Elasticsearch客户端不可用")
+    if timeout is not None:
+        client = client.options(request_timeout=timeout)
+
+    start_time = time.perf_counter()
+    _es_state["requests"] += 1
+    try:
+        response = await client.search(index=index, body=body, **kwargs)
+    except Exception as e:
+        _es_state["failures"] += 1
+        _mark(False, e)
+        raise
+    finally:
+        _es_state["total_time"] += time.perf_counter() - start_time
+    if not _es_state["healthy"]:
+        _mark(True)
+    return response.body if hasattr(response, "body") else response
+
+
+async def close_es_client():
+    """
+    关闭共享的ES客户端及其连接池。
+    此函数应在应用关闭时调用。
+    """
+    global es_client
+    async with _get_lock():
+        if es_client is not None:
+            try:
+                await es_client.close()
+            finally:
+                es_client = None
+                _es_state["healthy"] = False
+            logger.info("Elasticsearch客户端已关闭。")
+
+
+def get_es_client_status() -> Dict[str, Any]:
+    """获取ES客户端状态信息"""
+    status = dict(_es_state)
+    status["initialized"] = es_client is not None
+    total_time = status.pop("total_time")
+    status["avg_latency_ms"] = round(total_time / status["requests"] * 1000, 2) if status["requests"] else None
+    return status
@@ -0,0 +1,179 @@
+"""
+Elasticsearch查询构建
+
+含 * 或 ? 的查询原先一次性展开为 wildcard/prefix/suffix/query_string 等多个should子句，
+前导通配符会在每个分片上扫描整个词典。索引带有 wildcard 类型子字段（title.wc / content.wc，
+见 ElasticsearchIndexer）时，查询规划器按模式形状只生成一个低成本子句：
+
+    plain     无通配符          ik_smart 匹配查询（不变）
+    prefix    "南开*"           phrase_prefix，仅扩展最后一个词，max_expansions 有上限
+    pattern   "*大学"/"南开*大学"/"南?"  wildcard 子字段上的包含匹配，由ngram近似索引加速后再校验
+
+索引不带子字段时回退到原来的多子句展开。
+"""
+import re
+from typing import Any, Dict
+
+# wildcard 类型子字段名
+WILDCARD_SUBFIELD = "wc"
+
+# phrase_prefix 最多扩展的词数
+PREFIX_MAX_EXPANSIONS = 50
+
+
+def has_wildcard(query: str) -> bool:
+    return '*' in query or '?' in query
+
+
+def classify_pattern(query: str) -> str:
+    """判断查询的模式形状：plain / prefix / pattern"""
+    if not has_wildcard(query):
+        return "plain"
+    if query.endswith('*') and not has_wildcard(query.rstrip('*')) and query.rstrip('*'):
+        return "prefix"
+    return "pattern"
+
+
+def has_wildcard_fields(mapping: Dict[str, Any], index_name: str) -> bool:
+    """根据 get_mapping 的响应判断索引是否带有 wildcard 子字段"""
+    try:
+        index_mapping = mapping.get(index_name) or next(iter(mapping.values()))
+        properties = index_mapping["mappings"]["properties"]
+        return all(
+            properties[field].get("fields", {}).get(WILDCARD_SUBFIELD, {}).get("type") == "wildcard"
+            for field in ("title", "content")
+        )
+    except (KeyError, StopIteration, AttributeError, TypeError):
+        return False
+
+
+def build_match_query(query: str) -> Dict[str, Any]:
+    """无通配符时使用ik_smart分析器的匹配查询"""
+    return {
+        "query": {
+            "bool": {
+                "should": [
+                    {"match": {"title": {"query": query, "analyzer": "ik_smart", "boost": 2.0}}},
+                    {"match": {"content": {"query": query, "analyzer": "ik_smart", "boost": 1.0}}}
+                ],
+                "minimum_should_match": 1
+            }
+        }
+    }
+
+
+def build_accelerated_wildcard_query(query: str) -> Dict[str, Any]:
+    """在带 wildcard 子字段的索引上，为每种模式形状生成单个低成本子句"""
+    if classify_pattern(query) == "prefix":
+        return {
+            "query": {
+                "multi_match": {
+                    "query": query.rstrip('*'),
+                    "type": "phrase_prefix",
+                    "fields": ["title^2", "content"],
+                    "max_expansions": PREFIX_MAX_EXPANSIONS
+                }
+            }
+        }
+
+    if not query.replace('*', '').replace('?', ''):
+        return {"query": {"match_all": {}}}
+
+    # 合并连续的*并按包含语义两端补*
+    pattern = re.sub(r'\*+', '*', query)
+    if not pattern.startswith('*'):
+        pattern = '*' + pattern
+    if not pattern.endswith('*'):
+        pattern += '*'
+    return {
+        "query": {
+            "bool": {
+                "should": [
+                    {"wildcard": {f"title.{WILDCARD_SUBFIELD}": {
+                        "value": pattern, "case_insensitive": True, "boost": 2.0}}},
+                    {"wildcard": {f"content.{WILDCARD_SUBFIELD}": {
+                        "value": pattern, "case_insensitive": True}}}
+                ],
+                "minimum_should_match": 1
+            }
+        }
+    }
+
+
+def build_legacy_wildcard_query(query: str) -> Dict[str, Any]:
+    """索引不带 wildcard 子字段时的多子句展开"""
+    should_queries = []
+
+    # 策略1: 在keyword字段中使用通配符（用于精确匹配完整标题）
+    should_queries.extend([
+        {"wildcard": {"title.keyword": {"value": query, "case_insensitive": True}}},
+        {"wildcard": {"content.keyword": {"value": query, "case_insensitive": True}}}
+    ])
+
+    # 策略2: 在text字段中使用通配符
+    should_queries.extend([
+        {"wildcard": {"title": {"value": query, "case_insensitive": True}}},
+        {"wildcard": {"content": {"value": query, "case_insensitive": True}}}
+    ])
+
+    # 策略3: 对于简单的前缀后缀匹配，拆分查询
+    if '*' in query:
+        # 处理前缀匹配 如: "南开*"
+        if query.endswith('*') and '*' not in query[:-1]:
+            prefix = query[:-1]
+            should_queries.extend([
+                {"prefix": {"title": {"value": prefix, "case_insensitive": True}}},
+                {"prefix": {"content": {"value": prefix, "case_insensitive": True}}}
+            ])
+
+        # 处理中间匹配 如: "南开*大学"（ES没有suffix查询，后缀部分使用前导通配符）
+        elif query.count('*') == 1 and not query.startswith('*') and not query.endswith('*'):
+            prefix, suffix = query.split('*')
+            for field in ("title", "content"):
+                should_queries.append({
+                    "bool": {
+                        "must": [
+                            {"prefix": {field: {"value": prefix, "case_insensitive": True}}},
+                            {"wildcard": {field: {"value": f"*{suffix}", "case_insensitive": True}}}
+                        ]
+                    }
+                })
+
+    # 策略4: 对于?查询，转换为模糊查询或者更宽泛的匹配
+    if '?' in query:
+        # 将?替换为空，做包含查询作为备选
+        query_without_wildcards = query.replace('?', '').replace('*', '')
+        if query_without_wildcards:
+            should_queries.extend([
+                {"match": {"title": {"query": query_without_wildcards, "fuzziness": "AUTO"}}},
+                {"match": {"content": {"query": query_without_wildcards, "fuzziness": "AUTO"}}}
+            ])
+
+    # 策略5: query_string作为最后的尝试
+    should_queries.append({
+        "query_string": {
+            "query": query,
+            "fields": ["title", "content"],
+            "allow_leading_wildcard": True,
+            "analyze_wildcard": True,
+            "lenient": True
+        }
+    })
+
+    return {
+        "query": {
+            "bool": {
+                "should": should_queries,
+                "minimum_should_match": 1
+            }
+        }
+    }
+
+
+def build_es_query(query: str, accelerated: bool = False) -> Dict[str, Any]:
+    """根据查询字符串和索引能力构建ES查询体"""
+    if not has_wildcard(query):
+        return build_match_query(query)
+    if accelerated:
+        return build_accelerated_wildcard_query(query)
+    return build_legacy_wildcard_query(query)
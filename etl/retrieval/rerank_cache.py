@@ -0,0 +1,80 @@
+"""
+重排分数缓存
+
+同一查询反复召回相同的候选文档时，交叉编码器会对相同的 (query, passage) 对重复打分。
+RerankScoreCache 以 (重排模型, 归一化查询, 段落内容哈希) 为键缓存模型原始分数
+（未叠加PageRank），命中的候选对直接跳过模型，只有未命中的才组批计算。
+
+配置项（etl.retrieval.rerank_cache.*）：
+    enabled   是否启用，默认True
+    size      缓存容量（候选对数量），默认100000
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
+
+from config import Config
+from etl.embedding.query_cache import normalize_query
+
+config = Config()
+
+
+def make_rerank_key(model: str, query: str, passage: str) -> Tuple[str, str, str]:
+    passage_hash = hashlib.sha1(passage.encode("utf-8")).hexdigest()
+    return model, normalize_query(query), passage_hash
+
+
+class RerankScoreCache:
+    """线程安全的有界LRU分数缓存"""
+
+    def __init__(self, max_size: int = 100000):
+        self.max_size = max_size
+        self._data: "OrderedDict[Tuple[str, str, str], float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Tuple[str, str, str]) -> Optional[float]:
+        with self._lock:
+            score = self._data.get(key)
+            if score is None:
+                self.misses += 1
+            else:
+                self._data.move_to_end(key)
+                self.hits += 1
+            return score
+
+    def put(self, key: Tuple[str, str, str], score: float):
+        with self._lock:
+            self._data[key] = score
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+_rerank_cache: Optional[RerankScoreCache] = None
+_rerank_cache_lock = threading.Lock()
+
+
+def get_rerank_score_cache() -> Optional[RerankScoreCache]:
+    """获取进程内共享的重排分数缓存，未启用时返回None"""
+    global _rerank_cache
+    if not config.get("etl.retrieval.rerank_cache.enabled", True):
+        return None
+    if _rerank_cache is None:
+        with _rerank_cache_lock:
+            if _rerank_cache is None:
+                _rerank_cache = RerankScoreCache(config.get("etl.retrieval.rerank_cache.size", 100000))
+    return _rerank_cache
@@ -1,6 +1,10 @@
+import os
 import time
+import threading
 import torch
 import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pydantic import model_validator
 from typing import Any, List, Optional
 from llama_index.core.bridge.pydantic import Field, PrivateAttr, ConfigDict
@@ -10,6 +14,7 @@ from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle
 from llama_index.core.utils import infer_torch_device
 from transformers import AutoTokenizer, AutoModelForCausalLM
 from etl.processors.nodes import get_node_content
+from etl.retrieval.rerank_cache import get_rerank_score_cache, make_rerank_key
 
 DEFAULT_SENTENCE_TRANSFORMER_MAX_LENGTH = 512
 
@@ -39,7 +44,22 @@ class SentenceTransformerRerank(BaseNodePostprocessor):
         default=0.1,
         description="Weight for PageRank score integration"
     )
+    online: bool = Field(
+        default=False,
+        description="Online inference mode: no progress bars, length-sorted batches on a thread pool"
+    )
+    num_workers: int = Field(
+        default=1,
+        description="Number of batches scored concurrently in online mode"
+    )
+    max_length: int = Field(
+        default=DEFAULT_SENTENCE_TRANSFORMER_MAX_LENGTH,
+        description="Token budget for query + passage"
+    )
     _model: Any = PrivateAttr()
+    _executor: Any = PrivateAttr(default=None)
+    _latencies: Any = PrivateAttr()
+    _latency_lock: Any = PrivateAttr()
 
     def __init__(
             self,
@@ -49,6 +69,9 @@ class SentenceTransformerRerank(BaseNodePostprocessor):
             keep_retrieval_score: Optional[bool] = False,
             batch_size: int = 32,
             pagerank_weight: float = 0.1,
+            online: bool = False,
+            num_workers: int = 1,
+            max_length: int = DEFAULT_SENTENCE_TRANSFORMER_MAX_LENGTH,
     ):
         try:
             from sentence_transformers import CrossEncoder
@@ -66,19 +89,32 @@ class SentenceTransformerRerank(BaseNodePostprocessor):
             device=device,
             keep_retrieval_score=keep_retrieval_score,
             batch_size=batch_size,
-            pagerank_weight=pagerank_weight
+            pagerank_weight=pagerank_weight,
+            online=online,
+            num_workers=num_workers,
+            max_length=max_length,
         )
         
         try:
             self._model = CrossEncoder(
                 model, 
-                max_length=512,
+                max_length=max_length,
                 device=device
             )
         except Exception as e:
             raise Exception(f"Failed to initialize CrossEncoder model: {str(e)}")
 
         self.pagerank_weight = pagerank_weight
+        self._latencies = deque(maxlen=1000)
+        self._latency_lock = threading.Lock()
+
+        if online:
+            num_workers = max(1, num_workers)
+            if num_workers > 1:
+                self._executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="rerank")
+            if device == "cpu":
+                # 并发批次数 × 每批的intra-op线程数 ≈ CPU核数，避免线程超订
+                torch.set_num_threads(max(1, (os.cpu_count() or 1) // num_workers))
 
     @classmethod
     def class_name(cls) -> str:
@@ -128,13 +164,95 @@ class SentenceTransformerRerank(BaseNodePostprocessor):
                     
                 except Exception as e:
                     print(f"Error in batch prediction: {str(e)}")
-                    print(f"Batch size: {len(batch)}, Scores type: {type(scores)}")
-                    # 如果批处理失败，给这批数据一个默认分数
-                    all_scores.extend([0.0] * len(batch))
+                    print(f"Batch size: {len(batch)}")
+                    # 如果批处理失败，标记为None（按0分处理且不写入缓存）
+                    all_scores.extend([None] * len(batch))
             return all_scores
         except Exception as e:
             print(f"Error in _batch_predict: {str(e)}")
-            return [0.0] * len(query_and_nodes)
+            return [None] * len(query_and_nodes)
+
+    def _truncate_pairs(self, query_and_nodes: List[tuple]) -> List[tuple]:
+        """
+        按token预算截断段落：段落可用长度 = max_length - 查询长度 - 特殊token，
+        返回 (query, 截断后的段落, 段落token数)。
+        """
+        tokenizer = getattr(self._model, "tokenizer", None)
+        if tokenizer is None:
+            return [(q, p, len(p)) for q, p in query_and_nodes]
+        
+        query_tokens = {}
+        result = []
+        for query, passage in query_and_nodes:
+            if query not in query_tokens:
+                query_tokens[query] = len(tokenizer(query, add_special_tokens=False)["input_ids"])
+            budget = max(16, self.max_length - query_tokens[query] - 4)
+            try:
+                enc = tokenizer(passage, add_special_tokens=False, truncation=True,
+                                max_length=budget, return_offsets_mapping=True)
+                offsets = enc["offset_mapping"]
+                if offsets:
+                    passage = passage[:offsets[-1][1]]
+                result.append((query, passage, len(enc["input_ids"])))
+            except (NotImplementedError, KeyError):
+                # 慢速tokenizer不支持offset mapping，交给模型自身截断
+                result.append((query, passage, len(passage)))
+        return result
+
+    def _predict_batch(self, batch: List[tuple]) -> List[float]:
+        scores = self._model.predict(batch, batch_size=len(batch), show_progress_bar=False)
+        return np.asarray(scores, dtype=np.float32).reshape(-1).tolist()
+
+    def _online_predict(self, query_and_nodes: List[tuple]) -> List[Optional[float]]:
+        """在线推理：按长度排序组批以减少padding，批次在线程池中并行，不创建进度条"""
+        start = time.perf_counter()
+        truncated = self._truncate_pairs(query_and_nodes)
+        order = sorted(range(len(truncated)), key=lambda i: truncated[i][2], reverse=True)
+        batches = [order[i:i + self.batch_size] for i in range(0, len(order), self.batch_size)]
+        pairs = [[(truncated[i][0], truncated[i][1]) for i in batch] for batch in batches]
+        
+        if self._executor is not None and len(batches) > 1:
+            futures = [self._executor.submit(self._predict_batch, batch) for batch in pairs]
+            results = []
+            for future in futures:
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    print(f"Error in batch prediction: {str(e)}")
+                    results.append(None)
+        else:
+            results = []
+            for batch in pairs:
+                try:
+                    results.append(self._predict_batch(batch))
+                except Exception as e:
+                    print(f"Error in batch prediction: {str(e)}")
+                    results.append(None)
+        
+        scores: List[Optional[float]] = [None] * len(query_and_nodes)
+        for batch, batch_scores in zip(batches, results):
+            if batch_scores is None:
+                continue
+            for i, score in zip(batch, batch_scores):
+                scores[i] = score
+        
+        with self._latency_lock:
+            self._latencies.append((time.perf_counter() - start) * 1000)
+        return scores
+
+    def latency_stats(self) -> dict:
+        """在线模式下每次模型调用的延迟分位数（毫秒）"""
+        with self._latency_lock:
+            latencies = np.asarray(self._latencies, dtype=np.float64)
+        if latencies.size == 0:
+            return {"count": 0}
+        return {
+            "count": int(latencies.size),
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p95_ms": float(np.percentile(latencies, 95)),
+            "p99_ms": float(np.percentile(latencies, 99)),
+            "max_ms": float(latencies.max()),
+        }
 
     def _postprocess_nodes(
             self,
@@ -147,6 +265,7 @@ class SentenceTransformerRerank(BaseNodePostprocessor):
             print("警告: 重排器收到空节点列表")
             return []
 
+        pbar = None
         try:
             # 准备输入数据
             query_and_nodes = []
@@ -166,21 +285,31 @@ class SentenceTransformerRerank(BaseNodePostprocessor):
                 print("No valid nodes to process")
                 return nodes[:self.top_n]
 
-            # 设置进度条
-            from tqdm.auto import tqdm
-            
-            print(f"\nReranking {len(valid_nodes)} nodes in batches of {self.batch_size}...")
-            
-            pbar = tqdm(
-                total=len(valid_nodes),
-                desc="Reranking Progress",
-                unit="nodes",
-                miniters=1,
-                smoothing=0.1,
-                dynamic_ncols=True,
-                position=0,
-                leave=True
-            )
+            # 查询分数缓存，只有未命中的候选对才交给模型
+            score_cache = get_rerank_score_cache()
+            cached_scores = [None] * len(query_and_nodes)
+            cache_keys = []
+            if score_cache is not None:
+                cache_keys = [make_rerank_key(self.model, query, content) for query, content in query_and_nodes]
+                cached_scores = [score_cache.get(key) for key in cache_keys]
+            uncached = [i for i, score in enumerate(cached_scores) if score is None]
+
+            if not self.online:
+                # 设置进度条
+                from tqdm.auto import tqdm
+                
+                print(f"\nReranking {len(uncached)}/{len(valid_nodes)} uncached nodes in batches of {self.batch_size}...")
+                
+                pbar = tqdm(
+                    total=len(uncached),
+                    desc="Reranking Progress",
+                    unit="nodes",
+                    miniters=1,
+                    smoothing=0.1,
+                    dynamic_ncols=True,
+                    position=0,
+                    leave=True
+                )
 
             start_time = time.time()
 
@@ -193,14 +322,30 @@ class SentenceTransformerRerank(BaseNodePostprocessor):
                         EventPayload.TOP_K: self.top_n,
                     },
             ) as event:
-                # 批量预测
-                scores = self._batch_predict(query_and_nodes, pbar)
+                # 批量预测未命中缓存的候选对
+                uncached_pairs = [query_and_nodes[i] for i in uncached]
+                if not uncached_pairs:
+                    predicted = []
+                elif self.online:
+                    predicted = self._online_predict(uncached_pairs)
+                else:
+                    predicted = self._batch_predict(uncached_pairs, pbar)
 
-                if len(scores) != len(valid_nodes):
-                    print(f"Warning: Scores length ({len(scores)}) does not match nodes length ({len(valid_nodes)})")
-                    pbar.close()
+                if len(predicted) != len(uncached):
+                    print(f"Warning: Scores length ({len(predicted)}) does not match nodes length ({len(uncached)})")
+                    if pbar is not None:
+                        pbar.close()
                     return nodes[:self.top_n]
 
+                scores = list(cached_scores)
+                for i, score in zip(uncached, predicted):
+                    if score is None:
+                        scores[i] = 0.0
+                        continue
+                    scores[i] = float(score)
+                    if score_cache is not None:
+                        score_cache.put(cache_keys[i], scores[i])
+
                 # 更新分数
                 for node, score in zip(valid_nodes, scores):
                     try:
@@ -223,17 +368,18 @@ class SentenceTransformerRerank(BaseNodePostprocessor):
                     key=lambda x: float('-inf') if x.score is None else -float(x.score)
                 )[:min(self.top_n, len(valid_nodes))]
                 
-                # 显示完成统计
-                total_time = time.time() - start_time
-                print(f"\nReranking completed in {total_time:.2f}s ({len(valid_nodes)/total_time:.2f} nodes/s)")
-                
                 event.on_end(payload={EventPayload.NODES: new_nodes})
-                pbar.close()
+                if pbar is not None:
+                    # 显示完成统计
+                    total_time = time.time() - start_time
+                    print(f"\nReranking completed in {total_time:.2f}s "
+                          f"({len(valid_nodes) - len(uncached)} cached, {len(uncached)} scored)")
+                    pbar.close()
                 return new_nodes
 
         except Exception as e:
             print(f"Error in _postprocess_nodes: {str(e)}")
-            if 'pbar' in locals():
+            if pbar is not None:
                 pbar.close()
             return nodes[:min(self.top_n, len(nodes))]
 
@@ -492,21 +638,27 @@ class LLMRerank(BaseNodePostprocessor):
                     scores = logits[:, -1, self._yes_loc].view(-1).float()
 
             # 更新分数
-            for node, score in zip(batch_data, scores):
-                if self.keep_retrieval_score:
-                    node.node.metadata["retrieval_score"] = node.score
-                
-                # 获取PageRank分数并整合
-                pagerank_score = node.node.metadata.get('pagerank_score', 0.0)
+            score_cache = get_rerank_score_cache()
+            for node, (_, content), score in zip(batch_data, query_and_nodes, scores):
                 score_value = float(score.item() if torch.is_tensor(score) else score)
-                # 结合重排序分数和PageRank分数（使用配置的权重）
-                final_score = score_value + self.pagerank_weight * float(pagerank_score)
-                node.score = final_score
+                if score_cache is not None:
+                    score_cache.put(make_rerank_key(self.model, query_str, content), score_value)
+                self._apply_score(node, score_value)
 
             return batch_data, None
         except Exception as e:
             return None, str(e)
 
+    def _apply_score(self, node: NodeWithScore, score_value: float):
+        """将模型原始分数与PageRank分数结合后写回节点"""
+        if self.keep_retrieval_score:
+            node.node.metadata["retrieval_score"] = node.score
+        
+        # 获取PageRank分数并整合
+        pagerank_score = node.node.metadata.get('pagerank_score', 0.0)
+        # 结合重排序分数和PageRank分数（使用配置的权重）
+        node.score = score_value + self.pagerank_weight * float(pagerank_score)
+
     @model_validator(mode="before")
     @classmethod
     def validate_model(cls, values: dict) -> dict:
@@ -524,6 +676,22 @@ class LLMRerank(BaseNodePostprocessor):
             print("警告: 重排器收到空节点列表")
             return []
         
+        # 命中分数缓存的候选直接使用缓存分数，只有未命中的才交给模型
+        score_cache = get_rerank_score_cache()
+        processed_nodes = []
+        if score_cache is not None:
+            uncached_nodes = []
+            for node in nodes:
+                content = get_node_content(node.node, self._embed_type)
+                cached = score_cache.get(make_rerank_key(self.model, query_bundle.query_str, content))
+                if cached is None:
+                    uncached_nodes.append(node)
+                else:
+                    self._apply_score(node, cached)
+                    processed_nodes.append(node)
+            nodes = uncached_nodes
+        
+        cached_count = len(processed_nodes)
         bsz = self._embed_bs
         N = len(nodes)
 
@@ -547,7 +715,6 @@ class LLMRerank(BaseNodePostprocessor):
         )
 
         start_time = time.time()
-        processed_nodes = []
         errors = []
 
         # 计算总批次数
@@ -586,14 +753,15 @@ class LLMRerank(BaseNodePostprocessor):
                     
                     # 更新进度条信息
                     elapsed = time.time() - start_time
-                    speed = len(processed_nodes) / elapsed
-                    eta = (N - len(processed_nodes)) / speed if speed > 0 else 0
+                    scored = len(processed_nodes) - cached_count
+                    speed = scored / elapsed
+                    eta = (N - scored) / speed if speed > 0 else 0
                     
                     pbar.set_postfix({
                         'Batch': f'{i+1}/{total_batches}',
                         'Speed': f'{speed:.1f} nodes/s',
                         'ETA': f'{eta:.1f}s',
-                        'Success': f'{len(processed_nodes)}/{N}'
+                        'Success': f'{scored}/{N}'
                     })
                     
                 except Exception as e:
@@ -604,7 +772,7 @@ class LLMRerank(BaseNodePostprocessor):
         total_time = time.time() - start_time
         
         # 显示处理统计
-        print(f"\nReranking completed in {total_time:.2f}s ({N/total_time:.2f} nodes/s)")
+        print(f"\nReranking completed in {total_time:.2f}s ({cached_count} cached, {N} scored)")
         if errors:
             print("\nErrors occurred during processing:")
             for error in errors:
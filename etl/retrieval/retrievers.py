@@ -1,12 +1,15 @@
 import os
+import asyncio
 from pathlib import Path
 import re
+import functools
 import time
 import json
 import tempfile
 from typing import List, Dict, Any, Optional, Union, Tuple, Callable, Type
 import numpy as np
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 
 import bm25s
 from llama_index.core import QueryBundle, VectorStoreIndex
@@ -29,6 +32,10 @@ import jieba
 import pickle
 
 from etl.retrieval import logger
+from etl.retrieval.bm25_index import BM25BinaryIndex, BM25SegmentedIndex, read_index_meta
+from etl.retrieval.bm25_filter import MetadataColumns
+from etl.retrieval.bm25_tokenizer import tokenize_corpus
+from etl.retrieval.es_query import build_es_query, has_wildcard_fields
 
 
 class QdrantRetriever(BaseRetriever):
@@ -46,7 +53,10 @@ class QdrantRetriever(BaseRetriever):
         super().__init__()
 
     async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
-        query_embedding = self._embed_model.get_query_embedding(query_bundle.query_str)
+        query_embedding = query_bundle.embedding
+        if query_embedding is None:
+            # 异步接口：缓存未命中时在线程中计算，不阻塞事件循环
+            query_embedding = await self._embed_model.aget_query_embedding(query_bundle.query_str)
         vector_store_query = VectorStoreQuery(
             query_embedding,
             similarity_top_k=self._similarity_top_k,
@@ -62,8 +72,8 @@ class QdrantRetriever(BaseRetriever):
             node_with_scores.append(NodeWithScore(node=node, score=similarity))
         return node_with_scores
 
-    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
-        # 不维护
+    def _retrieve(self, query_bundle: QueryBundle, filters=None) -> List[NodeWithScore]:
+        # 不维护；filters 只作用于本次调用，避免共享实例上的过滤条件串到其他请求
         query_embedding = self._embed_model.get_query_embedding(query_bundle.query_str)
         vector_store_query = VectorStoreQuery(
             query_embedding,
@@ -71,7 +81,7 @@ class QdrantRetriever(BaseRetriever):
         )
         query_result = self._vector_store.query(
             vector_store_query,
-            qdrant_filters=self.filters,  # 需要查找qdrant相关用法
+            qdrant_filters=filters if filters is not None else self.filters,  # 需要查找qdrant相关用法
         )
 
         node_with_scores = []
@@ -168,6 +178,7 @@ class BM25Retriever(BaseRetriever):
             self._initialized = False
         
         self.filter_dict = None
+        self._columns = None
         
         super().__init__(
             callback_manager=callback_manager,
@@ -185,14 +196,7 @@ class BM25Retriever(BaseRetriever):
         start_time = time.time()
         
         # 处理语料库
-        self._corpus = []
-        for i, node in enumerate(self._nodes):
-            if i % 10000 == 0:  # 每处理1万个节点显示一次进度
-                logger.debug(f"已处理 {i}/{len(self._nodes)} 个节点")
-            
-            content = get_node_content(node, self.embed_type)
-            tokens = tokenize_and_remove_stopwords(self._tokenizer, content, stopwords=self.stopwords)
-            self._corpus.append(tokens)
+        self._corpus = self._tokenize_nodes(self._nodes)
         
         if not any(self._corpus):
             raise ValueError("All documents are empty after tokenization")
@@ -216,6 +220,19 @@ class BM25Retriever(BaseRetriever):
         end_time = time.time()
         logger.info(f"BM25索引构建完成，耗时: {end_time - start_time:.2f}秒")
     
+    def _tokenize_nodes(self, nodes) -> List[List[str]]:
+        """对节点分词；使用jieba时走多进程分词和分词缓存"""
+        contents = [get_node_content(node, self.embed_type) for node in nodes]
+        if self._tokenizer is jieba:
+            return tokenize_corpus(contents, self.stopwords)
+        
+        corpus = []
+        for i, content in enumerate(contents):
+            if i % 10000 == 0:  # 每处理1万个节点显示一次进度
+                logger.debug(f"已处理 {i}/{len(contents)} 个节点")
+            corpus.append(tokenize_and_remove_stopwords(self._tokenizer, content, stopwords=self.stopwords))
+        return corpus
+
     def _ensure_initialized(self):
         """确保索引已初始化"""
         if not self._initialized:
@@ -268,8 +285,9 @@ class BM25Retriever(BaseRetriever):
                 end_time = time.time()
                 logger.info(f"文件读取耗时: {end_time - start_time:.2f}秒")
                 
-                # 重新打开文件并使用load_from_pickle方法
-                instance = cls.load_from_pickle(nodes_path, tokenizer)
+                # 直接使用已读取的状态恢复，避免二次反序列化
+                instance = cls._from_state(data, tokenizer)
+                logger.info(f"BM25检索器已从 {nodes_path} 恢复，节点数量: {len(instance._nodes)}")
                 
                 # 更新参数（如果提供的话）
                 if similarity_top_k != DEFAULT_SIMILARITY_TOP_K:
@@ -310,25 +328,43 @@ class BM25Retriever(BaseRetriever):
             logger.error(f"加载BM25文件失败: {e}")
             raise
 
+    def _metadata_mask(self, filters: Dict[str, Any]):
+        """计算元数据过滤掩码，返回 (掩码, 未建列的剩余条件)"""
+        if isinstance(self.bm25, BM25SegmentedIndex):
+            return self.bm25.metadata_mask(filters)
+        # 内存中的索引：首次过滤时为节点列表建列，之后复用
+        if self._columns is None or self._columns.num_docs != len(self._nodes):
+            self._columns = MetadataColumns.from_nodes(self._nodes)
+        return self._columns.mask(filters)
+
     def filter(self, scores):
-        top_n = scores.argsort()[::-1]
+        """
+        选出得分最高的similarity_top_k个节点。
+        元数据条件先以列掩码的形式作用于分数向量，再用argpartition取top-k，
+        只有未建列的字段才逐个节点检查。
+        """
+        scores = np.asarray(scores)
+        top_k = self.similarity_top_k
+        mask = scores > 0
+        residual = {}
+        if self.filter_dict:
+            column_mask, residual = self._metadata_mask(self.filter_dict)
+            if column_mask is not None:
+                mask &= column_mask
+
+        candidates = np.flatnonzero(mask)
+        if not residual and len(candidates) > top_k:
+            candidates = candidates[np.argpartition(scores[candidates], -top_k)[-top_k:]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+
         nodes: List[NodeWithScore] = []
-        for ix in top_n:
-            if scores[ix] <= 0:
-                break
-            flag = True
-            if self.filter_dict is not None:
-                for key, value in self.filter_dict.items():
-                    if self._nodes[ix].metadata[key] != value:
-                        flag = False
-                        break
-            if flag:
-                nodes.append(NodeWithScore(node=self._nodes[ix], score=float(scores[ix])))
-            if len(nodes) == self.similarity_top_k:
+        for ix in candidates:
+            node = self._nodes[ix]
+            if residual and any(node.metadata.get(key) != value for key, value in residual.items()):
+                continue
+            nodes.append(NodeWithScore(node=node, score=float(scores[ix])))
+            if len(nodes) == top_k:
                 break
-
-        # add nodes sort in BM25Retriever
-        nodes = sorted(nodes, key=lambda x: x.score, reverse=True)
         return nodes
 
     def get_scores(self, query, docs=None):
@@ -413,7 +449,9 @@ class BM25Retriever(BaseRetriever):
         """
         if not self._initialized:
             raise ValueError("BM25检索器未初始化，无法保存")
-        
+        if isinstance(self.bm25, BM25SegmentedIndex):
+            raise ValueError("从二进制索引加载的BM25检索器请使用 save_to_binary_index 保存")
+
         # 创建可序列化的状态字典
         state = {
             'nodes': self._nodes,
@@ -467,6 +505,14 @@ class BM25Retriever(BaseRetriever):
         with open(filepath, 'rb') as f:
             state = pickle.load(f)
         
+        instance = cls._from_state(state, tokenizer)
+        logger.info(f"BM25检索器已从 {filepath} 恢复，节点数量: {len(instance._nodes)}")
+        
+        return instance
+
+    @classmethod
+    def _from_state(cls, state: Dict[str, Any], tokenizer=None) -> "BM25Retriever":
+        """从save_to_pickle保存的状态字典重建检索器"""
         # 设置默认tokenizer
         if tokenizer is None:
             import jieba
@@ -491,12 +537,12 @@ class BM25Retriever(BaseRetriever):
         instance._corpus = state['corpus']
         
         # 重建BM25索引对象
+        bm25_data = state['bm25_index']
         if state['bm25_data']['type'] == 1:
             # bm25s类型
             import bm25s
             instance.bm25 = bm25s.BM25(k1=instance.k1, b=instance.b)
             # 恢复内部状态
-            bm25_data = state['bm25_index']
             instance.bm25.doc_freqs = bm25_data['doc_freqs']
             instance.bm25.idf = bm25_data['idf']
             instance.bm25.doc_lens = bm25_data['doc_lens']
@@ -504,18 +550,119 @@ class BM25Retriever(BaseRetriever):
             instance.bm25.vocab = bm25_data['vocab']
             instance.bm25.corpus_size = bm25_data['corpus_size']
         else:
-            # BM25Okapi类型
+            # BM25Okapi类型：直接恢复已保存的统计量，不再遍历语料库重新计算
             from rank_bm25 import BM25Okapi
-            instance.bm25 = BM25Okapi(
-                state['bm25_index']['corpus'],
-                k1=instance.k1,
-                b=instance.b,
-                epsilon=instance.epsilon
-            )
+            bm25 = BM25Okapi.__new__(BM25Okapi)
+            bm25.k1 = instance.k1
+            bm25.b = instance.b
+            bm25.epsilon = instance.epsilon
+            bm25.tokenizer = None
+            bm25.doc_freqs = bm25_data['doc_freqs']
+            bm25.idf = bm25_data['idf']
+            bm25.doc_len = bm25_data['doc_len']
+            bm25.avgdl = bm25_data['avgdl']
+            bm25.corpus_size = len(bm25_data['doc_len'])
+            instance.bm25 = bm25
         
         instance._initialized = True
-        logger.info(f"BM25检索器已从 {filepath} 恢复，节点数量: {len(instance._nodes)}")
+        return instance
+
+    def _ensure_segmented(self) -> BM25SegmentedIndex:
+        """将内存中的BM25索引转换为支持增量更新的分段索引"""
+        self._ensure_initialized()
+        if isinstance(self.bm25, BM25SegmentedIndex):
+            return self.bm25
+        if self._corpus is None:
+            raise ValueError("BM25检索器缺少分词语料，无法转换为二进制索引")
+        index = BM25BinaryIndex.from_corpus(
+            self._corpus, k1=self.k1, b=self.b, epsilon=self.epsilon, bm25_type=self.bm25_type
+        )
+        self.bm25 = BM25SegmentedIndex.from_index(index, self._nodes)
+        return self.bm25
+
+    def add_nodes(self, nodes: List[BaseNode]) -> int:
+        """
+        增量追加节点：只对新节点分词并作为新段加入索引，同一文档的旧节点会被标记删除。
+        返回被替换的旧节点数。
+        """
+        index = self._ensure_segmented()
+        replaced = index.add(self._tokenize_nodes(nodes), nodes)
+        self._nodes = index.nodes
+        self._corpus = None
+        return replaced
+
+    def delete_nodes(self, node_ids: List[str]) -> int:
+        """按节点ID删除节点（墓碑标记，压缩时才真正移除），返回删除数量"""
+        index = self._ensure_segmented()
+        deleted = index.delete(node_ids)
+        self._nodes = index.nodes
+        return deleted
+
+    def compact(self):
+        """合并所有段并移除已删除节点"""
+        index = self._ensure_segmented().compacted()
+        self.bm25 = index
+        self._nodes = index.nodes
+
+    def save_to_binary_index(self, index_dir: str):
+        """
+        保存为二进制索引目录（CSR倒排表 + 节点数据），可通过 from_binary_index 以memmap方式加载。
+        若索引本身就是从该目录加载的，只写入新增的段和清单。
+        """
+        if not self._initialized:
+            raise ValueError("BM25检索器未初始化，无法保存")
+        
+        index = self._ensure_segmented()
+        index.save(
+            index_dir,
+            extra_meta={
+                'stopwords': list(self.stopwords or []),
+                'similarity_top_k': self.similarity_top_k,
+                'embed_type': self.embed_type,
+            }
+        )
+        self._nodes = index.nodes
+
+    @classmethod
+    def from_binary_index(
+        cls,
+        index_dir: str,
+        tokenizer: Optional[Callable[[str], List[str]]] = None,
+        stopwords: List[str] = None,
+        similarity_top_k: int = DEFAULT_SIMILARITY_TOP_K,
+    ) -> "BM25Retriever":
+        """
+        从二进制索引目录加载BM25检索器。倒排表和节点数据通过memmap映射，
+        启动几乎不需要计算，多个进程通过页缓存共享索引内存。
+        """
+        start_time = time.time()
+        meta = read_index_meta(index_dir)
+        
+        if tokenizer is None:
+            import jieba
+            tokenizer = jieba
+        
+        index = BM25SegmentedIndex.load(index_dir)
+        instance = cls(
+            nodes=index.nodes,
+            tokenizer=tokenizer,
+            stopwords=stopwords if stopwords is not None else meta.get('stopwords', []),
+            similarity_top_k=similarity_top_k if similarity_top_k != DEFAULT_SIMILARITY_TOP_K else meta.get('similarity_top_k', similarity_top_k),
+            embed_type=meta.get('embed_type', 0),
+            bm25_type=meta['bm25_type'],
+            fast_mode=True,
+            lazy_init=True
+        )
+        instance.k1 = meta['k1']
+        instance.b = meta['b']
+        instance.epsilon = meta['epsilon']
+        instance.bm25 = index
+        instance._initialized = True
         
+        logger.info(
+            f"BM25二进制索引已从 {index_dir} 加载，段数: {len(index.segments)}，文档数: {index.corpus_size}，"
+            f"已删除: {index.num_deleted}，耗时: {time.time() - start_time:.2f}秒"
+        )
         return instance
 
 
@@ -530,6 +677,8 @@ class ElasticsearchRetriever(BaseRetriever):
         es_port: int = 9200, 
         similarity_top_k: int = 10,
         callback_manager: Optional[CallbackManager] = None,
+        request_timeout: Optional[float] = None,
+        wildcard_acceleration: bool = True,
     ):
         """
         初始化Elasticsearch检索器。
@@ -539,9 +688,13 @@ class ElasticsearchRetriever(BaseRetriever):
             es_host (str): Elasticsearch主机名。
             es_port (int): Elasticsearch端口号。
             similarity_top_k (int): 返回结果的数量。
+            request_timeout (float): 异步检索的单次请求超时（秒），默认使用共享客户端的设置。
+            wildcard_acceleration (bool): 索引带wildcard子字段时是否使用单子句通配符查询计划。
         """
         self.index_name = index_name
         self.similarity_top_k = similarity_top_k
+        self.request_timeout = request_timeout
+        self._wildcard_acceleration = wildcard_acceleration
         try:
             self.es_client = Elasticsearch([{'host': es_host, 'port': es_port, 'scheme': 'http'}])
             if not self.es_client.ping():
@@ -549,12 +702,64 @@ class ElasticsearchRetriever(BaseRetriever):
         except Exception as e:
             logger.error(f"无法连接到Elasticsearch: {e}")
             self.es_client = None
+        # 同步客户端不可用时先按未加速处理，首次异步检索时再用共享客户端检测
+        self._wildcard_detected = False
+        self.wildcard_accelerated = self._detect_wildcard_fields()
 
         super().__init__(callback_manager=callback_manager)
 
+    def _build_query(self, query: str) -> Dict[str, Any]:
+        """根据查询字符串构建ES查询体，通配符查询按索引是否带wildcard子字段选择查询计划"""
+        return build_es_query(query, accelerated=self.wildcard_accelerated)
+
+    def _detect_wildcard_fields(self) -> bool:
+        """检查索引映射中是否有wildcard子字段（旧索引没有时回退到多子句展开）"""
+        if not self._wildcard_acceleration:
+            self._wildcard_detected = True
+            return False
+        if self.es_client is None:
+            return False
+        try:
+            mapping = self.es_client.indices.get_mapping(index=self.index_name)
+            self._wildcard_detected = True
+            return has_wildcard_fields(getattr(mapping, "body", mapping), self.index_name)
+        except Exception as e:
+            logger.warning(f"读取Elasticsearch索引映射失败: {e}")
+            return False
+
+    async def _adetect_wildcard_fields(self, client):
+        """构造时未能检测时，用共享的异步客户端补做一次检测"""
+        try:
+            mapping = await client.indices.get_mapping(index=self.index_name)
+        except Exception as e:
+            logger.warning(f"读取Elasticsearch索引映射失败: {e}")
+            return
+        self._wildcard_detected = True
+        self.wildcard_accelerated = has_wildcard_fields(getattr(mapping, "body", mapping), self.index_name)
+
+    @staticmethod
+    def _to_nodes(response: Dict[str, Any]) -> List[NodeWithScore]:
+        """将ES响应转换为节点列表"""
+        nodes_with_scores = []
+        for hit in response['hits']['hits']:
+            source = hit['_source']
+            node = IndexNode(
+                text=source.get('content', ''),
+                index_id=hit['_id'],  # 添加必需的 index_id 字段
+                metadata={
+                    'title': source.get('title', ''),
+                    'original_url': source.get('original_url', ''),
+                    'publish_time': source.get('publish_time'),
+                    'pagerank_score': source.get('pagerank_score', 0.0),  # 添加PageRank分数
+                    'platform': source.get('platform', ''),  # 添加数据源信息
+                }
+            )
+            nodes_with_scores.append(NodeWithScore(node=node, score=hit['_score']))
+        return nodes_with_scores
+
     def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
         """
-        使用通配符查询在Elasticsearch中搜索。
+        使用通配符查询在Elasticsearch中搜索（同步客户端）。
 
         Args:
             query_bundle (QueryBundle): 包含查询字符串。
@@ -564,137 +769,38 @@ class ElasticsearchRetriever(BaseRetriever):
         """
         if not self.es_client:
             return []
-            
-        query = query_bundle.query_str
-        
-        # 构建通配符查询
-        if '*' in query or '?' in query:
-            should_queries = []
-            
-            # 策略1: 在keyword字段中使用通配符（用于精确匹配完整标题）
-            should_queries.extend([
-                {"wildcard": {"title.keyword": {"value": query, "case_insensitive": True}}},
-                {"wildcard": {"content.keyword": {"value": query, "case_insensitive": True}}}
-            ])
-            
-            # 策略2: 在text字段中使用通配符
-            should_queries.extend([
-                {"wildcard": {"title": {"value": query, "case_insensitive": True}}},
-                {"wildcard": {"content": {"value": query, "case_insensitive": True}}}
-            ])
-            
-            # 策略3: 对于简单的前缀后缀匹配，拆分查询
-            if '*' in query:
-                # 处理前缀匹配 如: "南开*"
-                if query.endswith('*') and '*' not in query[:-1]:
-                    prefix = query[:-1]
-                    should_queries.extend([
-                        {"prefix": {"title": {"value": prefix, "case_insensitive": True}}},
-                        {"prefix": {"content": {"value": prefix, "case_insensitive": True}}}
-                    ])
-                
-                # 处理后缀匹配 如: "*大学"
-                elif query.startswith('*') and '*' not in query[1:]:
-                    suffix = query[1:]
-                    should_queries.extend([
-                        {"suffix": {"title": {"value": suffix, "case_insensitive": True}}},
-                        {"suffix": {"content": {"value": suffix, "case_insensitive": True}}}
-                    ])
-                
-                # 处理中间匹配 如: "南开*大学" 
-                elif query.count('*') == 1 and not query.startswith('*') and not query.endswith('*'):
-                    parts = query.split('*')
-                    if len(parts) == 2:
-                        prefix, suffix = parts
-                        # 需要同时包含前缀和后缀
-                        should_queries.append({
-                            "bool": {
-                                "must": [
-                                    {"prefix": {"title": {"value": prefix, "case_insensitive": True}}},
-                                    {"suffix": {"title": {"value": suffix, "case_insensitive": True}}}
-                                ]
-                            }
-                        })
-                        should_queries.append({
-                            "bool": {
-                                "must": [
-                                    {"prefix": {"content": {"value": prefix, "case_insensitive": True}}},
-                                    {"suffix": {"content": {"value": suffix, "case_insensitive": True}}}
-                                ]
-                            }
-                        })
-            
-            # 策略4: 对于?查询，转换为模糊查询或者更宽泛的匹配
-            if '?' in query:
-                # 将?替换为空，做包含查询作为备选
-                query_without_wildcards = query.replace('?', '').replace('*', '')
-                if query_without_wildcards:
-                    should_queries.extend([
-                        {"match": {"title": {"query": query_without_wildcards, "fuzziness": "AUTO"}}},
-                        {"match": {"content": {"query": query_without_wildcards, "fuzziness": "AUTO"}}}
-                    ])
-            
-            # 策略5: query_string作为最后的尝试
-            should_queries.append({
-                "query_string": {
-                    "query": query,
-                    "fields": ["title", "content"],
-                    "allow_leading_wildcard": True,
-                    "analyze_wildcard": True,
-                    "lenient": True
-                }
-            })
-            
-            es_query = {
-                "query": {
-                    "bool": {
-                        "should": should_queries,
-                        "minimum_should_match": 1
-                    }
-                }
-            }
-        else:
-            # 如果没有通配符，使用普通的匹配查询，指定使用ik_smart分析器
-            es_query = {
-                "query": {
-                    "bool": {
-                        "should": [
-                            {"match": {"title": {"query": query, "analyzer": "ik_smart", "boost": 2.0}}},
-                            {"match": {"content": {"query": query, "analyzer": "ik_smart", "boost": 1.0}}}
-                        ],
-                        "minimum_should_match": 1
-                    }
-                }
-            }
-
         try:
             response = self.es_client.search(
                 index=self.index_name,
-                body=es_query,
+                body=self._build_query(query_bundle.query_str),
                 size=self.similarity_top_k
             )
-            
-            nodes_with_scores = []
-            for hit in response['hits']['hits']:
-                source = hit['_source']
-                node = IndexNode(
-                    text=source.get('content', ''),
-                    index_id=hit['_id'],  # 添加必需的 index_id 字段
-                    metadata={
-                        'title': source.get('title', ''),
-                        'original_url': source.get('original_url', ''),
-                        'publish_time': source.get('publish_time'),
-                        'pagerank_score': source.get('pagerank_score', 0.0),  # 添加PageRank分数
-                        'platform': source.get('platform', ''),  # 添加数据源信息
-                    }
-                )
-                nodes_with_scores.append(NodeWithScore(node=node, score=hit['_score']))
-            
-            return nodes_with_scores
+            return self._to_nodes(response)
         except Exception as e:
             logger.error(f"Elasticsearch搜索出错: {e}")
             return []
 
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        """使用应用级共享的AsyncElasticsearch客户端检索，不占用事件循环线程"""
+        from etl.retrieval.es_client import es_search, get_es_client
+        client = get_es_client()
+        if client is None:
+            # 未初始化共享客户端（如离线脚本），在线程池中走同步路径
+            return await asyncio.to_thread(self._retrieve, query_bundle)
+        if not self._wildcard_detected:
+            await self._adetect_wildcard_fields(client)
+        try:
+            response = await es_search(
+                self.index_name,
+                self._build_query(query_bundle.query_str),
+                timeout=self.request_timeout,
+                size=self.similarity_top_k
+            )
+            return self._to_nodes(response)
+        except Exception as e:
+            logger.error(f"Elasticsearch异步搜索出错: {e}")
+            return []
+
 
 class HybridRetriever(BaseRetriever):
     def __init__(
@@ -704,6 +810,9 @@ class HybridRetriever(BaseRetriever):
             retrieval_type=1,
             topk=256,
             pagerank_weight=0.1,
+            dense_timeout: float = 10.0,
+            sparse_timeout: float = 10.0,
+            max_workers: int = 8,
     ):
         self.dense_retriever = dense_retriever
         self.sparse_retriever = sparse_retriever
@@ -712,6 +821,13 @@ class HybridRetriever(BaseRetriever):
         self.filter_dict = None
         self.topk = topk
         self.pagerank_weight = pagerank_weight
+        # 每个分支独立超时，超时或失败的分支降级为空结果
+        self.dense_timeout = dense_timeout
+        self.sparse_timeout = sparse_timeout
+        # 同步路径下两路检索使用的线程池（跨请求共享）
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hybrid_retriever")
+        # 最近一次查询的分支耗时，便于上层读取和监控
+        self.last_branch_timings: Dict[str, Any] = {}
         super().__init__()
 
     @classmethod
@@ -777,6 +893,71 @@ class HybridRetriever(BaseRetriever):
             
         return reranked_nodes[:min(topk, len(reranked_nodes))]
 
+    def _fuse_branches(self, sparse_nodes: List[NodeWithScore], dense_nodes: List[NodeWithScore]) -> List[NodeWithScore]:
+        """融合两路检索结果，任一路为空时降级为另一路"""
+        if not dense_nodes and sparse_nodes:
+            logger.warning(f"向量检索无结果，降级使用BM25检索，返回{len(sparse_nodes)}个结果")
+            return sparse_nodes
+        if not sparse_nodes and dense_nodes:
+            logger.warning(f"BM25检索无结果，降级使用向量检索，返回{len(dense_nodes)}个结果")
+            return dense_nodes
+        if not sparse_nodes and not dense_nodes:
+            logger.warning("BM25和向量检索都返回0结果")
+            return []
+
+        # 正常混合检索：使用 reciprocal rank fusion 合并结果
+        return self.reciprocal_rank_fusion(
+            [sparse_nodes, dense_nodes],
+            topk=self.topk,
+            pagerank_weight=self.pagerank_weight
+        )
+
+    def _report_timings(self, query_str: str, timings: Dict[str, Any], total: float, fused_count: int):
+        timings["total"] = total
+        timings["fused"] = fused_count
+        self.last_branch_timings = timings
+        logger.info(
+            f"混合检索耗时: dense={timings['dense']['time']:.3f}s({timings['dense']['status']}, {timings['dense']['count']}条), "
+            f"sparse={timings['sparse']['time']:.3f}s({timings['sparse']['status']}, {timings['sparse']['count']}条), "
+            f"total={total:.3f}s, 融合后{fused_count}条, query='{query_str}'"
+        )
+
+    async def _aretrieve_branch(self, name: str, coro, timeout: float):
+        """执行单个分支的异步检索，返回(结果, 耗时信息)"""
+        start = time.perf_counter()
+        try:
+            nodes = await asyncio.wait_for(coro, timeout=timeout)
+            status = "ok"
+        except asyncio.TimeoutError:
+            logger.warning(f"{name}检索超时（>{timeout}秒），该分支降级为空结果")
+            nodes, status = [], "timeout"
+        except Exception as e:
+            logger.error(f"{name}检索失败: {e}")
+            nodes, status = [], "error"
+        nodes = nodes or []
+        return nodes, {"time": time.perf_counter() - start, "status": status, "count": len(nodes)}
+
+    def _retrieve_branch(self, name: str, future, timeout: float, start: float):
+        """等待单个分支的同步检索结果，返回(结果, 耗时信息)"""
+        try:
+            nodes, elapsed = future.result(timeout=max(0.0, timeout - (time.perf_counter() - start)))
+            status = "ok"
+        except FutureTimeoutError:
+            logger.warning(f"{name}检索超时（>{timeout}秒），该分支降级为空结果")
+            future.cancel()
+            nodes, status, elapsed = [], "timeout", time.perf_counter() - start
+        except Exception as e:
+            logger.error(f"{name}检索失败: {e}")
+            nodes, status, elapsed = [], "error", time.perf_counter() - start
+        nodes = nodes or []
+        return nodes, {"time": elapsed, "status": status, "count": len(nodes)}
+
+    @staticmethod
+    def _timed_call(fn, query_bundle: QueryBundle):
+        start = time.perf_counter()
+        nodes = fn(query_bundle)
+        return nodes, time.perf_counter() - start
+
     async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
         try:
             if self.retrieval_type == 2:
@@ -793,26 +974,36 @@ class HybridRetriever(BaseRetriever):
             self.sparse_retriever.filter_dict = self.filter_dict
             self.dense_retriever.filters = self.filters
             
-            # 并行执行两个检索
-            sparse_nodes = await self.sparse_retriever.aretrieve(query_bundle)
-            dense_nodes = await self.dense_retriever.aretrieve(query_bundle)
-            
-            # 使用 reciprocal rank fusion 合并结果
-            all_nodes = self.reciprocal_rank_fusion(
-                [sparse_nodes, dense_nodes], 
-                topk=self.topk,
-                pagerank_weight=self.pagerank_weight
+            # 并行执行两个检索：BM25为CPU密集的同步实现，放到线程中避免阻塞事件循环
+            start = time.perf_counter()
+            (sparse_nodes, sparse_timing), (dense_nodes, dense_timing) = await asyncio.gather(
+                self._aretrieve_branch(
+                    "BM25", asyncio.to_thread(self.sparse_retriever._retrieve, query_bundle), self.sparse_timeout
+                ),
+                self._aretrieve_branch(
+                    "向量", self.dense_retriever.aretrieve(query_bundle), self.dense_timeout
+                ),
             )
             
+            all_nodes = self._fuse_branches(sparse_nodes, dense_nodes)
+            self._report_timings(
+                query_bundle.query_str,
+                {"dense": dense_timing, "sparse": sparse_timing},
+                time.perf_counter() - start,
+                len(all_nodes)
+            )
             return all_nodes
             
         except Exception as e:
-            print(f"Error in hybrid retrieval: {str(e)}")
+            logger.error(f"Error in hybrid retrieval: {str(e)}")
             # 返回空列表而不是失败
             return []
 
-    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
-        """Synchronous version with intelligent fallback."""
+    def _retrieve(self, query_bundle: QueryBundle, filters=None) -> List[NodeWithScore]:
+        """Synchronous version with intelligent fallback. filters 为本次调用的Qdrant过滤器"""
+        dense_retrieve = self.dense_retriever._retrieve
+        if filters is not None:
+            dense_retrieve = functools.partial(dense_retrieve, filters=filters)
         try:
             if self.retrieval_type == 2:
                 # BM25只进行同步检索
@@ -821,44 +1012,33 @@ class HybridRetriever(BaseRetriever):
                 
             if self.retrieval_type == 1:
                 # 向量检索
-                dense_nodes = self.dense_retriever._retrieve(query_bundle)
+                dense_nodes = dense_retrieve(query_bundle)
                 return dense_nodes
 
-            # Hybrid retrieval (type 3) - 智能混合检索
-            # 同步执行两个检索
-            sparse_nodes = self.sparse_retriever._retrieve(query_bundle)
-            dense_nodes = self.dense_retriever._retrieve(query_bundle)
-            
-            # 智能降级策略
-            if not dense_nodes and sparse_nodes:
-                # 向量检索失败，降级到BM25检索
-                print(f"向量检索返回0结果，降级使用BM25检索，返回{len(sparse_nodes)}个结果")
-                return sparse_nodes
-            elif not sparse_nodes and dense_nodes:
-                # BM25检索失败，降级到向量检索
-                print(f"BM25检索返回0结果，降级使用向量检索，返回{len(dense_nodes)}个结果")
-                return dense_nodes
-            elif not sparse_nodes and not dense_nodes:
-                # 两个都失败
-                print("BM25和向量检索都返回0结果")
-                return []
-            
-            # 正常混合检索：使用 reciprocal rank fusion 合并结果
-            all_nodes = self.reciprocal_rank_fusion(
-                [sparse_nodes, dense_nodes], 
-                topk=self.topk,
-                pagerank_weight=self.pagerank_weight
+            # Hybrid retrieval (type 3) - 两路检索在线程池中并发执行，总耗时约为max(dense, sparse)
+            start = time.perf_counter()
+            sparse_future = self._executor.submit(self._timed_call, self.sparse_retriever._retrieve, query_bundle)
+            dense_future = self._executor.submit(self._timed_call, dense_retrieve, query_bundle)
+
+            sparse_nodes, sparse_timing = self._retrieve_branch("BM25", sparse_future, self.sparse_timeout, start)
+            dense_nodes, dense_timing = self._retrieve_branch("向量", dense_future, self.dense_timeout, start)
+
+            # 智能降级策略 + reciprocal rank fusion
+            all_nodes = self._fuse_branches(sparse_nodes, dense_nodes)
+            self._report_timings(
+                query_bundle.query_str,
+                {"dense": dense_timing, "sparse": sparse_timing},
+                time.perf_counter() - start,
+                len(all_nodes)
             )
-            
-            print(f"混合检索：BM25返回{len(sparse_nodes)}个结果，向量返回{len(dense_nodes)}个结果，融合后{len(all_nodes)}个结果")
             return all_nodes
             
         except Exception as e:
-            print(f"Error in hybrid retrieval: {str(e)}")
+            logger.error(f"Error in hybrid retrieval: {str(e)}")
             # 尝试降级到BM25检索作为最后的备选
             try:
                 fallback_nodes = self.sparse_retriever._retrieve(query_bundle)
-                print(f"异常降级到BM25检索，返回{len(fallback_nodes)}个结果")
+                logger.warning(f"异常降级到BM25检索，返回{len(fallback_nodes)}个结果")
                 return fallback_nodes
             except:
                 return []
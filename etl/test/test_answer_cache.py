@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+语义答案缓存（SemanticAnswerCache）测试
+"""
+
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parent.parent.parent))
+
+np = pytest.importorskip("numpy")
+
+from etl.rag.answer_cache import ALL_SOURCES, SemanticAnswerCache, _InvalidationLog, source_keys
+
+
+def _cache(**kwargs) -> SemanticAnswerCache:
+    params = {"max_size": 4, "threshold": 0.9, "ttl": 100}
+    params.update(kwargs)
+    return SemanticAnswerCache(**params)
+
+
+def test_hit_on_similar_query_and_miss_on_other_scope():
+    cache = _cache()
+    cache.put([1.0, 0.0, 0.0], "hybrid|bge", "图书馆几点开门", {"answer": "8:00"}, ["u1"])
+
+    hit = cache.lookup([0.98, 0.1, 0.0], "hybrid|bge")
+    assert hit is not None
+    result, similarity = hit
+    assert result == {"answer": "8:00"} and similarity > 0.9
+
+    assert cache.lookup([0.98, 0.1, 0.0], "bm25|bge") is None
+    assert cache.lookup([0.0, 1.0, 0.0], "hybrid|bge") is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 2
+
+
+def test_expired_nearest_neighbour_does_not_hide_valid_entry():
+    """最近邻已过期时仍能命中未过期的次近邻"""
+    cache = _cache()
+    cache.put([1.0, 0.0, 0.0], "s", "q1", {"answer": "old"}, ["u1"])
+    cache.put([0.95, 0.3, 0.0], "s", "q2", {"answer": "new"}, ["u2"])
+    expired_slot = next(slot for slot, entry in cache._entries.items() if entry["query"] == "q1")
+    cache._entries[expired_slot]["created_at"] = time.time() - 1000
+    cache._created[expired_slot] = time.time() - 1000
+
+    hit = cache.lookup([1.0, 0.0, 0.0], "s")
+    assert hit is not None and hit[0] == {"answer": "new"}
+    assert cache.stats()["size"] == 1
+
+
+def test_invalidate_by_source():
+    cache = _cache()
+    cache.put([1.0, 0.0], "s", "q1", {"answer": "a"}, ["https://a", "node-1"])
+    cache.put([0.0, 1.0], "s", "q2", {"answer": "b"}, ["https://b"])
+
+    assert cache.invalidate_sources(["node-1"]) == 1
+    assert cache.lookup([1.0, 0.0], "s") is None
+    assert cache.lookup([0.0, 1.0], "s") is not None
+
+    assert cache.invalidate_sources() == 1
+    assert cache.stats()["size"] == 0
+
+
+def test_evicts_least_recently_hit_when_full():
+    cache = _cache(max_size=2)
+    cache.put([1.0, 0.0, 0.0], "s", "q1", {"answer": "1"}, [])
+    cache.put([0.0, 1.0, 0.0], "s", "q2", {"answer": "2"}, [])
+    assert cache.lookup([1.0, 0.0, 0.0], "s") is not None
+
+    cache.put([0.0, 0.0, 1.0], "s", "q3", {"answer": "3"}, [])
+    assert cache.lookup([1.0, 0.0, 0.0], "s") is not None
+    assert cache.lookup([0.0, 1.0, 0.0], "s") is None
+    assert cache.lookup([0.0, 0.0, 1.0], "s") is not None
+
+
+def test_dimension_change_resets_index():
+    cache = _cache()
+    cache.put([1.0, 0.0], "s", "q1", {"answer": "a"}, [])
+    assert cache.lookup([1.0, 0.0, 0.0], "s") is None
+    cache.put([1.0, 0.0, 0.0], "s", "q1", {"answer": "b"}, [])
+    assert cache.stats()["size"] == 1
+    assert cache.lookup([1.0, 0.0, 0.0], "s")[0] == {"answer": "b"}
+
+
+def test_invalidation_log_applies_across_instances(tmp_path):
+    """其他进程写入的失效记录在下次查询时生效"""
+    log = _InvalidationLog(tmp_path / "invalidations.sqlite")
+    cache = _cache(invalidation_log=log, invalidation_interval=0)
+    cache.put([1.0, 0.0], "s", "q1", {"answer": "a"}, ["https://a"])
+    cache.put([0.0, 1.0], "s", "q2", {"answer": "b"}, ["https://b"])
+
+    _InvalidationLog(tmp_path / "invalidations.sqlite").append(["https://a"])
+    assert cache.lookup([1.0, 0.0], "s") is None
+    assert cache.lookup([0.0, 1.0], "s") is not None
+
+    log.append([ALL_SOURCES])
+    assert cache.lookup([0.0, 1.0], "s") is None
+
+
+def test_source_keys():
+    assert source_keys({"original_url": "https://a"}, "n1") == ["https://a", "n1"]
+    assert source_keys({"url": "https://b"}) == ["https://b"]
+    assert source_keys(None) == []
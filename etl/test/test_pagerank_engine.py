@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+稀疏矩阵PageRank引擎测试：与 nx.pagerank 的结果对比
+"""
+
+import random
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parent.parent.parent))
+
+nx = pytest.importorskip("networkx")
+
+from etl.pagerank.engine import LinkGraph, compute_pagerank, power_iteration
+
+
+def _random_links(num_nodes: int, num_edges: int, seed: int = 0):
+    """生成无重复、无自环的随机链接，部分节点没有出链（悬挂节点）"""
+    rng = random.Random(seed)
+    urls = [f"https://www.nankai.edu.cn/page/{i}" for i in range(num_nodes)]
+    links = set()
+    while len(links) < num_edges:
+        source, target = rng.sample(urls, 2)
+        # 最后一成节点只作为目标出现
+        if urls.index(source) >= num_nodes * 0.9:
+            continue
+        links.add((source, target))
+    return sorted(links)
+
+
+def _assert_matches_networkx(links, alpha=0.85):
+    graph = LinkGraph.from_links(links)
+    scores = compute_pagerank(graph, alpha=alpha, max_iter=200, tol=1e-10)
+
+    expected = nx.pagerank(nx.DiGraph(links), alpha=alpha, max_iter=200, tol=1e-10)
+    assert set(scores) == set(expected)
+    for url, score in expected.items():
+        assert scores[url] == pytest.approx(score, abs=1e-8)
+
+
+def test_power_iteration_matches_networkx():
+    """随机图（含悬挂节点）上与 nx.pagerank 一致"""
+    _assert_matches_networkx(_random_links(300, 1500))
+
+
+def test_power_iteration_matches_networkx_other_alpha():
+    _assert_matches_networkx(_random_links(120, 400, seed=7), alpha=0.6)
+
+
+def test_scores_sum_to_one_and_converge():
+    graph = LinkGraph.from_links(_random_links(200, 800, seed=3))
+    scores, iterations = power_iteration(graph, max_iter=200, tol=1e-10)
+    assert scores.sum() == pytest.approx(1.0, abs=1e-9)
+    assert iterations < 200
+
+
+def test_warm_start_converges_to_same_scores():
+    """新增少量链接后以上一次的分数作为初始向量，收敛到相同结果且迭代更少"""
+    links = _random_links(200, 800, seed=5)
+    graph = LinkGraph.from_links(links)
+    cold, cold_iterations = power_iteration(graph, tol=1e-10, max_iter=200)
+    previous = dict(zip(graph.urls, cold.tolist()))
+
+    new_links = links + [("https://www.nankai.edu.cn/new", graph.urls[0])]
+    _assert_matches_networkx(new_links)
+
+    new_graph = LinkGraph.from_links(new_links)
+    initial = [previous.get(url, 1.0 / new_graph.num_nodes) for url in new_graph.urls]
+    warm, warm_iterations = power_iteration(new_graph, tol=1e-10, max_iter=200, initial=initial)
+    cold_new, _ = power_iteration(new_graph, tol=1e-10, max_iter=200)
+    assert warm == pytest.approx(cold_new, abs=1e-8)
+    assert warm_iterations < cold_iterations
+
+
+def test_empty_graph():
+    scores, iterations = power_iteration(LinkGraph())
+    assert scores.size == 0 and iterations == 0
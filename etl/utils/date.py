@@ -1,3 +1,7 @@
+from datetime import datetime, timezone
+from typing import Optional
+
+
 def parse_date(date_str: str) -> 'datetime':
     """将字符串解析为日期对象，支持多种常见格式和相对日期"""
     import re
@@ -36,4 +40,29 @@ def parse_date(date_str: str) -> 'datetime':
         crawler_logger.warning(f"无法解析日期格式: {date_str}，使用当前日期")
     except Exception:
         pass
-    return today 
\ No newline at end of file
+    return today 
+
+
+def parse_datetime_utc(time_str: str) -> 'Optional[datetime]':
+    """将字符串稳健地解析为带UTC时区的时间对象"""
+    if not time_str or not isinstance(time_str, str):
+        return None
+    try:
+        # 尝试ISO 8601格式（带或不带'Z'）
+        if time_str.endswith("Z"):
+            time_str = time_str[:-1] + "+00:00"
+        dt = datetime.fromisoformat(time_str)
+        return dt.astimezone(timezone.utc)
+    except (ValueError, TypeError):
+        pass
+
+    # 尝试其他常见格式
+    formats_to_try = ["%Y-%m-%d %H:%M:%S", "%Y-%m-%d"]
+    for fmt in formats_to_try:
+        try:
+            dt = datetime.strptime(time_str, fmt)
+            # 假定为本地时区并转换为UTC
+            return dt.astimezone().astimezone(timezone.utc)
+        except ValueError:
+            continue
+    return None
@@ -0,0 +1,194 @@
+"""
+原始数据文件清单
+
+daily_pipeline 查找时间窗口内的新文件时，原先需要遍历目标年月目录并打开、完整解析每个JSON
+只为读取 publish_time。RawFileManifest 在sqlite中维护每个原始文件的
+(路径, mtime, 大小, 发布时间, 平台, 内容哈希)：
+
+    record       爬虫写入文件后登记一条记录（不重复读取文件）
+    refresh      扫描目录，只对新增或 mtime/大小 变化的文件重新解析，并删除已不存在的文件
+    query        按发布时间范围查询，走 publish_time 索引的范围扫描
+
+配置项（etl.data.raw_manifest.*）：
+    enabled    是否启用，默认True；关闭时 daily_pipeline 回退为逐个解析文件
+    path       sqlite文件路径，默认 CACHE_PATH/manifest/raw_files.sqlite
+    workers    refresh 时解析文件的线程数，默认8
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+from config import Config
+from core.utils.logger import register_logger
+from etl import CACHE_PATH
+from etl.utils.date import parse_datetime_utc
+
+logger = register_logger("etl.utils.raw_manifest")
+config = Config()
+
+
+def _walk_json_files(root: Path) -> Iterable[Tuple[str, os.stat_result]]:
+    """递归列出目录下的JSON文件及其stat信息（只stat，不打开文件）"""
+    stack = [str(root)]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name.endswith(".json") and entry.is_file():
+                        yield entry.path, entry.stat()
+        except OSError as e:
+            logger.warning(f"扫描目录失败: {e}")
+
+
+class RawFileManifest:
+    """原始JSON文件清单（sqlite）"""
+
+    def __init__(self, path: Union[str, Path, None] = None):
+        self.path = Path(path) if path else CACHE_PATH / "manifest" / "raw_files.sqlite"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS raw_files ("
+            "path TEXT PRIMARY KEY, mtime REAL NOT NULL, size INTEGER NOT NULL, "
+            "publish_time REAL, platform TEXT, content_hash TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_raw_files_publish_time ON raw_files (publish_time)")
+        self._conn.commit()
+
+    @staticmethod
+    def _parse(path: str, st: os.stat_result, data: Optional[Dict[str, Any]] = None) -> Tuple:
+        """解析文件得到一行记录；无法解析的文件发布时间记为NULL，直到文件再次变化前不会重复解析"""
+        if data is None:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except Exception:
+                data = None
+
+        publish_time = platform = content_hash = None
+        if isinstance(data, dict):
+            dt = parse_datetime_utc(data.get("publish_time"))
+            publish_time = dt.timestamp() if dt else None
+            platform = data.get("platform")
+            content_hash = hashlib.sha1(str(data.get("content") or "").encode("utf-8")).hexdigest()
+        return path, st.st_mtime, st.st_size, publish_time, platform, content_hash
+
+    def _upsert(self, rows: List[Tuple]):
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO raw_files (path, mtime, size, publish_time, platform, content_hash) "
+                "VALUES (?, ?, ?, ?, ?, ?)", rows
+            )
+            self._conn.commit()
+
+    def record(self, path: Union[str, Path], data: Optional[Dict[str, Any]] = None):
+        """登记一个刚写入的文件；data为已写入的内容时不再读取文件"""
+        path = os.path.abspath(str(path))
+        try:
+            self._upsert([self._parse(path, os.stat(path), data)])
+        except Exception as e:
+            logger.warning(f"登记文件清单失败 {path}: {e}")
+
+    def refresh(self, roots: Iterable[Union[str, Path]], workers: Optional[int] = None) -> Dict[str, int]:
+        """
+        扫描目录并增量更新清单
+
+        Args:
+            roots: 要扫描的目录列表
+            workers: 解析变化文件的线程数
+
+        Returns:
+            扫描、重新解析和删除的文件数
+        """
+        stats = {"scanned": 0, "parsed": 0, "removed": 0}
+        workers = workers or config.get("etl.data.raw_manifest.workers", 8)
+        for root in roots:
+            root = os.path.abspath(str(root))
+            prefix = root.rstrip(os.sep) + os.sep
+            with self._lock:
+                known = {
+                    path: (mtime, size)
+                    for path, mtime, size in self._conn.execute(
+                        "SELECT path, mtime, size FROM raw_files WHERE substr(path, 1, ?) = ?",
+                        (len(prefix), prefix),
+                    )
+                }
+
+            changed = []
+            for path, st in _walk_json_files(Path(root)):
+                stats["scanned"] += 1
+                if known.pop(path, None) != (st.st_mtime, st.st_size):
+                    changed.append((path, st))
+
+            if changed:
+                # 有界线程池解析，避免一次性打开大量文件
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    rows = list(executor.map(lambda item: self._parse(*item), changed))
+                for start in range(0, len(rows), 1000):
+                    self._upsert(rows[start:start + 1000])
+                stats["parsed"] += len(rows)
+
+            # 剩下的是清单中有但磁盘上已不存在的文件
+            if known:
+                with self._lock:
+                    self._conn.executemany("DELETE FROM raw_files WHERE path = ?", [(path,) for path in known])
+                    self._conn.commit()
+                stats["removed"] += len(known)
+        return stats
+
+    def query(self, start_time: datetime, end_time: datetime,
+              root: Union[str, Path, None] = None) -> List[Path]:
+        """查询发布时间在 [start_time, end_time] 内的文件，可限定在root目录下"""
+        sql = "SELECT path FROM raw_files WHERE publish_time BETWEEN ? AND ?"
+        params: List[Any] = [start_time.timestamp(), end_time.timestamp()]
+        if root is not None:
+            prefix = os.path.abspath(str(root)).rstrip(os.sep) + os.sep
+            sql += " AND substr(path, 1, ?) = ?"
+            params.extend([len(prefix), prefix])
+        with self._lock:
+            rows = self._conn.execute(sql + " ORDER BY publish_time", params).fetchall()
+        return [Path(path) for path, in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_manifest: Optional[RawFileManifest] = None
+_manifest_lock = threading.Lock()
+
+
+def get_raw_manifest() -> Optional[RawFileManifest]:
+    """获取进程内共享的原始文件清单，配置关闭或初始化失败时返回None"""
+    global _manifest
+    if not config.get("etl.data.raw_manifest.enabled", True):
+        return None
+    if _manifest is None:
+        with _manifest_lock:
+            if _manifest is None:
+                try:
+                    _manifest = RawFileManifest(config.get("etl.data.raw_manifest.path"))
+                except Exception as e:
+                    logger.warning(f"原始文件清单初始化失败: {e}")
+                    return None
+    return _manifest
+
+
+def record_raw_file(path: Union[str, Path], data: Optional[Dict[str, Any]] = None):
+    """爬虫写入原始JSON文件后调用，登记到文件清单（清单不可用时静默跳过）"""
+    manifest = get_raw_manifest()
+    if manifest is not None:
+        manifest.record(path, data)
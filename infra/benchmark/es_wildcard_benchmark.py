@@ -0,0 +1,116 @@
+"""
+Elasticsearch 通配符查询基准测试
+
+在合成的中文语料（默认20万篇）上建立两个索引并对比通配符查询延迟：
+    legacy    无wildcard子字段，多子句展开（原实现）
+    planned   title.wc/content.wc 子字段 + 按模式形状的单子句查询计划（当前实现）
+
+需要一个装有IK分词插件的Elasticsearch，测试索引在结束后删除（--keep 保留）。
+
+用法:
+    python infra/benchmark/es_wildcard_benchmark.py --host localhost --port 9200 --docs 200000 --repeat 50
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from elasticsearch import Elasticsearch, helpers
+
+sys.path.append(str(Path(__file__).resolve().parent.parent.parent))
+from etl.indexing.elasticsearch_indexer import build_index_mapping
+from etl.retrieval.es_query import build_es_query, classify_pattern
+
+VOCAB = [
+    "南开", "大学", "学院", "计算机", "软件", "网络", "安全", "人工智能", "数学", "物理",
+    "化学", "经济", "管理", "法学", "文学", "历史", "图书馆", "食堂", "宿舍", "选课",
+    "考试", "保研", "考研", "奖学金", "讲座", "社团", "志愿", "实习", "招聘", "通知",
+    "天津", "津南", "八里台", "校区", "研究生", "本科生", "教务处", "学工部", "科研", "竞赛",
+]
+
+PATTERNS = [
+    "南开*",          # prefix
+    "计算*",          # prefix
+    "*大学",          # 前导通配符
+    "*学院",          # 前导通配符
+    "南开*学院",      # 中间通配符
+    "保?",            # 单字符通配
+    "*奖学*",         # 两端通配
+]
+
+
+def make_docs(num_docs: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    vocab = np.array(VOCAB)
+    for i in range(num_docs):
+        title = "".join(vocab[rng.integers(0, len(vocab), rng.integers(2, 6))])
+        content = "".join(vocab[rng.integers(0, len(vocab), rng.integers(80, 300))])
+        yield {
+            "url": f"https://example.nankai.edu.cn/{i}",
+            "title": title,
+            "content": content,
+            "platform": "website",
+            "pagerank_score": float(rng.random()),
+        }
+
+
+def build_index(es: Elasticsearch, index: str, wildcard_acceleration: bool, num_docs: int):
+    if es.indices.exists(index=index):
+        es.indices.delete(index=index)
+    es.indices.create(index=index, body=build_index_mapping(wildcard_acceleration))
+    start = time.perf_counter()
+    helpers.bulk(es, ({"_index": index, "_source": doc} for doc in make_docs(num_docs)), chunk_size=2000)
+    es.indices.refresh(index=index)
+    es.indices.forcemerge(index=index, max_num_segments=1)
+    print(f"  {index}: 索引 {num_docs} 篇耗时 {time.perf_counter() - start:.1f}秒")
+
+
+def run(es: Elasticsearch, index: str, query: str, accelerated: bool, repeat: int, top_k: int):
+    body = build_es_query(query, accelerated=accelerated)
+    # request_cache=False 避免分片请求缓存掩盖真实耗时
+    es.search(index=index, body=body, size=top_k, request_cache=False)
+    timings = []
+    hits = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = es.search(index=index, body=body, size=top_k, request_cache=False, track_total_hits=True)
+        timings.append((time.perf_counter() - start) * 1000)
+        hits = response["hits"]["total"]["value"]
+    return np.percentile(timings, 50), np.percentile(timings, 99), hits
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Elasticsearch wildcard query benchmark")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=9200)
+    parser.add_argument("--docs", type=int, default=200_000)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--prefix", default="nkuwiki_wildcard_bench")
+    parser.add_argument("--keep", action="store_true", help="保留测试索引")
+    args = parser.parse_args()
+
+    es = Elasticsearch([f"http://{args.host}:{args.port}"], request_timeout=120)
+    legacy_index, planned_index = f"{args.prefix}_legacy", f"{args.prefix}_planned"
+
+    print(f"生成并索引 {args.docs} 篇合成文档...")
+    build_index(es, legacy_index, False, args.docs)
+    build_index(es, planned_index, True, args.docs)
+
+    try:
+        print(f"{'模式':<12}{'形状':<9}{'legacy p50/p99 (ms)':>22}{'planned p50/p99 (ms)':>24}"
+              f"{'命中 legacy/planned':>22}{'p99加速':>9}")
+        for pattern in PATTERNS:
+            legacy_p50, legacy_p99, legacy_hits = run(es, legacy_index, pattern, False, args.repeat, args.top_k)
+            new_p50, new_p99, new_hits = run(es, planned_index, pattern, True, args.repeat, args.top_k)
+            print(f"{pattern:<12}{classify_pattern(pattern):<9}{legacy_p50:>11.2f}/{legacy_p99:<10.2f}"
+                  f"{new_p50:>12.2f}/{new_p99:<11.2f}{legacy_hits:>11}/{new_hits:<10}"
+                  f"{legacy_p99 / new_p99:>8.1f}x")
+    finally:
+        if not args.keep:
+            es.indices.delete(index=[legacy_index, planned_index], ignore_unavailable=True)
+
+
+if __name__ == "__main__":
+    main()